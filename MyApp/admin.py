@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils import timezone
 from .models import (Product, StoryboardItem, RawItem, CabinetItem, Category, 
-	Order, OrderItem, UserProfile, Payment, PaymentQRCode, Invoice, InvoiceItem,
+	Order, OrderItem, UserProfile, Payment, PaymentQRCode, ProcessedBankTransaction, Invoice, InvoiceItem,
 	Review, Comment, Conversation, Message, Notification, ProductVariation, OrderStatusHistory, Coupon,
 	ReturnRequest, ReturnItem,
 	SupportTicket, SupportMessage, SupportAttachment, SupportRating,
@@ -206,6 +206,14 @@ class PaymentQRCodeAdmin(admin.ModelAdmin):
 	qr_image_preview.short_description = 'Xem trước QR Code'
 
 
+@admin.register(ProcessedBankTransaction)
+class ProcessedBankTransactionAdmin(admin.ModelAdmin):
+	list_display = ('transaction_id', 'order', 'amount', 'outcome', 'processed_at')
+	list_filter = ('outcome', 'processed_at')
+	search_fields = ('transaction_id', 'order__order_number', 'description')
+	readonly_fields = ('transaction_id', 'order', 'amount', 'description', 'outcome', 'processed_at')
+
+
 class InvoiceItemInline(admin.TabularInline):
 	model = InvoiceItem
 	extra = 0
@@ -265,8 +273,8 @@ class ConversationAdmin(admin.ModelAdmin):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-	list_display = ('conversation', 'sender', 'content_short', 'is_read', 'created_at')
-	list_filter = ('is_read', 'created_at')
+	list_display = ('conversation', 'sender', 'content_short', 'created_at')
+	list_filter = ('created_at',)
 
 	def content_short(self, obj):
 		return obj.content[:60]
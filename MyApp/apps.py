@@ -7,4 +7,13 @@ class MyappConfig(AppConfig):
 
     def ready(self):
         import MyApp.signals
+        import MyApp.search
+        import MyApp.notifications
+        import MyApp.presence
+        import MyApp.render_cache
+        import MyApp.product_stats
+        import MyApp.catalog_cache
 
+        import MyApp.support_stream
+        import MyApp.inbox
+        import MyApp.staff_fanout
@@ -0,0 +1,262 @@
+"""
+Streaming archive of old audit log entries (manage.py archive_audit_logs).
+
+The command built a list of every old AuditLog as dicts, wrote it with
+``json.dump(indent=2)`` into one gzip file and deleted everything in one
+DELETE: memory grew with the number of rows, and a crash between the dump
+and the DELETE left no record of what had been archived.
+
+Now rows are read in pages of (timestamp, log_id), the auditlog_timestamp_id
+index, each page with ``.iterator(chunk_size=...)``, and written one JSON
+object per line to gzip'd NDJSON part files:
+
+* a part is closed when its compressed size reaches ``max_bytes`` or, with
+  ``split_by_day``, when the day of the entries changes,
+* a closed part is fsynced, its SHA-256 computed from what is on disk, and
+  it is added to the run's manifest (``<run>.manifest.json``, replaced
+  atomically). Only then are its rows deleted, ``delete_batch`` at a time,
+  each batch in its own transaction, by key range, so nothing is kept per
+  row,
+* the manifest lists, per part, the row count, the first and last
+  timestamps and hashes, the size and the checksum. ``verify_manifest()``
+  reads the parts back and checks all of it, and the hash of every entry.
+
+A run that stops halfway leaves a manifest of the parts it deleted; the rows
+of the open part stay in the database and go to the next run.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .audit_models import AuditLog
+from .audit_sink import compute_hash
+
+FIELDS = (
+    'log_id', 'timestamp', 'event_type', 'severity_level', 'actor_id', 'actor_role', 'ip_address',
+    'user_agent', 'resource_type', 'resource_id', 'before_state', 'after_state', 'status', 'reason',
+    'chain_key', 'chain_seq', 'previous_hash', 'current_hash',
+)
+MANIFEST_VERSION = 1
+
+
+def _after(key):
+    """Rows after ``key`` = (timestamp, log_id) in archive order."""
+    timestamp, log_id = key
+    return Q(timestamp__gte=timestamp) & (Q(timestamp__gt=timestamp) | Q(log_id__gt=log_id))
+
+
+def _from(key):
+    timestamp, log_id = key
+    return Q(timestamp__gte=timestamp) & (Q(timestamp__gt=timestamp) | Q(log_id__gte=log_id))
+
+
+def _up_to(key):
+    timestamp, log_id = key
+    return Q(timestamp__lte=timestamp) & (Q(timestamp__lt=timestamp) | Q(log_id__lte=log_id))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Part:
+    """One gzip'd NDJSON file being written."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._raw = open(self.path, 'wb')
+        self._gzip = gzip.GzipFile(filename=name[:-3], mode='wb', fileobj=self._raw)
+        self.rows = 0
+        self.first = self.last = None  # archived entries
+        self.first_key = self.last_key = None  # their (timestamp, log_id)
+
+    @property
+    def compressed_size(self):
+        return self._raw.tell()
+
+    def write(self, entry, key):
+        self._gzip.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+        if self.first is None:
+            self.first, self.first_key = entry, key
+        self.last, self.last_key = entry, key
+        self.rows += 1
+
+    def close(self):
+        """Finish the file, make it durable and return its manifest entry."""
+        self._gzip.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        return {
+            'file': self.name,
+            'rows': self.rows,
+            'bytes': os.path.getsize(self.path),
+            'sha256': _sha256(self.path),
+            'first_timestamp': self.first['timestamp'],
+            'last_timestamp': self.last['timestamp'],
+            'first_log_id': self.first['log_id'],
+            'last_log_id': self.last['log_id'],
+            'first_hash': self.first['current_hash'],
+            'last_hash': self.last['current_hash'],
+        }
+
+
+class Archiver:
+    """Moves the audit entries older than ``before`` to part files in ``directory``."""
+
+    def __init__(self, directory, before, chunk_size=2000, delete_batch=5000, max_bytes=256 * 1024 * 1024,
+                 split_by_day=False, delete=True, log=None):
+        self.directory = directory
+        self.before = before
+        self.chunk_size = chunk_size
+        self.delete_batch = delete_batch
+        self.max_bytes = max_bytes
+        self.split_by_day = split_by_day
+        self.delete = delete
+        self.log = log or (lambda message: None)
+        self.run = f"audit_archive_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+        self.manifest_path = os.path.join(directory, f'{self.run}.manifest.json')
+        self.manifest = {
+            'version': MANIFEST_VERSION,
+            'run': self.run,
+            'before': before.isoformat(),
+            'started_at': timezone.now().isoformat(),
+            'finished_at': None,
+            'rows': 0,
+            'deleted': 0,
+            'parts': [],
+        }
+        self._part = None
+        self._closed = []  # parts whose rows are still to delete
+
+    def archive(self):
+        """Archive everything; returns the manifest."""
+        os.makedirs(self.directory, exist_ok=True)
+        old = AuditLog.objects.filter(timestamp__lt=self.before).order_by('timestamp', 'log_id')
+        key = None
+        while True:
+            page = old.filter(_after(key)) if key is not None else old
+            rows = 0
+            for values in page.values_list(*FIELDS)[:self.chunk_size].iterator(chunk_size=self.chunk_size):
+                key = (values[1], values[0])
+                self._write(dict(zip(FIELDS, values)), key)
+                rows += 1
+            # Not while the page is being read: SQLite does not isolate a DELETE from an open cursor.
+            self._delete_closed()
+            if rows < self.chunk_size:
+                break
+        if self._part is not None:
+            self._close_part()
+            self._delete_closed()
+        self.manifest['finished_at'] = timezone.now().isoformat()
+        self._save_manifest()
+        return self.manifest
+
+    def _write(self, entry, key):
+        timestamp = entry['timestamp']
+        entry['log_id'] = str(entry['log_id'])
+        entry['timestamp'] = timestamp.isoformat()
+        part = self._part
+        if part is not None and (
+            part.compressed_size >= self.max_bytes
+            or (self.split_by_day and timezone.localdate(part.first_key[0]) != timezone.localdate(timestamp))
+        ):
+            self._close_part()
+            part = None
+        if part is None:
+            number = len(self.manifest['parts']) + 1
+            day = f"_{timezone.localdate(timestamp).strftime('%Y%m%d')}" if self.split_by_day else ''
+            part = self._part = Part(self.directory, f'{self.run}{day}_part{number:04d}.ndjson.gz')
+        part.write(entry, key)
+
+    def _close_part(self):
+        part, self._part = self._part, None
+        entry = part.close()
+        self.manifest['parts'].append(entry)
+        self.manifest['rows'] += entry['rows']
+        # Recorded before anything is deleted: the manifest always covers the deleted rows.
+        self._save_manifest()
+        self.log(f"{entry['file']}: {entry['rows']} rows, {entry['bytes']} bytes")
+        if self.delete:
+            self._closed.append((entry, part.first_key, part.last_key))
+
+    def _delete_closed(self):
+        for entry, first, last in self._closed:
+            entry['deleted'] = self._delete_range(first, last)
+            self.manifest['deleted'] += entry['deleted']
+            self._save_manifest()
+        self._closed = []
+
+    def _delete_range(self, first, last):
+        """Delete the rows from key ``first`` to ``last``, ``delete_batch`` rows per transaction."""
+        rows = AuditLog.objects.filter(timestamp__lt=self.before).order_by('timestamp', 'log_id')
+        deleted = 0
+        start = _from(first)
+        while True:
+            batch = rows.filter(start & _up_to(last))
+            # The key ``delete_batch`` rows on; one range DELETE up to it, no list of ids.
+            end = batch.values_list('timestamp', 'log_id')[self.delete_batch - 1:self.delete_batch].first()
+            with transaction.atomic():
+                # QuerySet.delete() bypasses AuditLog.delete(), which refuses single deletions.
+                deleted += batch.filter(_up_to(end) if end else Q()).order_by().delete()[0]
+            if end is None:
+                return deleted
+            start = _after(end)
+
+    def _save_manifest(self):
+        temporary = self.manifest_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.manifest_path)
+
+
+def verify_manifest(path):
+    """
+    Problems found in the archive described by the manifest at ``path``: a
+    missing file, a different checksum, row count or first/last entry, or an
+    entry whose hash does not match its content. Empty when all is well.
+    """
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(path)
+    problems = []
+    for part in manifest['parts']:
+        name = part['file']
+        file_path = os.path.join(directory, name)
+        if not os.path.exists(file_path):
+            problems.append(f'{name}: missing')
+            continue
+        if _sha256(file_path) != part['sha256']:
+            problems.append(f'{name}: checksum does not match the manifest')
+        rows = 0
+        first = last = None
+        with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if compute_hash(entry['previous_hash'], entry['event_type'], entry['actor_id'],
+                                entry['resource_id']) != entry['current_hash']:
+                    problems.append(f"{name}: entry {entry['log_id']} does not match its hash")
+                if first is None:
+                    first = entry
+                last = entry
+                rows += 1
+        if rows != part['rows']:
+            problems.append(f"{name}: {rows} rows, the manifest says {part['rows']}")
+        elif rows and (first['current_hash'], last['current_hash']) != (part['first_hash'], part['last_hash']):
+            problems.append(f'{name}: first/last entries do not match the manifest')
+    total = sum(part['rows'] for part in manifest['parts'])
+    if total != manifest['rows']:
+        problems.append(f"manifest: parts hold {total} rows, the total says {manifest['rows']}")
+    return problems
@@ -67,10 +67,22 @@ class AuditLog(models.Model):
     previous_hash = models.CharField(max_length=64, blank=True, verbose_name="Mã băm liền trước")
     current_hash = models.CharField(max_length=64, blank=True, verbose_name="Mã băm hiện tại")
 
+    # Hash chain this entry belongs to and its position in it (see MyApp/audit_sink.py).
+    # Entries written before chains were sharded have chain_seq = NULL.
+    chain_key = models.CharField(max_length=100, blank=True, default='', verbose_name="Chuỗi băm")
+    chain_seq = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="Thứ tự trong chuỗi")
+
     class Meta:
         ordering = ['-timestamp']
         verbose_name = "Audit Log"
         verbose_name_plural = "Audit Logs"
+        constraints = [
+            models.UniqueConstraint(fields=['chain_key', 'chain_seq'], name='auditlog_unique_chain_seq'),
+        ]
+        indexes = [
+            # Keyset pagination of the audit log list (MyApp/pagination.py)
+            models.Index(fields=['timestamp', 'log_id'], name='auditlog_timestamp_id'),
+        ]
 
     def __str__(self):
         return f"{self.timestamp} - {self.event_type} ({self.actor_id})"
@@ -82,3 +94,19 @@ class AuditLog(models.Model):
 
     def delete(self, *args, **kwargs):
         raise ValidationError("Audit Logs are append-only. Deletion is not allowed.")
+
+
+class AuditChainHead(models.Model):
+    """Last link of each audit hash chain; locked row-by-row by writers of that chain only."""
+    chain_key = models.CharField(max_length=100, primary_key=True, verbose_name="Chuỗi băm")
+    genesis_hash = models.CharField(max_length=64, verbose_name="Mã băm khởi đầu")
+    last_hash = models.CharField(max_length=64, verbose_name="Mã băm cuối")
+    last_seq = models.PositiveBigIntegerField(default=0, verbose_name="Thứ tự cuối")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Audit Chain Head"
+        verbose_name_plural = "Audit Chain Heads"
+
+    def __str__(self):
+        return f"{self.chain_key} #{self.last_seq}"
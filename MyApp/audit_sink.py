@@ -0,0 +1,181 @@
+"""
+Batched audit log writer.
+
+Audit events used to be written one INSERT at a time, each one reading the
+newest AuditLog row to chain its hash, so every tracked save serialized on
+that row (and two concurrent workers could fork the chain).
+
+Now:
+
+* Events raised while a request is being handled are buffered (only once
+  their transaction commits) and written together when the request ends;
+  see AuditLogContextMiddleware. Code outside a request can group its
+  events with ``with audit_sink.batch(): ...``; otherwise each event is
+  written immediately, as before.
+* Every chain has an ``AuditChainHead`` row holding its last hash and
+  sequence number. A batch locks each head it touches once, computes the
+  SHA-256 links in memory and inserts the rows with ``bulk_create`` in one
+  transaction.
+* With ``AUDIT_LOG_SHARDED_CHAINS = True`` each resource type gets its own
+  chain ("Order", "Product", ...), so writers of different resource types
+  never wait on each other. By default everything goes to the "global"
+  chain, which continues from the last entry written before chains existed.
+
+Hash formula (unchanged): sha256("{previous_hash}|{event_type}|{actor_id}|{resource_id}").
+``manage.py verify_audit_chain`` re-checks every chain.
+"""
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from .audit_models import AuditLog, AuditChainHead
+
+GENESIS_HASH = '0' * 64
+GLOBAL_CHAIN = 'global'
+
+
+def compute_hash(previous_hash, event_type, actor_id, resource_id):
+    hash_content = f"{previous_hash}|{event_type}|{actor_id}|{resource_id}"
+    return hashlib.sha256(hash_content.encode('utf-8')).hexdigest()
+
+
+def chain_key_for(payload):
+    if getattr(settings, 'AUDIT_LOG_SHARDED_CHAINS', False):
+        return (payload.get('resource_type') or GLOBAL_CHAIN)[:100]
+    return GLOBAL_CHAIN
+
+
+def _lock_head(chain_key):
+    """
+    Return the chain head, locked until the end of the current transaction.
+    The UPDATE takes the row lock (and SQLite's write lock) before the head
+    is read, so two writers of one chain can never read the same last hash.
+    """
+    if AuditChainHead.objects.filter(chain_key=chain_key).update(updated_at=timezone.now()):
+        return AuditChainHead.objects.get(chain_key=chain_key)
+
+    genesis = GENESIS_HASH
+    if chain_key == GLOBAL_CHAIN:
+        # Continue the chain written before heads existed.
+        last_log = AuditLog.objects.filter(chain_seq__isnull=True).order_by('-timestamp').only('current_hash').first()
+        if last_log and last_log.current_hash:
+            genesis = last_log.current_hash
+    try:
+        with transaction.atomic():
+            AuditChainHead.objects.create(chain_key=chain_key, genesis_hash=genesis, last_hash=genesis)
+    except IntegrityError:
+        pass  # Created concurrently by another writer
+    AuditChainHead.objects.filter(chain_key=chain_key).update(updated_at=timezone.now())
+    return AuditChainHead.objects.get(chain_key=chain_key)
+
+
+def write_audit_events(payloads):
+    """Chain and insert a list of audit payloads. Returns the created AuditLog rows."""
+    if not payloads:
+        return []
+    by_chain = {}
+    for payload in payloads:
+        by_chain.setdefault(chain_key_for(payload), []).append(payload)
+
+    logs = []
+    with transaction.atomic():
+        # Fixed lock order so concurrent batches spanning several chains cannot deadlock.
+        for chain_key in sorted(by_chain):
+            head = _lock_head(chain_key)
+            previous_hash, seq = head.last_hash, head.last_seq
+            for payload in by_chain[chain_key]:
+                seq += 1
+                current_hash = compute_hash(
+                    previous_hash, payload.get('event_type'), payload.get('actor_id'), payload.get('resource_id')
+                )
+                logs.append(_build_log(payload, chain_key, seq, previous_hash, current_hash))
+                previous_hash = current_hash
+            AuditChainHead.objects.filter(chain_key=chain_key).update(last_hash=previous_hash, last_seq=seq)
+        AuditLog.objects.bulk_create(logs, batch_size=500)
+    return logs
+
+
+def _build_log(payload, chain_key, seq, previous_hash, current_hash):
+    return AuditLog(
+        event_type=payload.get('event_type'),
+        severity_level=payload.get('severity_level', 'INFO'),
+        actor_id=payload.get('actor_id'),
+        actor_role=payload.get('actor_role', ''),
+        ip_address=payload.get('ip_address'),
+        user_agent=payload.get('user_agent', ''),
+        resource_type=payload.get('resource_type', ''),
+        resource_id=payload.get('resource_id', ''),
+        before_state=payload.get('before_state', ''),
+        after_state=payload.get('after_state', ''),
+        status=payload.get('status', 'SUCCESS'),
+        reason=payload.get('reason', ''),
+        previous_hash=previous_hash,
+        current_hash=current_hash,
+        chain_key=chain_key,
+        chain_seq=seq,
+    )
+
+
+class AuditSink:
+    """Per-thread buffer of audit payloads."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def _buffer(self):
+        return getattr(self._local, 'buffer', None)
+
+    def emit(self, payload):
+        buffer = self._buffer
+        if buffer is None:
+            dispatch_audit_events([payload])
+            return
+        # Only keep events whose changes are actually committed.
+        transaction.on_commit(lambda: buffer.append(payload))
+
+    def emit_many(self, payloads):
+        """Like emit(), but outside a batch the payloads are written together."""
+        if not payloads:
+            return
+        buffer = self._buffer
+        if buffer is None:
+            dispatch_audit_events(list(payloads))
+            return
+        transaction.on_commit(lambda: buffer.extend(payloads))
+
+    @contextmanager
+    def batch(self):
+        if self._buffer is not None:
+            # Nested batch: the outermost one flushes.
+            yield
+            return
+        self._local.buffer = []
+        try:
+            yield
+        finally:
+            self.flush()
+
+    def flush(self):
+        buffer = self._buffer
+        self._local.buffer = None
+        if buffer:
+            dispatch_audit_events(buffer)
+
+
+audit_sink = AuditSink()
+
+
+def dispatch_audit_events(payloads):
+    """Write now (django-q sync mode) or hand the batch to a django-q worker."""
+    sync_mode = getattr(settings, 'Q_CLUSTER', {}).get('sync', False)
+    if sync_mode:
+        from .tasks import process_audit_batch_task
+        process_audit_batch_task(payloads)
+    else:
+        from django_q.tasks import async_task
+        async_task('MyApp.tasks.process_audit_batch_task', payloads)
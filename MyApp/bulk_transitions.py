@@ -0,0 +1,178 @@
+"""
+Chunked bulk state transitions for maintenance commands.
+
+cleanup_expired_orders called Order.action_cancel() once per order (stock
+locks, a history row, a rollup update and a notification, each its own
+query) and close_stale_tickets saved every ticket and system message one by
+one. Here a transition runs over its candidates chunk by chunk:
+
+* candidates are paged by primary key (keyset pagination: ``pk > last``), so
+  every page is an index range scan and rows leaving the queryset while we
+  work do not shift the pages,
+* each chunk is selected again with the candidate filter inside its own
+  transaction, so a row that changed since it was paged is skipped,
+* the chunk is changed with one UPDATE per table, and its history, ledger,
+  notification and message rows are inserted with bulk_create; the audit
+  events of the chunk are written together when it commits,
+* progress is logged and passed to a callback after each chunk.
+
+``run()`` is the loop; ``cancel_orders()`` and ``close_tickets()`` are the
+transitions. A transition takes the chunk's queryset and returns how many
+rows it changed.
+"""
+import logging
+import time
+
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import inventory, render_cache, sales_rollups, support_stream
+from .audit_sink import audit_sink
+from .models import (
+    Order, OrderItem, OrderStatusHistory, Invoice, Notification, SupportTicket, SupportMessage,
+)
+from .notifications import bulk_notify
+from .signals import log_bulk_update
+
+logger = logging.getLogger(__name__)
+
+# Same rules as Order.action_cancel()
+CANCELLABLE_STATUSES = ['pending', 'confirmed', 'processing', 'shipping']
+HOLDING_STATUSES = ['confirmed', 'processing', 'shipping']
+
+
+class Metrics:
+    def __init__(self, name):
+        self.name = name
+        self.chunks = 0
+        self.selected = 0
+        self.changed = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.changed / elapsed if elapsed else 0
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.changed}/{self.selected} rows in {self.chunks} chunks, "
+            f"{self.elapsed:.1f}s ({self.rate:.0f}/s)"
+        )
+
+
+def run(queryset, transition, chunk_size=500, progress=None, name=None):
+    """Apply ``transition`` to the queryset's rows, ``chunk_size`` per transaction; returns Metrics."""
+    metrics = Metrics(name or transition.__name__)
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        ids = list(page.values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        with audit_sink.batch():
+            with transaction.atomic():
+                changed = transition(queryset.filter(pk__in=ids))
+        metrics.chunks += 1
+        metrics.selected += len(ids)
+        metrics.changed += changed
+        logger.info(str(metrics))
+        if progress:
+            progress(metrics)
+    return metrics
+
+
+def cancel_orders(queryset, note='', user=None):
+    """Order.action_cancel() for every order of the queryset that can still be cancelled."""
+    orders = queryset.filter(status__in=CANCELLABLE_STATUSES).select_related('user', 'invoice').order_by('pk')
+    if connection.features.has_select_for_update_of:
+        orders = orders.select_for_update(of=('self',))
+    orders = list(orders)
+    if not orders:
+        return 0
+    note = note or "Hủy đơn hàng."
+    old_statuses = {order.pk: order.status for order in orders}
+
+    # Safe Release of what the orders still hold, one lock and one UPDATE per table
+    numbers = {order.pk: order.order_number for order in orders if order.status in HOLDING_STATUSES}
+    if numbers:
+        items = (
+            OrderItem.objects.filter(order__in=list(numbers))
+            .select_related('product', 'variation__product')
+            .order_by('order_id', 'id')
+        )
+        holds = [(line, numbers[item.order_id]) for item in items for line in inventory.lines_for([item])]
+        inventory.release_holds(holds, note='Giải phóng kho do hủy đơn hàng {reference}', user=user, sign=-1)
+
+    now = timezone.now()
+    Order.objects.filter(pk__in=list(old_statuses)).update(status='cancelled', updated_at=now)
+    for order in orders:
+        order.status = 'cancelled'
+        order.updated_at = now
+    log_bulk_update(Order, orders, ['status', 'updated_at'])
+    OrderStatusHistory.objects.bulk_create([
+        OrderStatusHistory(order=order, status='cancelled', user=user, note=note) for order in orders
+    ])
+    sales_rollups.apply_orders(
+        [order for order in orders if old_statuses[order.pk] in sales_rollups.SALES_STATUSES], -1
+    )
+
+    invoices = [invoice for invoice in map(_invoice, orders) if invoice and invoice.status != 'cancelled']
+    if invoices:
+        Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices]).update(status='cancelled')
+        for invoice in invoices:
+            invoice.status = 'cancelled'
+        log_bulk_update(Invoice, invoices, ['status'])
+
+    status_display = dict(Order.STATUS_CHOICES)['cancelled']
+    bulk_notify([
+        Notification(
+            user=order.user,
+            actor=user,
+            notification_type='order',
+            title=f"Cập nhật đơn hàng {order.order_number}",
+            message=f"Đơn hàng của bạn đã chuyển sang trạng thái: {status_display}. {note}",
+            link=reverse('order_detail', kwargs={'order_number': order.order_number}),
+        )
+        for order in orders
+    ])
+    # QuerySet.update() sends no post_save, which is what drops cached PDFs and QR codes
+    order_ids = list(old_statuses)
+    transaction.on_commit(lambda: _invalidate_renderings(order_ids))
+    return len(orders)
+
+
+def close_tickets(queryset, message=''):
+    """Close the queryset's open tickets, posting ``message`` as a system message in each."""
+    ticket_ids = list(queryset.exclude(status='closed').values_list('pk', flat=True))
+    if not ticket_ids:
+        return 0
+    messages = []
+    if message:
+        messages = SupportMessage.objects.bulk_create([
+            SupportMessage(ticket_id=ticket_id, sender_type='system', content=message) for ticket_id in ticket_ids
+        ])
+    SupportTicket.objects.filter(pk__in=ticket_ids).update(status='closed', updated_at=timezone.now())
+    # Neither bulk_create nor update() sends post_save: push the change to open chat streams here.
+    support_stream.publish_ticket_updates(ticket_ids, [m.pk for m in messages if m.pk is not None])
+    return len(ticket_ids)
+
+
+def _invoice(order):
+    try:
+        return order.invoice
+    except Invoice.DoesNotExist:
+        return None
+
+
+def _invalidate_renderings(order_ids):
+    for order_id in order_ids:
+        render_cache.invalidate(order_id)
@@ -0,0 +1,203 @@
+"""
+Casso (casso.vn) bank transfer webhook processing.
+
+casso_webhook used to run the order-number regex, an Order query and the
+payment/invoice lookups once per transaction, and processed a transaction
+again whenever Casso retried a delivery. A payload is now handled as a batch:
+
+* every transaction is parsed first, and the ones already recorded in
+  ProcessedBankTransaction (by Casso id) are skipped,
+* the remaining orders are loaded, with their payment and invoice, by one
+  query (locked with SELECT ... FOR UPDATE where the backend supports it),
+* every transaction gets an outcome and is recorded, and the payments are
+  confirmed, all in one database transaction.
+
+If a concurrent delivery of the same payload records a transaction first,
+the unique transaction_id makes our insert fail; the batch is rolled back
+and retried without the transactions that are now known.
+"""
+import hashlib
+import logging
+import re
+from collections import namedtuple
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import Order, ProcessedBankTransaction, Notification
+from .tasks import run_task_on_commit
+
+logger = logging.getLogger(__name__)
+
+ORDER_NUMBER_RE = re.compile(r'ORD-\d{8}-[A-Z0-9]{6}')
+AMOUNT_TOLERANCE = 1000  # VND
+INELIGIBLE_STATUSES = ['cancelled', 'refunded', 'exchanged', 'return_requested', 'return_approved', 'returned']
+ATTEMPTS = 3
+
+BankTransaction = namedtuple('BankTransaction', ['transaction_id', 'order_number', 'amount', 'description'])
+Result = namedtuple('Result', ['matched', 'duplicates', 'recorded'])
+
+
+def transaction_id(data):
+    """Casso's id of a transaction; a digest of its content when the payload has none."""
+    if data.get('id') not in (None, ''):
+        return f"casso:{data['id']}"
+    content = '|'.join(str(data.get(key, '')) for key in ('tid', 'when', 'amount', 'description'))
+    return 'sha1:' + hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def parse(transactions):
+    """BankTransactions of a webhook payload, without repeats and without empty descriptions."""
+    parsed = {}
+    for data in transactions:
+        if not isinstance(data, dict):
+            continue
+        description = str(data.get('description', '')).upper()
+        if not description:
+            continue
+        try:
+            amount = int(data.get('amount', 0))
+        except (TypeError, ValueError):
+            amount = 0
+        match = ORDER_NUMBER_RE.search(description)
+        txn_id = transaction_id(data)
+        parsed.setdefault(txn_id, BankTransaction(txn_id, match.group(0) if match else None, amount, description[:255]))
+    return list(parsed.values())
+
+
+def process(transactions):
+    """Apply a webhook payload; returns Result(matched, duplicates, recorded)."""
+    incoming = parse(transactions)
+    duplicates = 0
+    for attempt in range(ATTEMPTS):
+        known = set(
+            ProcessedBankTransaction.objects.filter(transaction_id__in=[t.transaction_id for t in incoming])
+            .values_list('transaction_id', flat=True)
+        )
+        duplicates += len(known)
+        incoming = [t for t in incoming if t.transaction_id not in known]
+        try:
+            with transaction.atomic():
+                matched, recorded = _apply(incoming)
+            return Result(matched, duplicates, recorded)
+        except IntegrityError:
+            if attempt == ATTEMPTS - 1:
+                raise
+            logger.info("Casso: transactions recorded by a concurrent delivery, retrying the rest")
+
+
+def _apply(incoming):
+    if not incoming:
+        return 0, 0
+    orders = _load_orders({t.order_number for t in incoming if t.order_number})
+
+    records = []
+    to_confirm = []
+    for txn in incoming:
+        order = orders.get(txn.order_number)
+        outcome = _outcome(txn, order)
+        records.append(ProcessedBankTransaction(
+            transaction_id=txn.transaction_id, order=order, amount=txn.amount,
+            description=txn.description, outcome=outcome,
+        ))
+        if outcome == 'confirmed':
+            # A second transfer for the same order in this payload is 'already_paid'.
+            order.payment.payment_status = 'completed'
+            to_confirm.append((txn, order))
+
+    # Claim the transactions first: a concurrent delivery fails here, before any change.
+    ProcessedBankTransaction.objects.bulk_create(records)
+
+    confirmations = []
+    stock_shortage = []
+    failed = []
+    for txn, order in to_confirm:
+        try:
+            with transaction.atomic():
+                if _confirm(order, txn):
+                    confirmations.append((order.id, txn.amount))
+                    logger.info(f"✅ Casso auto-confirmed payment for order {order.order_number}")
+                else:
+                    stock_shortage.append(txn.transaction_id)
+        except Exception:
+            logger.exception(f"Casso: confirming payment for order {order.order_number} failed")
+            failed.append(txn.transaction_id)
+    if stock_shortage:
+        ProcessedBankTransaction.objects.filter(transaction_id__in=stock_shortage).update(outcome='stock_shortage')
+    if failed:
+        # Not processed after all: let Casso's next retry try them again.
+        ProcessedBankTransaction.objects.filter(transaction_id__in=failed).delete()
+
+    if confirmations:
+        # Customer notifications + emails run in a django-q worker
+        run_task_on_commit('payments_confirmed_task', confirmations)
+    return len(confirmations), len(records) - len(failed)
+
+
+def _load_orders(order_numbers):
+    if not order_numbers:
+        return {}
+    queryset = Order.objects.filter(order_number__in=order_numbers).select_related('user', 'payment', 'invoice')
+    if connection.features.has_select_for_update_of:
+        queryset = queryset.select_for_update(of=('self',)).order_by('id')
+    return {order.order_number: order for order in queryset}
+
+
+def _outcome(txn, order):
+    if not txn.order_number:
+        return 'unmatched'
+    if order is None:
+        logger.warning(f"Casso: order not found for {txn.order_number}")
+        return 'order_not_found'
+    expected = int(order.total_amount)
+    if abs(txn.amount - expected) > AMOUNT_TOLERANCE:
+        logger.warning(
+            f"Casso: amount mismatch for {order.order_number}: "
+            f"expected {expected}, received {txn.amount}"
+        )
+        return 'amount_mismatch'
+    try:
+        payment = order.payment
+    except Exception:
+        logger.warning(f"Casso: no payment record for order {order.order_number}")
+        return 'no_payment'
+    if payment.payment_status == 'completed':
+        logger.info(f"Casso: order {order.order_number} already completed, skipping")
+        return 'already_paid'
+    if order.status in INELIGIBLE_STATUSES:
+        logger.warning(f"Casso: order {order.order_number} is not eligible for payment confirm")
+        return 'ineligible'
+    return 'confirmed'
+
+
+def _confirm(order, txn):
+    """Mark the order paid. Returns False when the money arrived but stock could not be reserved."""
+    payment = order.payment
+    payment.payment_status = 'completed'
+    payment.payment_date = timezone.now()
+    payment.transaction_id = payment.transaction_id or txn.transaction_id[:100]
+
+    if order.status == 'pending':
+        success, message = order.action_confirm()  # Reserve stock
+        if not success:
+            logger.error(f"Casso: stock reservation failed for order {order.order_number}: {message}")
+            payment.notes = f"Payment received but stock reservation failed: {message}"
+            payment.save()
+            order.set_status('pending', note="Đã nhận thanh toán nhưng thiếu tồn kho.")
+            Notification.objects.create(
+                user=order.user,
+                notification_type='order',
+                title=f'Đã nhận thanh toán cho đơn {order.order_number}',
+                message='Tuy nhiên kho đang thiếu hàng cho một số sản phẩm. Chúng tôi sẽ liên hệ để xử lý.',
+                link=f'/order/{order.order_number}/',
+            )
+            return False
+        invoice = order.invoice
+    else:
+        invoice = order.ensure_invoice()
+
+    payment.save()
+    if invoice.status != 'paid':
+        invoice.status = 'paid'
+        invoice.save(update_fields=['status'])
+    return True
@@ -0,0 +1,139 @@
+"""
+Versioned cache for the storefront home page.
+
+``index`` ran about nine queries on every hit (three product lists with their
+images, categories, storyboard, raw and cabinet items) for content that only
+changes when staff edit the catalog. Now:
+
+* a catalog version is bumped by every save/delete of a Product, Category,
+  StoryboardItem, RawItem or CabinetItem (receivers below); stock, rating and
+  view-count saves do not change the home page and do not bump it. It lives
+  in the cache when the cache is shared by all worker processes, else in the
+  CatalogVersion row (CATALOG_VERSION_STORE), read once per request, so an
+  edit made in one process reaches the local-memory caches of the others,
+* index.html wraps each section in ``{% cache %}`` keyed on that version, and
+  the view hands it lazy querysets, so a warm fragment runs no query,
+* anonymous visitors without pending messages get the whole page from the
+  cache (``cached_page()`` / ``store_page()``). The page is stored with a
+  placeholder for the CSRF token, which is filled in per request, so the cached
+  copy never hands one visitor's token to another.
+
+Writes that bypass save() (QuerySet.update(), raw SQL) are picked up when the
+entries expire after CACHE_TIMEOUT seconds, or right away with ``bump()``.
+"""
+import time
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .models import CatalogVersion, Product, Category, StoryboardItem, RawItem, CabinetItem
+
+VERSION_KEY = 'catalog_version'
+CACHE_TIMEOUT = 600
+CSRF_PLACEHOLDER = '__catalog_cache_csrf_token__'
+# Product fields the cached pages do not show; saving only these keeps the version.
+VOLATILE_FIELDS = {'physical_stock', 'reserved_stock', 'total_available_stock', 'avg_rating', 'review_count', 'views_count'}
+
+
+def uses_database():
+    store = getattr(settings, 'CATALOG_VERSION_STORE', '')
+    if store:
+        return store == 'db'
+    return isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def version(request=None):
+    """The current catalog version; read once per ``request`` when one is given."""
+    if request is not None:
+        if not hasattr(request, '_catalog_version'):
+            request._catalog_version = version()
+        return request._catalog_version
+    if uses_database():
+        current = CatalogVersion.objects.filter(pk=1).values_list('value', flat=True).first()
+        if current is None:
+            current = CatalogVersion.objects.get_or_create(pk=1, defaults={'value': time.time_ns()})[0].value
+        return current
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        # Start from the clock so an evicted version never comes back to old entries.
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def bump():
+    if uses_database():
+        if not CatalogVersion.objects.filter(pk=1).update(value=F('value') + 1):
+            CatalogVersion.objects.get_or_create(pk=1, defaults={'value': time.time_ns()})
+        return
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def fragment_context(request=None):
+    """Template variables of the ``{% cache %}`` blocks."""
+    return {'catalog_version': version(request), 'catalog_cache_timeout': CACHE_TIMEOUT}
+
+
+def page_cacheable(request):
+    """Whether ``request`` gets the shared page: an anonymous GET without query string or pending messages."""
+    return (
+        request.method == 'GET'
+        and not request.GET
+        and not request.user.is_authenticated
+        and not len(messages.get_messages(request))
+    )
+
+
+def _page_key(request, name):
+    return f'catalog_page:{name}:{version(request)}'
+
+
+def cached_page(request, name):
+    """The cached response of page ``name`` for ``request``, or None."""
+    if not page_cacheable(request):
+        return None
+    content = cache.get(_page_key(request, name))
+    if content is None:
+        return None
+    return _with_token(request, content)
+
+
+def store_page(request, name, response):
+    """Cache a page rendered with ``csrf_token=CSRF_PLACEHOLDER`` and return it for ``request``."""
+    content = response.content.decode(response.charset)
+    cache.set(_page_key(request, name), content, CACHE_TIMEOUT)
+    return _with_token(request, content)
+
+
+def _with_token(request, content):
+    return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=StoryboardItem)
+@receiver(post_delete, sender=StoryboardItem)
+@receiver(post_save, sender=RawItem)
+@receiver(post_delete, sender=RawItem)
+@receiver(post_save, sender=CabinetItem)
+@receiver(post_delete, sender=CabinetItem)
+def bump_catalog_version(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if sender is Product and update_fields is not None and set(update_fields) <= VOLATILE_FIELDS:
+        return
+    transaction.on_commit(bump)
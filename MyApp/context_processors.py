@@ -1,11 +1,12 @@
 from django.core.cache import cache
+from MyApp import catalog_cache
 from MyApp.models import Category, SupportTicket, Wishlist, CartItem
 
 def categories(request):
     """
     Returns all active categories to be available in every template.
     """
-    cache_key = 'active_categories'
+    cache_key = f'active_categories:{catalog_cache.version(request)}'
     categories = cache.get(cache_key)
     if categories is None:
         categories = list(
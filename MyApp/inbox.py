@@ -0,0 +1,99 @@
+"""
+Conversation inbox with per-participant read cursors.
+
+message_inbox called get_other_user(), last_message() and unread_count() for
+every conversation, three queries each, and message_detail marked messages
+read with an UPDATE of each unread Message row. Now:
+
+* Conversation.last_message points at the newest message,
+* every participant has a ConversationReadCursor: the id of the last message
+  they have read, and how many messages from the others came after it.
+
+Both are kept up to date when a message is saved (``record_message()``): the
+conversation's pointer moves, the other participants' counters go up by one
+and the sender's cursor moves to their own message. Reading a conversation is
+one UPDATE of the reader's cursor (``mark_read()``), and ``inbox()`` returns
+the conversations with the other participant, the last message and the
+unread count from a single query.
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Conversation, ConversationReadCursor, Message, User
+
+
+def inbox(user):
+    """
+    Conversations of ``user``, most recent first, with ``last_message`` loaded
+    and annotated with ``other_username`` and ``unread``.
+    """
+    others = User.objects.filter(conversations=OuterRef('pk')).exclude(pk=user.pk)
+    cursor = ConversationReadCursor.objects.filter(conversation=OuterRef('pk'), user=user)
+    return (
+        Conversation.objects.filter(participants=user)
+        .select_related('last_message')
+        .annotate(
+            other_username=Subquery(others.values('username')[:1]),
+            unread=Coalesce(Subquery(cursor.values('unread_count')[:1]), Value(0)),
+        )
+        .order_by('-updated_at')
+    )
+
+
+def unread_total(user):
+    """Unread messages of ``user`` over all their conversations."""
+    return ConversationReadCursor.objects.filter(user=user).aggregate(total=Sum('unread_count'))['total'] or 0
+
+
+def read_position(conversation, user):
+    """Id of the last message ``user`` has read in ``conversation`` (0 = none)."""
+    return ConversationReadCursor.objects.filter(
+        conversation=conversation, user=user
+    ).values_list('last_read_id', flat=True).first() or 0
+
+
+def mark_read(conversation, user):
+    """Move the cursor of ``user`` to the conversation's last message; no write when already there."""
+    last_id = conversation.last_message_id or 0
+    # Messages saved since ``conversation`` was loaded stay unread.
+    newer = (
+        Message.objects.filter(conversation=conversation, pk__gt=last_id).exclude(sender=user)
+        .order_by().values('conversation').annotate(count=Count('pk')).values('count')
+    )
+    ConversationReadCursor.objects.filter(conversation=conversation, user=user).exclude(
+        last_read_id__gte=last_id, unread_count=0,
+    ).update(
+        last_read_id=last_id,
+        unread_count=Coalesce(Subquery(newer, output_field=IntegerField()), Value(0)),
+        updated_at=timezone.now(),
+    )
+
+
+@receiver(post_save, sender=Message)
+def record_message(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    cursors = ConversationReadCursor.objects.filter(conversation_id=instance.conversation_id)
+    now = timezone.now()
+    with transaction.atomic():
+        Conversation.objects.filter(pk=instance.conversation_id).update(last_message=instance, updated_at=now)
+        cursors.exclude(user_id=instance.sender_id).update(unread_count=F('unread_count') + 1, updated_at=now)
+        cursors.filter(user_id=instance.sender_id).update(last_read_id=instance.pk, unread_count=0, updated_at=now)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def create_read_cursors(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        pairs = [(conversation_id, instance.pk) for conversation_id in pk_set]
+    else:
+        pairs = [(instance.pk, user_id) for user_id in pk_set]
+    ConversationReadCursor.objects.bulk_create(
+        [ConversationReadCursor(conversation_id=conversation_id, user_id=user_id) for conversation_id, user_id in pairs],
+        ignore_conflicts=True,
+    )
@@ -0,0 +1,64 @@
+"""
+Shared helpers for the benchmark/stress management commands.
+
+Benchmarks never touch the real database: they run against a throw-away test
+database created the same way ``manage.py test`` does (migrations included)
+and destroyed afterwards.
+"""
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def temporary_database(verbosity=0, on_disk=False):
+    """
+    ``on_disk=True`` keeps a SQLite test database in a file instead of memory,
+    so that connections opened by other threads share it and use SQLite's
+    normal file locking (stress tests need that).
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if on_disk and connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(tempfile.gettempdir(), f'myapp_stress_{os.getpid()}.sqlite3')
+    try:
+        connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+        try:
+            yield connection.settings_dict['NAME']
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+    finally:
+        test_settings['NAME'] = old_test_name
+
+
+@contextmanager
+def timer(samples):
+    """Append the elapsed milliseconds of the block to ``samples``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+def summarize(samples):
+    """Return p50/p95/max (milliseconds) of a list of timings."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    p95_index = min(len(ordered) - 1, int(round(len(ordered) * 0.95)) - 1)
+    return {
+        'p50': statistics.median(ordered),
+        'p95': ordered[max(p95_index, 0)],
+        'max': ordered[-1],
+    }
+
+
+def format_summary(label, samples):
+    stats = summarize(samples)
+    return f"{label:<28} p50={stats['p50']:8.2f} ms  p95={stats['p95']:8.2f} ms  max={stats['max']:8.2f} ms"
@@ -1,15 +1,16 @@
 import os
-import json
-import gzip
 from datetime import timedelta
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 from django.conf import settings
-from MyApp.audit_models import AuditLog
+from MyApp.audit_archive import Archiver, verify_manifest
 from MyApp.tasks import process_audit_event_task
 
 class Command(BaseCommand):
-    help = 'Archives audit logs older than a specified number of days to compressed JSON and deletes them.'
+    help = (
+        'Archives audit logs older than a specified number of days to gzip NDJSON files with a manifest '
+        'and deletes them (streams the table, constant memory).'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -18,61 +19,68 @@ class Command(BaseCommand):
             default=90,
             help='Number of days to keep hot logs in the database (default: 90)',
         )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched per database round trip (default: 2000)',
+        )
+        parser.add_argument(
+            '--delete-batch', type=int, default=5000,
+            help='Rows deleted per transaction once their file is written (default: 5000)',
+        )
+        parser.add_argument(
+            '--max-file-mb', type=int, default=256,
+            help='Start a new file when the current one reaches this compressed size (default: 256)',
+        )
+        parser.add_argument(
+            '--split-by-day', action='store_true',
+            help='Start a new file for every day of logs',
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Write the archive but do not delete the logs from the database',
+        )
+        parser.add_argument(
+            '--output-dir', type=str, default=None,
+            help='Where to write the archive (default: BASE_DIR/cold_storage/audit_logs)',
+        )
+        parser.add_argument(
+            '--verify', type=str, default=None, metavar='MANIFEST',
+            help='Check an existing archive against its manifest instead of archiving',
+        )
 
     def handle(self, *args, **options):
+        if options['verify']:
+            return self._verify(options['verify'])
+
         days = options['days']
         threshold_date = timezone.now() - timedelta(days=days)
-        
+        archive_dir = options['output_dir'] or os.path.join(settings.BASE_DIR, 'cold_storage', 'audit_logs')
+
         self.stdout.write(f"Archiving audit logs older than {threshold_date}...")
-        
-        old_logs = AuditLog.objects.filter(timestamp__lt=threshold_date).order_by('timestamp')
-        count = old_logs.count()
-        
+
+        archiver = Archiver(
+            archive_dir, threshold_date,
+            chunk_size=options['chunk_size'],
+            delete_batch=options['delete_batch'],
+            max_bytes=options['max_file_mb'] * 1024 * 1024,
+            split_by_day=options['split_by_day'],
+            delete=not options['keep'],
+            log=self.stdout.write,
+        )
+        manifest = archiver.archive()
+        count = manifest['rows']
+
         if count == 0:
+            os.remove(archiver.manifest_path)
             self.stdout.write(self.style.SUCCESS('No logs to archive.'))
             return
 
-        archive_dir = os.path.join(settings.BASE_DIR, 'cold_storage', 'audit_logs')
-        os.makedirs(archive_dir, exist_ok=True)
-        
-        filename = f"audit_archive_{timezone.now().strftime('%Y%m%d_%H%M%S')}_{count}_records.json.gz"
-        filepath = os.path.join(archive_dir, filename)
-        
-        # Serialize to JSON
-        logs_data = []
-        for log in old_logs:
-            logs_data.append({
-                'log_id': str(log.log_id),
-                'timestamp': log.timestamp.isoformat(),
-                'event_type': log.event_type,
-                'severity_level': log.severity_level,
-                'actor_id': log.actor_id,
-                'actor_role': log.actor_role,
-                'ip_address': log.ip_address,
-                'user_agent': log.user_agent,
-                'resource_type': log.resource_type,
-                'resource_id': log.resource_id,
-                # In archive, we might store them still encrypted or decrypt them.
-                # Decrypting them here to store plain text JSON in secure cold storage is usually preferred.
-                'before_state': log.before_state,
-                'after_state': log.after_state,
-                'status': log.status,
-                'reason': log.reason,
-                'previous_hash': log.previous_hash,
-                'current_hash': log.current_hash
-            })
-            
-        with gzip.open(filepath, 'wt', encoding='utf-8') as f:
-            json.dump(logs_data, f, ensure_ascii=False, indent=2)
-            
-        self.stdout.write(self.style.SUCCESS(f"Successfully exported {count} logs to {filepath}"))
-        
-        # We use queryset.delete() which bypasses the model's delete() restriction
-        # to actually purge from the database.
-        old_logs.delete()
-        
-        self.stdout.write(self.style.SUCCESS(f"Purged {count} logs from database."))
-        
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully exported {count} logs to {len(manifest['parts'])} file(s), manifest {archiver.manifest_path}"
+        ))
+        if not options['keep']:
+            self.stdout.write(self.style.SUCCESS(f"Purged {manifest['deleted']} logs from database."))
+
         # Log this archiving action
         process_audit_event_task({
             'event_type': 'SYSTEM_ARCHIVE_LOGS',
@@ -84,7 +92,15 @@ class Command(BaseCommand):
             'resource_type': 'AuditLog',
             'resource_id': 'batch',
             'before_state': '',
-            'after_state': f"Archived {count} records to {filename}",
+            'after_state': f"Archived {count} records to {os.path.basename(archiver.manifest_path)}",
             'status': 'SUCCESS',
             'reason': 'Scheduled Data Purging'
         })
+
+    def _verify(self, path):
+        problems = verify_manifest(path)
+        for problem in problems:
+            self.stderr.write(self.style.ERROR(problem))
+        if problems:
+            raise CommandError(f'Archive verification failed: {len(problems)} problem(s).')
+        self.stdout.write(self.style.SUCCESS(f'Archive {path} verified.'))
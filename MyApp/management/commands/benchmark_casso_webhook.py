@@ -0,0 +1,102 @@
+import json
+import logging
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from MyApp.models import Category, Product, Order, OrderItem, Payment, ProcessedBankTransaction
+from MyApp.views.order_views import casso_webhook
+from ._benchmark import temporary_database
+
+
+class Command(BaseCommand):
+    help = 'Feed a large Casso webhook payload, then replay it, and report time and query counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--transactions', type=int, default=1000,
+            help='Transactions in the payload (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        # Payment emails go to memory, never to the configured SMTP server.
+        with temporary_database(), override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', CASSO_APIKEY='',
+        ):
+            self._run(options['transactions'])
+
+    def _run(self, total):
+        # The mismatching transactions would log one warning each.
+        logging.getLogger('MyApp.casso').setLevel(logging.ERROR)
+        orders = self._create_orders(total)
+        payload = json.dumps({'error': 0, 'data': self._transactions(orders)})
+        expected = sum(1 for i in range(total) if i % 10 not in (7, 8, 9))
+        self.stdout.write(f'{total} transactions: {expected} should confirm a payment, '
+                          f'the others are a wrong amount, no order code or an unknown order')
+
+        factory = RequestFactory()
+        results = {}
+        for label in ('first delivery', 'replay'):
+            request = factory.post('/api/webhook/casso/', data=payload, content_type='application/json')
+            queries = []
+            # Counted with a wrapper: the debug query log keeps only 9000 entries.
+            with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+                start = time.perf_counter()
+                response = casso_webhook(request)
+                elapsed = time.perf_counter() - start
+            body = json.loads(response.content)
+            results[label] = body
+            self.stdout.write(
+                f"{label:<15} {elapsed * 1000:9.1f} ms  {len(queries):6} queries  "
+                f"matched={body['matched']} duplicates={body['duplicates']}"
+            )
+
+        confirmed = Payment.objects.filter(order__in=orders, payment_status='completed').count()
+        recorded = ProcessedBankTransaction.objects.count()
+        self.stdout.write(f'{confirmed} payments completed, {recorded} bank transactions recorded')
+        if results['first delivery']['matched'] != expected or confirmed != expected:
+            raise CommandError(f'Expected {expected} confirmed payments.')
+        if results['replay']['matched'] or results['replay']['duplicates'] != recorded:
+            raise CommandError('The replayed payload was processed again.')
+        self.stdout.write(self.style.SUCCESS('Replay was a no-op: every transaction was recognised as processed.'))
+
+    def _create_orders(self, total):
+        user = User.objects.create_user('casso-bench', email='casso-bench@example.com')
+        category = Category.objects.create(name='Casso', slug='casso-bench')
+        product = Product.objects.create(
+            title='Casso bench', slug='casso-bench', category=category, price=100000, physical_stock=total * 2,
+        )
+        orders = Order.objects.bulk_create([
+            Order(user=user, order_number=f'ORD-20260101-{i:06X}', total_amount=100000, status='pending')
+            for i in range(total)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, product_title=product.title, quantity=1, price=100000)
+            for order in orders
+        ])
+        Payment.objects.bulk_create([
+            Payment(order=order, amount=100000, payment_method='qr_bank', reference_code=f'BENCH{i:05d}')
+            for i, order in enumerate(orders)
+        ])
+        return orders
+
+    def _transactions(self, orders):
+        transactions = []
+        for i, order in enumerate(orders):
+            description = f'TeaZen-{order.order_number} chuyen khoan'
+            amount = 100000
+            if i % 10 == 7:
+                amount = 50000
+            elif i % 10 == 8:
+                description = 'chuyen tien an trua'
+            elif i % 10 == 9:
+                description = f'TeaZen-ORD-20250101-{i:06X}'
+            transactions.append({
+                'id': 900000 + i, 'tid': f'FT{i:08d}', 'description': description,
+                'amount': amount, 'when': '2026-01-01 10:00:00',
+            })
+        return transactions
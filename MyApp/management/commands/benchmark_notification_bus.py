@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from MyApp.notification_bus import LocalBus, user_channel
+from ._benchmark import summarize
+
+
+class Command(BaseCommand):
+    help = 'Simulate many idle SSE subscribers on the notification bus and measure fan-out latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections', type=int, default=5000,
+            help='Number of simulated idle SSE connections (default: 5000)',
+        )
+        parser.add_argument(
+            '--events', type=int, default=500,
+            help='Number of notifications published to random users (default: 500)',
+        )
+        parser.add_argument(
+            '--idle', type=float, default=2.0,
+            help='Seconds the connections stay idle before publishing (default: 2)',
+        )
+
+    def handle(self, *args, **options):
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            result = asyncio.run(self._run(options['connections'], options['events'], options['idle']))
+        tracemalloc.stop()
+
+        stats = summarize(result['latencies'])
+        self.stdout.write(f"{options['connections']} idle subscribers, {result['delivered']}/{options['events']} events delivered")
+        self.stdout.write(f"Publish -> receive latency: p50={stats['p50']:.3f} ms  p95={stats['p95']:.3f} ms  max={stats['max']:.3f} ms")
+        self.stdout.write(f"Memory held by subscribers: {result['memory'] / 1024:.0f} KiB "
+                          f"(~{result['memory'] / max(options['connections'], 1):.0f} bytes each)")
+        self.stdout.write(f"Database queries while idle and fanning out: {len(queries)}")
+
+    async def _run(self, total, events, idle):
+        bus = LocalBus()
+        latencies = []
+        delivered = 0
+        done = asyncio.Event()
+
+        before, _ = tracemalloc.get_traced_memory()
+        subscriptions = [bus.subscribe_async(user_channel(i)) for i in range(total)]
+        memory = tracemalloc.get_traced_memory()[0] - before
+
+        async def consumer(subscription):
+            nonlocal delivered
+            while True:
+                message = await subscription.get(timeout=None)
+                latencies.append((time.perf_counter() - message['sent']) * 1000)
+                delivered += 1
+                if delivered >= events:
+                    done.set()
+
+        tasks = [asyncio.create_task(consumer(s)) for s in subscriptions]
+        await asyncio.sleep(idle)
+
+        def publisher():
+            # Publishers run in ordinary request threads.
+            for n in range(events):
+                bus.publish(user_channel((n * 7919) % total), {'sent': time.perf_counter()})
+
+        threading.Thread(target=publisher).start()
+        try:
+            await asyncio.wait_for(done.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for subscription in subscriptions:
+            subscription.close()
+        return {'latencies': latencies, 'delivered': delivered, 'memory': memory}
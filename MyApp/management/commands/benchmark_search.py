@@ -0,0 +1,91 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.test import RequestFactory
+
+from MyApp.models import Category, Product
+from MyApp.search import rebuild_index, get_backend, suggest_product_ids, order_by_ids
+from MyApp.views.utils import get_smart_search_filter
+from MyApp.views.product_views import search_suggestions
+from ._benchmark import temporary_database, timer, format_summary
+
+WORDS = [
+    'Trà', 'Xanh', 'Đen', 'Ô Long', 'Thảo Mộc', 'Sen', 'Nhài', 'Thái Nguyên', 'Shan Tuyết',
+    'Matcha', 'Hoa Cúc', 'Gừng', 'Quế', 'Đinh Hương', 'Bạch Trà', 'Phổ Nhĩ', 'Hồng Trà',
+    'Đặc Biệt', 'Thượng Hạng', 'Cổ Thụ', 'Hà Giang', 'Mộc Châu', 'Lâm Đồng', 'Tân Cương',
+    'Ấm', 'Chén', 'Khay', 'Hũ', 'Gói', 'Hộp Quà',
+]
+QUERIES = [
+    't', 'tr', 'tra', 'tra x', 'trà xa', 'trà xanh', 'tra den', 'đen', 'o lo', 'ô long',
+    'thai ng', 'shan tuyet', 'matc', 'hoa cuc', 'phổ', 'hong tra', 'dac biet', 'co thu ha',
+    'moc chau', 'am', 'hop qua', 'gung que', 'bach', 'lam dong tra',
+    # typos / words that are not in the catalogue: worst case for icontains
+    'tra sua', 'oolongg', 'cafe', 'xyz',
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark search_suggestions latency (icontains vs full-text index) on a temporary database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products', type=int, default=100000,
+            help='Number of synthetic products to generate (default: 100000)',
+        )
+        parser.add_argument(
+            '--rounds', type=int, default=5,
+            help='How many times each query is repeated (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            self._run(options['products'], options['rounds'])
+
+    def _run(self, total, rounds):
+        rng = random.Random(42)
+        categories = [
+            Category.objects.create(name=name, slug=f'bench-{i}')
+            for i, name in enumerate(['Trà Xanh', 'Trà Đen', 'Ô Long', 'Trà Thảo Mộc', 'Phụ Kiện Pha Trà'])
+        ]
+
+        self.stdout.write(f'Generating {total} products...')
+        batch = []
+        for i in range(total):
+            title = ' '.join(rng.sample(WORDS, 3))
+            batch.append(Product(
+                category=rng.choice(categories),
+                title=title,
+                slug=f'bench-product-{i}',
+                excerpt=' '.join(rng.sample(WORDS, 5)),
+                description=' '.join(rng.sample(WORDS, 12)),
+                price=rng.randrange(50, 2000) * 1000,
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_create(batch)
+        rebuild_index()
+        self.stdout.write(f'Search backend: {get_backend().name}')
+
+        active_filter = Q(category__isnull=True) | Q(category__is_active=True)
+        legacy, indexed, endpoint = [], [], []
+        factory = RequestFactory()
+        for _ in range(rounds):
+            for q in QUERIES:
+                with timer(legacy):
+                    list(Product.objects.filter(active_filter).filter(
+                        get_smart_search_filter(q, ['title', 'excerpt', 'category__name'])
+                    ).select_related('category')[:6])
+                with timer(indexed):
+                    list(order_by_ids(
+                        Product.objects.filter(active_filter), suggest_product_ids(q)
+                    ).select_related('category')[:6])
+                with timer(endpoint):
+                    search_suggestions(factory.get('/api/search-suggestions/', {'q': q}))
+
+        self.stdout.write(f'{len(QUERIES) * rounds} suggestion queries over {total} products:')
+        self.stdout.write(format_summary('icontains (legacy)', legacy))
+        self.stdout.write(format_summary('full-text index', indexed))
+        self.stdout.write(format_summary('search_suggestions view', endpoint))
@@ -0,0 +1,319 @@
+import random
+import re
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from MyApp import view_counter
+from MyApp.query_inspector import QueryRecorder, budget_for
+from MyApp.models import (
+    Category, Product, ProductVariation, Order, OrderItem, Cart, CartItem, InventoryTransaction,
+    AIChatSession, AIChatMessage, SupportTicket, SupportMessage, SupportAttachment, Notification,
+    Conversation, ConversationReadCursor, Message,
+)
+from ._benchmark import temporary_database
+
+# Tables that grow with traffic: a query may not read all of their rows.
+HOT_MODELS = [
+    Order, OrderItem, Cart, CartItem, InventoryTransaction,
+    AIChatSession, AIChatMessage, SupportTicket, SupportMessage, Notification,
+    Conversation, ConversationReadCursor, Message,
+]
+
+# (label, view name, url kwargs from the fixture, who is logged in[, query string]); the query budget
+# of each view is its QUERY_BUDGETS entry (query_inspector.budget_for()).
+VIEWS = [
+    ('index', 'index', None, 'anonymous'),
+    ('product list', 'product_list_public', None, 'anonymous'),
+    ('product detail', 'product_detail', lambda f: {'slug': f['product'].slug}, 'anonymous'),
+    ('cart (guest)', 'cart', None, 'guest'),
+    ('cart', 'cart', None, 'customer'),
+    ('my orders', 'order_list', None, 'customer'),
+    ('order detail', 'order_detail', lambda f: {'order_number': f['order'].order_number}, 'customer'),
+    ('AI chat history (guest)', 'api_chat_history', None, 'guest'),
+    ('AI chat history', 'api_chat_history', None, 'customer'),
+    ('admin orders', 'admin_order_list', None, 'admin'),
+    ('admin orders by status', 'admin_order_list', None, 'admin', {'status': 'pending'}),
+    ('admin order detail', 'admin_order_detail_manage', lambda f: {'order_number': f['order'].order_number}, 'admin'),
+    ('admin inventory ledger', 'admin_inventory_ledger', None, 'admin'),
+    ('admin support queue', 'admin_support_dashboard', None, 'admin'),
+    ('support chat (3 messages)', 'api_support_messages_get', lambda f: {'ticket_id': f['short_ticket'].pk}, 'customer'),
+    ('support chat (200 messages)', 'api_support_messages_get', lambda f: {'ticket_id': f['long_ticket'].pk}, 'customer'),
+    ('admin support ticket (3 messages)', 'admin_support_ticket_detail', lambda f: {'ticket_id': f['short_ticket'].pk}, 'admin'),
+    ('admin support ticket (200 messages)', 'admin_support_ticket_detail', lambda f: {'ticket_id': f['long_ticket'].pk}, 'admin'),
+    ('conversation', 'message_detail', lambda f: {'conversation_id': f['conversation'].pk}, 'pen_pal'),
+    ('inbox (1 conversation)', 'message_inbox', None, 'pen_pal'),
+    ('inbox (19 conversations)', 'message_inbox', None, 'customer'),
+]
+
+# Views that must run the same number of queries however long the list they show.
+SAME_COUNT = [
+    ('support chat (3 messages)', 'support chat (200 messages)'),
+    ('admin support ticket (3 messages)', 'admin support ticket (200 messages)'),
+    ('inbox (1 conversation)', 'inbox (19 conversations)'),
+]
+
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?(.*)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+ALIAS = re.compile(r'"(\w+)" (?:AS )?"?([A-Z]\d+)"?')
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the main views against a seeded temporary database: check their query counts, N+1 patterns '
+        'and that no query reads a whole hot table (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL)'
+    )
+    verbose_plans = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--orders', type=int, default=3000,
+            help='Number of synthetic orders; the other tables are sized from it (default: 3000)',
+        )
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Print the plan of every query, not only of the failing ones',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            with temporary_database():
+                failures = self._run(options)
+                # Views recorded product views: write them here, not to the real database at exit.
+                view_counter.flush()
+        finally:
+            teardown_test_environment()
+        if failures:
+            raise CommandError(f'{len(failures)} query plan/count check(s) failed:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('All query counts and plans are within budget.'))
+
+    def _run(self, options):
+        self.stdout.write(f'Seeding {options["orders"]} orders on {connection.vendor}...')
+        fixture = self._seed(options['orders'])
+        self.verbose_plans = options['verbose_plans']
+        return self.check_queries(fixture) + self.check_views(fixture)
+
+    def _prepare(self):
+        self.hot_tables = {model._meta.db_table for model in HOT_MODELS}
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+                # Small seeded tables are cheaper to read whole; only report a Seq Scan when no index fits.
+                cursor.execute('SET enable_seqscan = off')
+
+    def check_queries(self, fixture):
+        """Failures of the hot filters of ``_hot_queries()``: full scans of a hot table."""
+        self._prepare()
+        failures = []
+        for label, queryset in self._hot_queries(fixture):
+            scans = self._full_scans(queryset.explain(), queryset.query.__str__())
+            status = self.style.ERROR('FULL SCAN ' + ', '.join(scans)) if scans else 'ok'
+            self.stdout.write(f'{"query: " + label:<40} {status}')
+            if scans:
+                failures.append(f'{label}: full scan of {", ".join(scans)}')
+        return failures
+
+    def check_views(self, fixture):
+        """Failures of the VIEWS: HTTP errors, queries over budget, full scans, N+1 patterns, SAME_COUNT."""
+        self._prepare()
+        failures = []
+        counts = {}
+        for check in VIEWS:
+            label, name, kwargs, who = check[:4]
+            params = check[4] if len(check) > 4 else {}
+            budget = budget_for(name)
+            client = self._client(who, fixture)
+            url = reverse(name, kwargs=kwargs(fixture) if kwargs else None)
+            with CaptureQueriesContext(connection) as queries, QueryRecorder() as recorder:
+                response = client.get(url, params)
+            scans = []
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    scans.extend(f'{table} in {sql[:120]}...' for table in self._explain(sql))
+            count = counts[label] = len(queries)
+            status = 'ok'
+            if response.status_code != 200:
+                failures.append(f'{label}: HTTP {response.status_code} for {url}')
+                status = self.style.ERROR(f'HTTP {response.status_code}')
+            if count > budget:
+                failures.append(f'{label}: {count} queries (budget {budget})')
+                status = self.style.ERROR(f'over budget')
+            if scans:
+                failures.extend(f'{label}: full scan of {scan}' for scan in scans)
+                status = self.style.ERROR(f'{len(scans)} full scan(s)')
+            repeated = recorder.problems()
+            if repeated:
+                failures.extend(f'{label}: {problem}' for problem in repeated)
+                status = self.style.ERROR(f'{len(repeated)} N+1 pattern(s)')
+            self.stdout.write(f'{"view: " + label:<40} {count:>3}/{budget:<3} queries  {status}')
+
+        for short, long in SAME_COUNT:
+            if counts[short] != counts[long]:
+                failures.append(f'{long}: {counts[long]} queries, {counts[short]} for {short}')
+        return failures
+
+    def _hot_queries(self, fixture):
+        """The filters the indexes exist for, including those of maintenance commands."""
+        threshold = timezone.now() - timedelta(hours=1)
+        return [
+            ('guest cart', Cart.objects.filter(session_key=fixture['session_key'], user__isnull=True)),
+            ('expired carts', Cart.objects.filter(updated_at__lt=threshold).values_list('id', flat=True)),
+            ('order stock movements', InventoryTransaction.objects.filter(reference_id=fixture['order'].order_number)),
+            ('orders by status', Order.objects.filter(status='pending').order_by('-created_at')[:20]),
+            ('orders of a user', Order.objects.filter(user=fixture['customer']).order_by('-created_at')),
+            ('AI chat history', AIChatMessage.objects.filter(session=fixture['ai_session']).order_by('created_at')),
+            ('AI guest session', AIChatSession.objects.filter(session_key=fixture['session_key'])),
+            ('support queue', SupportTicket.objects.filter(status='waiting').order_by('-updated_at')[:50]),
+            ('items of orders', OrderItem.objects.filter(order__in=[fixture['order'].pk])),
+        ]
+
+    def _explain(self, sql):
+        """Hot tables read whole by ``sql`` (already interpolated by the backend)."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+            else:
+                cursor.execute('EXPLAIN ' + sql)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+        return self._full_scans(plan, sql)
+
+    def _full_scans(self, plan, sql):
+        aliases = dict((alias, table) for table, alias in ALIAS.findall(sql))
+        scans = []
+        for line in plan.splitlines():
+            if connection.vendor == 'sqlite':
+                match = SQLITE_SCAN.search(line)
+                # "SCAN t USING [COVERING] INDEX i" walks an index in order (ORDER BY ... LIMIT, COUNT): fine.
+                if not match or 'INDEX' in match.group(2):
+                    continue
+            else:
+                match = POSTGRES_SCAN.search(line)
+                if not match:
+                    continue
+            table = aliases.get(match.group(1), match.group(1))
+            if table in self.hot_tables:
+                scans.append(table)
+            if self.verbose_plans or table in self.hot_tables:
+                self.stdout.write(f'    {line.strip()}')
+        return scans
+
+    def _client(self, who, fixture):
+        client = Client()
+        if who == 'guest':
+            session = client.session
+            session.save()
+            Cart.objects.filter(pk=fixture['guest_cart'].pk).update(session_key=session.session_key)
+            AIChatSession.objects.filter(pk=fixture['guest_ai_session'].pk).update(session_key=session.session_key)
+        elif who != 'anonymous':
+            client.force_login(fixture[who])
+        return client
+
+    def _seed(self, total_orders):
+        rng = random.Random(17)
+        now = timezone.now()
+        admin = User.objects.create_user('plan-admin')
+        admin.profile.role = 'admin'
+        admin.profile.save()
+        customers = [User.objects.create_user(f'plan-customer-{i}') for i in range(20)]
+
+        category = Category.objects.create(name='Query plans', slug='query-plans')
+        products = Product.objects.bulk_create([
+            Product(title=f'Trà thử {i}', slug=f'plan-product-{i}', category=category, price=1000 + i,
+                    physical_stock=100, total_available_stock=100)
+            for i in range(100)
+        ])
+        ProductVariation.objects.bulk_create([
+            ProductVariation(product=product, title='Hộp 100g', price=product.price, physical_stock=50)
+            for product in products[:30]
+        ])
+
+        statuses = [status for status, _ in Order.STATUS_CHOICES]
+        orders = Order.objects.bulk_create([
+            Order(user=rng.choice(customers), order_number=f'ORD-PLAN-{i:06d}', status=rng.choice(statuses),
+                  total_amount=2000)
+            for i in range(total_orders)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, product_title=product.title, quantity=1, price=product.price)
+            for order in orders for product in rng.sample(products, 2)
+        ])
+        InventoryTransaction.objects.bulk_create([
+            InventoryTransaction(product=rng.choice(products), transaction_type='RESERVE', quantity=-1,
+                                 is_physical=False, reference_id=order.order_number)
+            for order in orders for _ in range(2)
+        ])
+
+        carts = Cart.objects.bulk_create([Cart(session_key=f'plan-session-{i:06d}') for i in range(total_orders // 3)])
+        Cart.objects.filter(pk__in=[cart.pk for cart in carts[::2]]).update(updated_at=now - timedelta(days=1))
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=rng.choice(products)) for cart in carts])
+        for customer in customers[:1]:
+            CartItem.objects.create(cart=customer.cart, product=products[0], quantity=2)
+
+        sessions = AIChatSession.objects.bulk_create(
+            [AIChatSession(session_key=f'plan-session-{i:06d}') for i in range(total_orders // 3)]
+            + [AIChatSession(user=customer) for customer in customers]
+        )
+        AIChatMessage.objects.bulk_create([
+            AIChatMessage(session=session, sender=sender, content='Xin chào')
+            for session in sessions for sender in ('user', 'ai', 'user', 'ai')
+        ])
+
+        ticket_statuses = [status for status, _ in SupportTicket.STATUS_CHOICES]
+        tickets = SupportTicket.objects.bulk_create([
+            SupportTicket(user=rng.choice(customers), subject=f'Hỗ trợ {i}', status=rng.choice(ticket_statuses))
+            for i in range(total_orders // 3)
+        ])
+        SupportMessage.objects.bulk_create([
+            SupportMessage(ticket=ticket, sender_type='customer', content='Cần hỗ trợ') for ticket in tickets
+        ])
+        agents = [User.objects.create_user(f'plan-agent-{i}', first_name=f'Agent {i}') for i in range(3)]
+        long_ticket, short_ticket = SupportTicket.objects.bulk_create([
+            SupportTicket(user=customers[0], subject='Lịch sử dài', status='assigned', assigned_to=agents[0]),
+            SupportTicket(user=customers[0], subject='Lịch sử ngắn', status='assigned', assigned_to=agents[0]),
+        ])
+        history = SupportMessage.objects.bulk_create([
+            SupportMessage(ticket=ticket, sender_type='customer' if i % 2 else 'agent',
+                           sender=customers[0] if i % 2 else agents[i % 3], content=f'Tin nhắn {i}')
+            for ticket, length in ((long_ticket, 200), (short_ticket, 3)) for i in range(length)
+        ])
+        SupportAttachment.objects.bulk_create([
+            SupportAttachment(message=message, file=f'support_attachments/plan-{message.pk}.png', file_name='anh.png')
+            for message in history[::5]
+        ])
+        Notification.objects.bulk_create([
+            Notification(user=rng.choice(customers), notification_type='order', title='Cập nhật', message='...')
+            for _ in range(total_orders)
+        ])
+        # One at a time: saving a message moves the conversation's pointer and the read cursors.
+        conversations = []
+        for other in customers[1:]:
+            conversation = Conversation.objects.create()
+            conversation.participants.add(customers[0], other)
+            for i, sender in enumerate((other, customers[0], other)):
+                Message.objects.create(conversation=conversation, sender=sender, content=f'Tin nhắn {i}')
+            conversations.append(conversation)
+
+        customer = customers[0]
+        return {
+            'admin': admin,
+            'customer': customer,
+            'product': products[0],
+            'order': Order.objects.filter(user=customer).first(),
+            'session_key': carts[0].session_key,
+            'guest_cart': carts[1],
+            'guest_ai_session': sessions[1],
+            'ai_session': AIChatSession.objects.get(user=customer),
+            'long_ticket': long_ticket,
+            'short_ticket': short_ticket,
+            'pen_pal': customers[1],
+            'conversation': conversations[0],
+        }
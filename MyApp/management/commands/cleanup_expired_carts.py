@@ -1,9 +1,12 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from MyApp.models import Cart, CartItem, InventoryTransaction, Product, ProductVariation
+from MyApp.models import Cart, CartItem
+from MyApp import inventory
 from datetime import timedelta
 from django.db import transaction
-from django.db.models import F
+from django.db.models import Sum, Count
 
 class Command(BaseCommand):
     help = 'Giải phóng kho hàng cho các giỏ hàng đã hết hạn (không hoạt động quá 60 phút)'
@@ -15,58 +18,73 @@ class Command(BaseCommand):
             default=60,
             help='Số phút tối đa cho phép giỏ hàng không hoạt động trước khi giải phóng kho'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Số giỏ hàng xử lý trong một transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Chỉ thống kê, không giải phóng kho và không xóa giỏ hàng'
+        )
 
     def handle(self, *args, **options):
         minutes = options['minutes']
+        batch_size = max(1, options['batch_size'])
         threshold = timezone.now() - timedelta(minutes=minutes)
-        
+
         # Tìm các giỏ hàng không được cập nhật sau thời gian threshold
-        expired_carts = Cart.objects.filter(updated_at__lt=threshold)
-        
-        total_released = 0
-        cart_count = expired_carts.count()
-        
+        cart_ids = list(Cart.objects.filter(updated_at__lt=threshold).order_by('id').values_list('id', flat=True))
+        cart_count = len(cart_ids)
+
         self.stdout.write(self.style.NOTICE(f"Đang kiểm tra {cart_count} giỏ hàng quá hạn..."))
 
-        for cart in expired_carts:
-            items = cart.items.all()
-            if not items.exists():
-                # Xóa giỏ trống quá hạn giúp dọn dẹp DB
-                cart.delete()
-                continue
-                
-            with transaction.atomic():
-                for item in items:
-                    try:
-                        target = item.variation if item.variation else item.product
-                        if not target:
-                            continue
-                            
-                        # Lock target để tránh race condition khi hoàn trả
-                        target = type(target).objects.select_for_update().get(id=target.id)
-                        
-                        # Giải phóng stock - đảm bảo không bị âm (Safe Release)
-                        release_qty = min(item.quantity, target.reserved_stock)
-                        if release_qty > 0:
-                            target.reserved_stock = F('reserved_stock') - release_qty
-                            target.save()
-                            
-                            # Ghi log giải phóng thực tế
-                            InventoryTransaction.objects.create(
-                                product=item.product,
-                                variation=item.variation,
-                                transaction_type='RELEASE',
-                                quantity=release_qty,
-                                is_physical=False,
-                                reference_id=f"CART_EXP_{cart.id} | Tự động giải phóng {release_qty}"[:100]
-                            )
-                            total_released += release_qty
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f"Lỗi khi xử lý item {item.id} trong giỏ {cart.id}: {e}"))
-                
-                # Sau khi giải phóng kho xong cho tất cả items, xóa giỏ hàng
-                cart_id = cart.id
-                cart.delete()
-                self.stdout.write(self.style.SUCCESS(f"Đã giải phóng kho và xóa giỏ hàng ID: {cart_id}"))
+        if options['dry_run']:
+            totals = CartItem.objects.filter(cart__updated_at__lt=threshold).aggregate(items=Count('id'), quantity=Sum('quantity'))
+            self.stdout.write(
+                f"[dry-run] Sẽ xóa {cart_count} giỏ hàng ({totals['items']} dòng sản phẩm) "
+                f"và giải phóng tối đa {totals['quantity'] or 0} sản phẩm đang giữ."
+            )
+            return
+
+        total_released = 0
+        total_deleted = 0
+        started = time.perf_counter()
+        for start in range(0, cart_count, batch_size):
+            released, deleted = self._release_batch(cart_ids[start:start + batch_size], threshold)
+            total_released += released
+            total_deleted += deleted
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"[{min(start + batch_size, cart_count)}/{cart_count}] đã xóa {total_deleted} giỏ, "
+                f"giải phóng {total_released} sản phẩm · {total_deleted / elapsed if elapsed else 0:.0f} giỏ/s"
+            )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Hoàn tất! Đã giải phóng {total_released} sản phẩm từ {total_deleted} giỏ hàng hết hạn "
+            f"trong {elapsed:.1f}s ({total_deleted / elapsed if elapsed else 0:.0f} giỏ/s)."
+        ))
 
-        self.stdout.write(self.style.SUCCESS(f"Hoàn tất! Đã giải phóng {total_released} sản phẩm từ các giỏ hàng hết hạn."))
+    def _release_batch(self, cart_ids, threshold):
+        """Một transaction cho cả lô: giải phóng kho theo từng sản phẩm/biến thể, ghi log và xóa giỏ."""
+        with transaction.atomic():
+            # Bỏ qua giỏ vừa được cập nhật lại sau khi lấy danh sách
+            cart_ids = list(
+                Cart.objects.filter(id__in=cart_ids, updated_at__lt=threshold).values_list('id', flat=True)
+            )
+            items = (
+                CartItem.objects.filter(cart_id__in=cart_ids)
+                .select_related('product', 'variation__product')
+                .order_by('cart_id', 'id')
+            )
+            holds = [
+                (inventory.StockLine(item.product, item.variation, item.quantity), f"CART_EXP_{item.cart_id}")
+                for item in items
+            ]
+            released = inventory.release_holds(holds, note='Tự động giải phóng {quantity}') if holds else 0
+            # Sau khi giải phóng kho xong cho tất cả items, xóa giỏ hàng
+            Cart.objects.filter(id__in=cart_ids).delete()
+        return released, len(cart_ids)
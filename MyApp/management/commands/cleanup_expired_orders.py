@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from MyApp.models import Order
+from MyApp import bulk_transitions
 from datetime import timedelta
 
 class Command(BaseCommand):
@@ -13,6 +14,17 @@ class Command(BaseCommand):
             default=24,
             help='Số giờ tối đa cho phép đơn hàng ở trạng thái chờ trước khi hủy'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Số đơn hàng hủy trong một transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Chỉ đếm số đơn sẽ bị hủy, không thay đổi gì'
+        )
 
     def handle(self, *args, **options):
         hours = options['hours']
@@ -23,25 +35,31 @@ class Command(BaseCommand):
         expired_orders = Order.objects.filter(
             status__in=['pending', 'confirmed'],
             created_at__lt=threshold
-        ).exclude(payment__payment_method='cod') # Không tự động hủy đơn COD vì khách thanh toán sau
+        ).exclude(
+            payment__payment_method='cod' # Không tự động hủy đơn COD vì khách thanh toán sau
+        ).exclude(
+            payment__payment_status='completed' # Đã thanh toán (phòng hờ)
+        )
 
         count = expired_orders.count()
         self.stdout.write(self.style.NOTICE(f'Tìm thấy {count} đơn hàng quá hạn ({hours} giờ)...'))
+        if options['dry_run'] or not count:
+            return
 
-        cancelled_count = 0
-        for order in expired_orders:
-            # Kiểm tra xem có payment completed chưa (phòng hờ)
-            try:
-                if hasattr(order, 'payment') and order.payment.payment_status == 'completed':
-                    continue
-            except:
-                pass
+        def progress(metrics):
+            self.stdout.write(
+                f'[{metrics.selected}/{count}] đã hủy {metrics.changed} đơn · {metrics.rate:.0f} đơn/s'
+            )
 
-            success, msg = order.action_cancel(note=f"Hủy tự động hệ thống do quá hạn {hours} giờ.")
-            if success:
-                cancelled_count += 1
-                self.stdout.write(self.style.SUCCESS(f'Đã hủy đơn: {order.order_number}'))
-            else:
-                self.stdout.write(self.style.ERROR(f'Lỗi khi hủy đơn {order.order_number}: {msg}'))
-
-        self.stdout.write(self.style.SUCCESS(f'Hoàn tất! Đã giải phóng kho cho {cancelled_count} đơn hàng.'))
+        note = f"Hủy tự động hệ thống do quá hạn {hours} giờ."
+        metrics = bulk_transitions.run(
+            expired_orders,
+            lambda orders: bulk_transitions.cancel_orders(orders, note=note),
+            chunk_size=max(1, options['batch_size']),
+            name='cancel_orders',
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Hoàn tất! Đã giải phóng kho cho {metrics.changed} đơn hàng '
+            f'trong {metrics.elapsed:.1f}s ({metrics.rate:.0f} đơn/s).'
+        ))
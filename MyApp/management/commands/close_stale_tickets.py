@@ -6,7 +6,8 @@ Cấu hình cron: mỗi giờ, hoặc mỗi 6 giờ.
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
-from MyApp.models import SupportTicket, SupportMessage
+from MyApp.models import SupportTicket
+from MyApp import bulk_transitions
 
 
 class Command(BaseCommand):
@@ -17,6 +18,10 @@ class Command(BaseCommand):
             '--hours', type=int, default=24,
             help='Số giờ sau khi resolved để auto-close (mặc định 24h)'
         )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Số ticket đóng trong một transaction (mặc định 500)'
+        )
         parser.add_argument(
             '--dry-run', action='store_true',
             help='Chỉ hiển thị, không thực hiện thay đổi'
@@ -41,18 +46,17 @@ class Command(BaseCommand):
                 self.stdout.write(f'  - Ticket #{t.id} | {t.display_name} | resolved: {t.resolved_at}')
             return
 
-        closed_count = 0
-        for ticket in stale_tickets:
-            # Create system message
-            SupportMessage.objects.create(
-                ticket=ticket,
-                sender_type='system',
-                content=f'Ticket đã tự động đóng sau {hours} giờ.',
-            )
-            ticket.status = 'closed'
-            ticket.save(update_fields=['status', 'updated_at'])
-            closed_count += 1
+        message = f'Ticket đã tự động đóng sau {hours} giờ.'
+        metrics = bulk_transitions.run(
+            stale_tickets,
+            lambda tickets: bulk_transitions.close_tickets(tickets, message=message),
+            chunk_size=max(1, options['batch_size']),
+            name='close_tickets',
+        )
 
         self.stdout.write(
-            self.style.SUCCESS(f'✓ Đã đóng {closed_count} ticket stale (resolved > {hours}h)')
+            self.style.SUCCESS(
+                f'✓ Đã đóng {metrics.changed} ticket stale (resolved > {hours}h) '
+                f'trong {metrics.elapsed:.1f}s ({metrics.rate:.0f} ticket/s)'
+            )
         )
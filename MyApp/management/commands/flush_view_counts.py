@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from MyApp import view_counter
+
+
+class Command(BaseCommand):
+    """
+    Run every few minutes when VIEW_COUNT_STORE is 'cache', from cron or as a
+    django-q schedule:
+
+        Schedule.objects.create(func='MyApp.tasks.flush_view_counts_task',
+                                schedule_type=Schedule.MINUTES, minutes=5)
+    """
+    help = 'Add the product views counted in the cache to Product.views_count'
+
+    def handle(self, *args, **options):
+        if not view_counter.uses_cache():
+            self.stdout.write(self.style.WARNING(
+                'Views are counted in each web process (memory store) and flushed by those processes; '
+                'nothing to do here.'
+            ))
+            return
+        updated = view_counter.flush()
+        self.stdout.write(self.style.SUCCESS(f'Updated the view count of {updated} products.'))
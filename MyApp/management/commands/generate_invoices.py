@@ -1,10 +1,18 @@
+import django
 from django.core.management.base import BaseCommand, CommandError
 from django.core.files.base import ContentFile
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections
 from django.utils import timezone
+from MyApp import render_cache
 from MyApp.models import Order, Invoice, Payment
 from MyApp.invoices import InvoicePDFGenerator, InvoiceWithQRGenerator
+from MyApp.signals import log_bulk_create
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
+import queue
+import threading
+import time
 
 
 class Command(BaseCommand):
@@ -41,6 +49,20 @@ class Command(BaseCommand):
             default='confirmed',
             help='Chỉ generate invoices cho orders có status này (default: confirmed)',
         )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Số process render PDF song song (default: 1 = chạy tuần tự trong process hiện tại)',
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Số orders mỗi lô: tải dữ liệu, lưu Invoice và báo tiến độ theo lô (default: 200)',
+        )
     
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('🚀 Bắt đầu generate invoices...'))
@@ -63,70 +85,164 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('⚠️  Không có orders để generate'))
             return
         
+        order_ids = list(orders.order_by('id').values_list('id', flat=True))
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+        mailer = InvoiceMailer(self) if options['send_email'] else None
+
         # Generate invoices
         success_count = 0
         error_count = 0
-        
-        for idx, order in enumerate(orders, 1):
-            try:
-                self.stdout.write(f"\n[{idx}/{total}] Generating {order.order_number}...", ending='')
-                
+        started = time.perf_counter()
+
+        executor = None
+        if workers > 1:
+            # Workers only render PDFs and write files; they never use the
+            # database, so no connection is shared with them. django.setup()
+            # is needed where processes are spawned instead of forked.
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+        if mailer:
+            mailer.start()
+
+        try:
+            for start in range(0, len(order_ids), batch_size):
+                batch = list(
+                    Order.objects.filter(id__in=order_ids[start:start + batch_size])
+                    .select_related('user', 'user__profile', 'payment')
+                    .prefetch_related('items')
+                    .order_by('id')
+                )
+
                 # Xóa invoice cũ nếu force
                 if options['force']:
-                    try:
-                        order.invoice.delete()
-                    except:
-                        pass
-                
-                # Tạo PDF
-                if options['with_qr']:
-                    generator = InvoiceWithQRGenerator(order, payment_method='bank')
-                else:
-                    generator = InvoicePDFGenerator(order)
-                
-                pdf_buffer = generator.generate()
-                pdf_bytes = pdf_buffer.getvalue()
-                
-                # Lưu vào database
-                invoice = Invoice.objects.create(
-                    order=order,
-                    pdf_file=ContentFile(pdf_bytes, name=f'invoice_{order.order_number}.pdf'),
+                    Invoice.objects.filter(order__in=batch).delete()
+
+                rendered, errors = self._render_batch(batch, options['with_qr'], executor)
+                for order, error in errors:
+                    self.stdout.write(self.style.ERROR(f'❌ {order.order_number}: {error}'))
+                error_count += len(errors)
+
+                # Lưu vào database (một lô)
+                invoices = self._save_batch(rendered)
+                success_count += len(invoices)
+
+                # Gửi email nếu yêu cầu (qua một kết nối SMTP dùng chung, chạy nền)
+                if mailer:
+                    for invoice, (order, _, pdf_bytes) in zip(invoices, rendered):
+                        mailer.put(invoice, order, pdf_bytes)
+
+                done = min(start + batch_size, len(order_ids))
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"[{done}/{total}] {success_count} invoices, {error_count} lỗi · "
+                    f"{success_count / elapsed if elapsed else 0:.1f} invoices/s"
                 )
-                
-                self.stdout.write(self.style.SUCCESS(' ✅'))
-                
-                # Gửi email nếu yêu cầu
-                if options['send_email']:
-                    try:
-                        self._send_invoice_email(order, pdf_bytes)
-                        self.stdout.write(self.style.SUCCESS('   └─ 📧 Email sent'))
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(f'   └─ ⚠️  Email failed: {str(e)}'))
-                
-                success_count += 1
-                
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f' ❌ {str(e)}'))
-                error_count += 1
-        
+        finally:
+            if executor:
+                executor.shutdown()
+            if mailer:
+                mailer.close()
+
+        elapsed = time.perf_counter() - started
+
         # Summary
         self.stdout.write('\n' + '='*70)
         self.stdout.write(self.style.SUCCESS(f'✅ Success: {success_count}/{total}'))
         if error_count > 0:
             self.stdout.write(self.style.ERROR(f'❌ Errors: {error_count}/{total}'))
+        if mailer:
+            self.stdout.write(f'📧 Emails sent: {mailer.sent_count}, failed: {mailer.failed_count}')
+        self.stdout.write(
+            f'⏱  {elapsed:.1f}s · {success_count / elapsed if elapsed else 0:.1f} invoices/s · {workers} worker(s)'
+        )
         self.stdout.write('='*70)
-    
-    def _send_invoice_email(self, order, pdf_bytes):
-        """
-        Gửi invoice email
-        """
-        if not order.user.email:
-            raise Exception("User không có email")
-        
-        # Tạo email
-        email = EmailMessage(
-            subject=f'Hóa đơn {order.order_number} - Tea Company',
-            body=f'''
+
+    def _render_batch(self, batch, with_qr, executor):
+        """Returns ([(order, pdf_name, pdf_bytes)], [(order, error)])."""
+        rendered = []
+        errors = []
+        if executor is None:
+            for order in batch:
+                try:
+                    rendered.append((order, *render_invoice_pdf(order, with_qr)))
+                except Exception as e:
+                    errors.append((order, e))
+            return rendered, errors
+
+        futures = {executor.submit(render_invoice_pdf, order, with_qr): order for order in batch}
+        for future in as_completed(futures):
+            order = futures[future]
+            try:
+                rendered.append((order, *future.result()))
+            except Exception as e:
+                errors.append((order, e))
+        rendered.sort(key=lambda row: row[0].id)
+        return rendered, errors
+
+    def _save_batch(self, rendered):
+        """Tạo Invoice cho cả lô bằng một bulk_create."""
+        if not rendered:
+            return []
+        numbers = _unique_invoice_numbers(len(rendered))
+        invoices = [
+            Invoice(order=order, pdf_file=pdf_name, invoice_number=number)
+            for (order, pdf_name, _), number in zip(rendered, numbers)
+        ]
+        try:
+            Invoice.objects.bulk_create(invoices)
+        except Exception:
+            # Không Invoice nào trỏ tới các PDF vừa ghi: xóa để không để lại file mồ côi.
+            storage = Invoice._meta.get_field('pdf_file').storage
+            for _, pdf_name, _ in rendered:
+                storage.delete(pdf_name)
+            raise
+        log_bulk_create(Invoice, invoices)
+        # bulk_create không gửi post_save: xóa bản render đã cache như render_cache.invalidate_order_of.
+        for invoice in invoices:
+            render_cache.invalidate(invoice.order_id)
+        return invoices
+
+
+def render_invoice_pdf(order, with_qr):
+    """
+    Render PDF hóa đơn và ghi file vào storage của Invoice.pdf_file.
+    Chạy được trong process con: order đã được tải sẵn (kèm items, user, payment)
+    nên không cần truy vấn database. Trả về (tên file đã lưu, nội dung PDF).
+    """
+    if with_qr:
+        generator = InvoiceWithQRGenerator(order, payment_method='bank')
+    else:
+        generator = InvoicePDFGenerator(order)
+    pdf_bytes = generator.generate().getvalue()
+
+    field = Invoice._meta.get_field('pdf_file')
+    name = field.generate_filename(None, f'invoice_{order.order_number}.pdf')
+    name = field.storage.save(name, ContentFile(pdf_bytes), max_length=field.max_length)
+    return name, pdf_bytes
+
+
+def _unique_invoice_numbers(count):
+    """Số hóa đơn mới cho cả lô, không trùng nhau và không trùng với database."""
+    numbers = set()
+    while len(numbers) < count:
+        candidates = {Invoice.new_invoice_number() for _ in range(count - len(numbers))} - numbers
+        taken = set(Invoice.objects.filter(invoice_number__in=candidates).values_list('invoice_number', flat=True))
+        numbers |= candidates - taken
+    return list(numbers)
+
+
+def build_invoice_email(order, pdf_bytes):
+    """
+    Tạo email hóa đơn
+    """
+    if not order.user.email:
+        raise Exception("User không có email")
+
+    # Tạo email
+    email = EmailMessage(
+        subject=f'Hóa đơn {order.order_number} - Tea Company',
+        body=f'''
 Xin chào {order.user.first_name or order.user.username},
 
 Hóa đơn của bạn đã được tạo thành công.
@@ -146,30 +262,82 @@ Tea Company
 Điện thoại: (84) 123-456-789
 Email: admin@teacompany.com
             ''',
-            from_email='admin@teacompany.com',
-            to=[order.user.email],
-        )
-        
-        # Đính kèm PDF
-        email.attach(
-            f'invoice_{order.order_number}.pdf',
-            pdf_bytes,
-            'application/pdf'
-        )
-        
-        # Gửi
-        email.send()
-        
+        from_email='admin@teacompany.com',
+        to=[order.user.email],
+    )
+
+    # Đính kèm PDF
+    email.attach(
+        f'invoice_{order.order_number}.pdf',
+        pdf_bytes,
+        'application/pdf'
+    )
+    return email
+
+
+class InvoiceMailer:
+    """
+    Gửi email hóa đơn ở một thread nền qua một kết nối SMTP mở sẵn, trong khi
+    các lô tiếp theo vẫn đang render. sent_at được cập nhật theo lô.
+    """
+    BATCH = 50
+
+    def __init__(self, command):
+        self.command = command
+        self.queue = queue.Queue(maxsize=1000)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.sent_ids = []
+        self.sent_count = 0
+        self.failed_count = 0
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, invoice, order, pdf_bytes):
+        try:
+            message = build_invoice_email(order, pdf_bytes)
+        except Exception as e:
+            self.failed_count += 1
+            self.command.stdout.write(self.command.style.WARNING(f'⚠️  {order.order_number}: Email failed: {e}'))
+            return
+        self.queue.put((invoice.id, order.order_number, message))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
         # Cập nhật sent_at
+        for start in range(0, len(self.sent_ids), 1000):
+            Invoice.objects.filter(id__in=self.sent_ids[start:start + 1000]).update(sent_at=timezone.now())
+
+    def _run(self):
+        connection = get_connection()
         try:
-            invoice = order.invoice
-            invoice.sent_at = timezone.now()
-            invoice.save()
-        except:
-            pass
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                self._send(connection, item)
+        finally:
+            connection.close()
+
+    def _send(self, connection, item):
+        invoice_id, order_number, message = item
+        try:
+            connection.send_messages([message])
+        except Exception as e:
+            self.failed_count += 1
+            self.command.stdout.write(self.command.style.WARNING(f'⚠️  {order_number}: Email failed: {e}'))
+            try:
+                connection.close()  # Mở lại kết nối cho email sau
+            except Exception:
+                pass
+            return
+        self.sent_ids.append(invoice_id)
+        self.sent_count += 1
 
 
 # Để chạy command:
 # python manage.py generate_invoices
 # python manage.py generate_invoices --with-qr --send-email
 # python manage.py generate_invoices --order-ids 1,2,3 --force
+# python manage.py generate_invoices --workers 8 --batch-size 500 --send-email
@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from MyApp.sales_rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollups used by the admin statistics page from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Only rebuild the last N days (default: the whole history)',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days'] is not None:
+            since = timezone.localdate() - timedelta(days=options['days'])
+            self.stdout.write(f'Rebuilding sales rollups since {since}...')
+        else:
+            self.stdout.write('Rebuilding sales rollups for the whole order history...')
+
+        days, product_rows = rebuild(since=since)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {days} daily summaries and {product_rows} product/day rows.'
+        ))
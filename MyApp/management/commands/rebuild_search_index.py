@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from MyApp.search import rebuild_index, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index (after bulk imports that bypass save())'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Products indexed per batch (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} products (backend: {get_backend().name}).'
+        ))
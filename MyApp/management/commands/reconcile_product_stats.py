@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from MyApp.product_stats import find_drift, refresh
+
+
+class Command(BaseCommand):
+    help = 'Check Product.total_available_stock, avg_rating and review_count against variations and reviews, and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the products whose stored values are wrong',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute every product instead of only the drifted ones',
+        )
+
+    def handle(self, *args, **options):
+        if options['all'] and not options['dry_run']:
+            updated = refresh()
+            self.stdout.write(self.style.SUCCESS(f'Recomputed the stored values of {updated} products.'))
+            return
+
+        drift = find_drift()
+        for product_id, wrong in drift[:50]:
+            details = ', '.join(f'{field} {stored} != {actual}' for field, (stored, actual) in wrong.items())
+            self.stdout.write(f'  product #{product_id}: {details}')
+        if len(drift) > 50:
+            self.stdout.write(f'  ... and {len(drift) - 50} more')
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('No drift: every product is up to date.'))
+            return
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} products have drifted (dry run, nothing repaired).'))
+            return
+
+        with transaction.atomic():
+            refresh([product_id for product_id, _ in drift])
+        self.stdout.write(self.style.SUCCESS(f'Repaired {len(drift)} products.'))
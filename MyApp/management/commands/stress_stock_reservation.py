@@ -0,0 +1,225 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, OperationalError
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+
+from MyApp.models import Category, Product, ProductVariation, Order, OrderItem, InventoryTransaction
+from ._benchmark import temporary_database, timer, format_summary
+
+BUSY_RETRIES = 10
+BATCH_SLACK = 3
+
+
+class Command(BaseCommand):
+    help = 'Confirm, cancel and complete many orders concurrently and check that stock is never oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='Number of concurrent threads placing orders (default: 8)',
+        )
+        parser.add_argument(
+            '--orders', type=int, default=400,
+            help='Total number of orders placed (default: 400)',
+        )
+        parser.add_argument(
+            '--products', type=int, default=4,
+            help='Contended products; each also gets one variation (default: 4)',
+        )
+        parser.add_argument(
+            '--stock', type=int, default=150,
+            help='Physical stock of every product and variation (default: 150)',
+        )
+        parser.add_argument(
+            '--lines', type=int, default=4,
+            help='Order lines per order (default: 4)',
+        )
+
+    def handle(self, *args, **options):
+        with temporary_database(on_disk=True):
+            self._query_counts()
+            self._stress(options)
+
+    def _query_counts(self):
+        counts = query_counts()
+        for size, (confirm, complete) in counts.items():
+            self.stdout.write(f'{size:>3} order lines: action_confirm {confirm} queries, '
+                              f'action_complete {complete} queries')
+        if counts_grow(counts):
+            raise CommandError('Query count grows with the number of order lines.')
+
+    def _stress(self, options):
+        stock = options['stock']
+        category = Category.objects.create(name='Stress', slug='stress')
+        products = Product.objects.bulk_create([
+            Product(title=f'Stress {i}', slug=f'stress-{i}', category=category, price=1000, physical_stock=stock)
+            for i in range(options['products'])
+        ])
+        variations = ProductVariation.objects.bulk_create([
+            ProductVariation(product=product, title='100g', price=1500, physical_stock=stock)
+            for product in products
+        ])
+        targets = [(product, None) for product in products] + [(v.product, v) for v in variations]
+        user = User.objects.create_user('stock-stress')
+
+        lock = threading.Lock()
+        next_order = iter(range(options['orders']))
+        results = {'confirmed': 0, 'rejected': 0, 'cancelled': 0, 'completed': 0, 'busy': 0, 'gave_up': 0, 'errors': []}
+        samples = []
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        n = next(next_order, None)
+                    if n is None:
+                        return
+                    rng = random.Random(n)
+                    picks = rng.sample(targets, min(options['lines'], len(targets)))
+                    lines = [(product, variation, rng.randint(1, 3)) for product, variation in picks]
+                    try:
+                        outcome = self._place(user, lines, rng, samples)
+                    except Exception as e:
+                        with lock:
+                            results['errors'].append(repr(e))
+                        continue
+                    with lock:
+                        for key in outcome:
+                            results[key] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(
+            f"{options['orders']} orders from {options['workers']} threads: {results['confirmed']} confirmed, "
+            f"{results['rejected']} rejected for stock, {results['cancelled']} cancelled, "
+            f"{results['completed']} completed, {results['busy']} database-busy retries, "
+            f"{results['gave_up']} actions given up after {BUSY_RETRIES} retries"
+        )
+        self.stdout.write(format_summary('action_confirm', samples))
+        for error in results['errors'][:10]:
+            self.stderr.write(self.style.ERROR(error))
+
+        problems = self._check(products, variations, stock)
+        for problem in problems:
+            self.stderr.write(self.style.ERROR(problem))
+        if problems or results['errors']:
+            raise CommandError('Stock reservation stress test failed.')
+        self.stdout.write(self.style.SUCCESS('No overselling: stock, reservations and ledger are consistent.'))
+
+    def _place(self, user, lines, rng, samples):
+        outcome = []
+
+        def confirm():
+            with transaction.atomic():
+                order = _create_order(user, lines)
+                with timer(samples):
+                    success, _ = order.action_confirm()
+                if not success:
+                    transaction.set_rollback(True)
+                    return None
+            return order
+
+        order = _retry(confirm, outcome)
+        if order is None:
+            if 'gave_up' not in outcome:
+                outcome.append('rejected')
+            return outcome
+        outcome.append('confirmed')
+        roll = rng.random()
+        # A fresh instance per attempt: a failed attempt may have changed order.status in memory.
+        if roll < 0.25 and _retry(lambda: Order.objects.get(pk=order.pk).action_cancel(), outcome):
+            outcome.append('cancelled')
+        elif 0.25 <= roll < 0.5 and _retry(lambda: Order.objects.get(pk=order.pk).action_complete(), outcome):
+            outcome.append('completed')
+        return outcome
+
+    def _check(self, products, variations, stock):
+        problems = []
+        held_statuses = ['confirmed']
+        for model, instances, field in ((Product, products, 'product'), (ProductVariation, variations, 'variation')):
+            for target in model.objects.filter(id__in=[i.id for i in instances]):
+                items = OrderItem.objects.filter(**{field: target})
+                if field == 'product':
+                    items = items.filter(variation__isnull=True)
+                reserved = items.filter(order__status__in=held_statuses).aggregate(n=Sum('quantity'))['n'] or 0
+                shipped = items.filter(order__status='delivered').aggregate(n=Sum('quantity'))['n'] or 0
+                ledger = InventoryTransaction.objects.filter(**{field: target})
+                if field == 'product':
+                    ledger = ledger.filter(variation__isnull=True)
+                ledger_reserved = ledger.filter(is_physical=False).aggregate(n=Sum('quantity'))['n'] or 0
+                ledger_physical = ledger.filter(is_physical=True).aggregate(n=Sum('quantity'))['n'] or 0
+
+                if target.reserved_stock > target.physical_stock or target.physical_stock < 0:
+                    problems.append(f'{target}: oversold (physical {target.physical_stock}, reserved {target.reserved_stock})')
+                if target.reserved_stock != reserved:
+                    problems.append(f'{target}: reserved_stock {target.reserved_stock} != {reserved} held by orders')
+                if target.physical_stock != stock - shipped:
+                    problems.append(f'{target}: physical_stock {target.physical_stock} != {stock - shipped}')
+                if ledger_reserved != target.reserved_stock or ledger_physical != -shipped:
+                    problems.append(f'{target}: ledger does not add up')
+        return problems
+
+
+def query_counts(sizes=(1, 10, 50)):
+    """{order lines: (queries of action_confirm, of action_complete)} for an order of each size."""
+    user = User.objects.create_user('stock-query-count')
+    category = Category.objects.create(name='Query count', slug='query-count')
+    counts = {}
+    for size in sizes:
+        products = Product.objects.bulk_create([
+            Product(title=f'Q{size}-{i}', slug=f'query-count-{size}-{i}', category=category, price=1000, physical_stock=100)
+            for i in range(size)
+        ])
+        order = _create_order(user, [(product, None, 1) for product in products])
+        with CaptureQueriesContext(connection) as confirm:
+            order.action_confirm()
+        with CaptureQueriesContext(connection) as complete:
+            order.action_complete()
+        counts[size] = (len(confirm), len(complete))
+    return counts
+
+
+def counts_grow(counts):
+    """Whether the number of queries per action grows with the number of order lines."""
+    # Large bulk inserts may be split into a few batches (SQLite's parameter limit).
+    smallest = counts[min(counts)]
+    return any(n - smallest[i] > BATCH_SLACK for size_counts in counts.values() for i, n in enumerate(size_counts))
+
+
+def _retry(action, outcome):
+    """
+    Run ``action``, retrying when the database reports lock contention.
+    SQLite fails a write transaction with "database is locked" instead of
+    waiting when two writers upgrade their locks at the same time. Returns
+    None when every attempt failed.
+    """
+    for attempt in range(BUSY_RETRIES):
+        try:
+            return action()
+        except OperationalError:
+            outcome.append('busy')
+            time.sleep(random.uniform(0.005, 0.02) * 2 ** min(attempt, 5))
+    # Still locked: the action was rolled back, which the final check must tolerate.
+    outcome.append('gave_up')
+    return None
+
+
+def _create_order(user, lines):
+    order = Order.objects.create(user=user, total_amount=0)
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, variation=variation, product_title=product.title,
+                  quantity=quantity, price=1000)
+        for product, variation, quantity in lines
+    ])
+    return order
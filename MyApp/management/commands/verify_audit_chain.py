@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+from MyApp.audit_models import AuditLog, AuditChainHead
+from MyApp.audit_sink import compute_hash, GENESIS_HASH
+
+FIELDS = ('log_id', 'chain_key', 'chain_seq', 'event_type', 'actor_id', 'resource_id', 'previous_hash', 'current_hash')
+
+
+class Command(BaseCommand):
+    help = 'Verify the SHA-256 hash chains of the audit log (streams the table, constant memory)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chain', type=str, default=None,
+            help='Only verify this chain key (default: all chains)',
+        )
+        parser.add_argument(
+            '--skip-legacy', action='store_true',
+            help='Skip entries written before chains were sharded (chain_seq is empty)',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched per database round trip (default: 2000)',
+        )
+        parser.add_argument(
+            '--max-errors', type=int, default=20,
+            help='Maximum number of problems printed (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        self.problems = 0
+        self.max_errors = options['max_errors']
+        chunk_size = options['chunk_size']
+        checked = 0
+
+        if not options['skip_legacy'] and not options['chain']:
+            legacy = AuditLog.objects.filter(chain_seq__isnull=True).order_by('timestamp')
+            count = self._verify_legacy(legacy.values_list(*FIELDS).iterator(chunk_size=chunk_size))
+            self.stdout.write(f'legacy: {count} entries checked')
+            checked += count
+
+        heads = {head.chain_key: head for head in AuditChainHead.objects.all()}
+        chained = AuditLog.objects.filter(chain_seq__isnull=False).order_by('chain_key', 'chain_seq')
+        if options['chain']:
+            chained = chained.filter(chain_key=options['chain'])
+
+        state = None  # [chain_key, last_seq, last_hash, count]
+        for row in chained.values_list(*FIELDS).iterator(chunk_size=chunk_size):
+            log_id, chain_key, seq, event_type, actor_id, resource_id, previous_hash, current_hash = row
+            if state is None or state[0] != chain_key:
+                if state is not None:
+                    self._finish_chain(state, heads.get(state[0]))
+                head = heads.get(chain_key)
+                if head is None:
+                    self._problem(f'{chain_key}: no chain head row')
+                if seq == 1:
+                    expected_prev = head.genesis_hash if head else GENESIS_HASH
+                    if previous_hash != expected_prev:
+                        self._problem(f'{chain_key}#1 ({log_id}): does not start from the genesis hash')
+                else:
+                    # Older entries were archived: start from this entry's own link.
+                    self.stdout.write(f'{chain_key}: entries before #{seq} are archived, verifying from there')
+                state = [chain_key, seq - 1, previous_hash, 0]
+
+            if seq != state[1] + 1:
+                self._problem(f'{chain_key}: entries #{state[1] + 1}..#{seq - 1} are missing')
+            if previous_hash != state[2]:
+                self._problem(f'{chain_key}#{seq} ({log_id}): previous_hash does not match entry #{seq - 1}')
+            if compute_hash(previous_hash, event_type, actor_id, resource_id) != current_hash:
+                self._problem(f'{chain_key}#{seq} ({log_id}): current_hash does not match its content')
+            state[1], state[2] = seq, current_hash
+            state[3] += 1
+            checked += 1
+
+        if state is not None:
+            self._finish_chain(state, heads.get(state[0]))
+
+        if self.problems:
+            raise CommandError(f'Audit chain verification failed: {self.problems} problem(s) in {checked} entries.')
+        self.stdout.write(self.style.SUCCESS(f'All {checked} audit entries verified.'))
+
+    def _verify_legacy(self, rows):
+        count = 0
+        last_hash = None
+        for log_id, _, _, event_type, actor_id, resource_id, previous_hash, current_hash in rows:
+            if last_hash is not None and previous_hash != last_hash:
+                self._problem(f'legacy ({log_id}): previous_hash does not match the preceding entry')
+            if compute_hash(previous_hash, event_type, actor_id, resource_id) != current_hash:
+                self._problem(f'legacy ({log_id}): current_hash does not match its content')
+            last_hash = current_hash
+            count += 1
+        return count
+
+    def _finish_chain(self, state, head):
+        chain_key, last_seq, last_hash, count = state
+        if head is not None and (head.last_seq != last_seq or head.last_hash != last_hash):
+            self._problem(f'{chain_key}: chain head (#{head.last_seq}) does not match the last entry (#{last_seq})')
+        self.stdout.write(f'{chain_key}: {count} entries checked')
+
+    def _problem(self, message):
+        self.problems += 1
+        if self.problems <= self.max_errors:
+            self.stderr.write(self.style.ERROR(message))
@@ -12,8 +12,65 @@ class AuditLogContextMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
+        from .audit_sink import audit_sink
+
         _thread_locals.request = request
+        try:
+            # Audit events of the whole request are written in one batch
+            with audit_sink.batch():
+                response = self.get_response(request)
+        finally:
+            if hasattr(_thread_locals, 'request'):
+                del _thread_locals.request
+        return response
+
+
+class StaffPresenceMiddleware:
+    """Record a presence heartbeat for staff users (see MyApp/presence.py)."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
         response = self.get_response(request)
-        if hasattr(_thread_locals, 'request'):
-            del _thread_locals.request
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and user.is_staff:
+            from .presence import heartbeat
+            heartbeat(user.pk)
+        return response
+
+
+class QueryInspectorMiddleware:
+    """
+    Record the SQL of a sample of requests and log a per-request summary,
+    flagging N+1 patterns and URLs over their budget (see MyApp/query_inspector.py).
+    Not used unless QUERY_INSPECTOR_SAMPLE_RATE > 0 or QUERY_BUDGET_STRICT.
+    """
+    def __init__(self, get_response):
+        from django.conf import settings
+        from django.core.exceptions import MiddlewareNotUsed
+        from . import query_inspector
+
+        self.strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+        if not self.strict and query_inspector.sample_rate() <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from . import query_inspector
+
+        if not self.strict and not query_inspector.should_sample():
+            return self.get_response(request)
+        with query_inspector.QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.view_name if match else None
+        problems = recorder.problems(query_inspector.budget_for(url_name))
+        summary = f'{request.method} {request.path} ({url_name}) {response.status_code}: {recorder.summary()}'
+        if problems and self.strict:
+            raise query_inspector.QueryBudgetExceeded('\n'.join([summary] + problems))
+        if problems:
+            query_inspector.logger.warning('%s\n  %s', summary, '\n  '.join(problems))
+        else:
+            query_inspector.logger.info(summary)
         return response
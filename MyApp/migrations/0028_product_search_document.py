@@ -0,0 +1,109 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:11
+
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db import DatabaseError
+from django.utils import timezone
+
+# Frozen copy of the index DDL and text folding of MyApp/search.py at the time
+# of this migration, so later changes there cannot break migrating a new database.
+FTS_TABLE = 'myapp_product_fts'
+DOC_TABLE = 'MyApp_productsearchdocument'
+PG_INDEX = 'myapp_product_search_gin'
+PG_VECTOR = (
+    "setweight(to_tsvector('simple', title), 'A') || "
+    "setweight(to_tsvector('simple', body), 'B')"
+)
+
+
+def fold_text(value):
+    if not value:
+        return ''
+    value = value.replace('đ', 'd').replace('Đ', 'D')
+    value = unicodedata.normalize('NFD', value)
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return value.lower()
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, body, content='{DOC_TABLE}', content_rowid='product_id', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+            )
+        except DatabaseError:
+            # SQLite built without FTS5: search falls back to icontains.
+            return
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {DOC_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.product_id, new.title, new.body); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {DOC_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) "
+            f"VALUES ('delete', old.product_id, old.title, old.body); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON {DOC_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) "
+            f"VALUES ('delete', old.product_id, old.title, old.body); "
+            f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.product_id, new.title, new.body); END"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON "{DOC_TABLE}" USING GIN (({PG_VECTOR}))'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+
+
+def backfill_search_documents(apps, schema_editor):
+    Product = apps.get_model('MyApp', 'Product')
+    ProductSearchDocument = apps.get_model('MyApp', 'ProductSearchDocument')
+    now = timezone.now()
+    documents = []
+    for product in Product.objects.select_related('category').iterator(chunk_size=500):
+        category_name = product.category.name if product.category else ''
+        body = ' '.join(part for part in (product.excerpt, product.description, category_name) if part)
+        documents.append(ProductSearchDocument(
+            product_id=product.id, title=fold_text(product.title), body=fold_text(body), updated_at=now,
+        ))
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MyApp', '0027_auditlog_alter_order_status_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='MyApp.product')),
+                ('title', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Chỉ mục tìm kiếm sản phẩm',
+                'verbose_name_plural': 'Chỉ mục tìm kiếm sản phẩm',
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
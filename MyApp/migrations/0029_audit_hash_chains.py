@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MyApp', '0028_product_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditChainHead',
+            fields=[
+                ('chain_key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Chuỗi băm')),
+                ('genesis_hash', models.CharField(max_length=64, verbose_name='Mã băm khởi đầu')),
+                ('last_hash', models.CharField(max_length=64, verbose_name='Mã băm cuối')),
+                ('last_seq', models.PositiveBigIntegerField(default=0, verbose_name='Thứ tự cuối')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Audit Chain Head',
+                'verbose_name_plural': 'Audit Chain Heads',
+            },
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='chain_key',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Chuỗi băm'),
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='chain_seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Thứ tự trong chuỗi'),
+        ),
+        migrations.AddConstraint(
+            model_name='auditlog',
+            constraint=models.UniqueConstraint(fields=('chain_key', 'chain_seq'), name='auditlog_unique_chain_seq'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Sum, Count, DecimalField
+from django.db.models.functions import TruncDate
+
+
+SALES_STATUSES = ['confirmed', 'shipping', 'delivered', 'completed']
+
+
+def backfill_sales_rollups(apps, schema_editor):
+    Order = apps.get_model('MyApp', 'Order')
+    OrderItem = apps.get_model('MyApp', 'OrderItem')
+    DailySalesSummary = apps.get_model('MyApp', 'DailySalesSummary')
+    DailyProductSales = apps.get_model('MyApp', 'DailyProductSales')
+
+    day_rows = Order.objects.filter(status__in=SALES_STATUSES).annotate(day=TruncDate('created_at')).values('day').annotate(
+        order_count=Count('id'), revenue=Sum('total_amount'),
+    ).order_by()
+    DailySalesSummary.objects.bulk_create([
+        DailySalesSummary(date=row['day'], order_count=row['order_count'], revenue=row['revenue'] or 0)
+        for row in day_rows
+    ], batch_size=1000)
+
+    product_rows = OrderItem.objects.filter(order__status__in=SALES_STATUSES, product__isnull=False).annotate(
+        day=TruncDate('order__created_at'),
+    ).values('day', 'product_id').annotate(
+        qty=Sum('quantity'), rev=Sum(F('quantity') * F('price'), output_field=DecimalField()),
+    ).order_by()
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(date=row['day'], product_id=row['product_id'], quantity=row['qty'], revenue=row['rev'])
+        for row in product_rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MyApp', '0029_audit_hash_chains'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('order_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Doanh thu theo ngày',
+                'verbose_name_plural': 'Doanh thu theo ngày',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='MyApp.product')),
+            ],
+            options={
+                'verbose_name': 'Doanh số sản phẩm theo ngày',
+                'verbose_name_plural': 'Doanh số sản phẩm theo ngày',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['product', 'date'], name='daily_sales_product_date')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='daily_product_sales_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_sales_rollups, migrations.RunPython.noop),
+    ]
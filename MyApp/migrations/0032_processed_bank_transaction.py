@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MyApp', '0031_staff_presence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedBankTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=100, unique=True, verbose_name='Mã giao dịch')),
+                ('amount', models.BigIntegerField(default=0, verbose_name='Số tiền')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Nội dung')),
+                ('outcome', models.CharField(choices=[('confirmed', 'Đã xác nhận thanh toán'), ('stock_shortage', 'Đã nhận tiền nhưng thiếu hàng'), ('already_paid', 'Đơn đã thanh toán trước đó'), ('ineligible', 'Đơn không thể xác nhận'), ('amount_mismatch', 'Sai số tiền'), ('no_payment', 'Đơn không có bản ghi thanh toán'), ('order_not_found', 'Không tìm thấy đơn hàng'), ('unmatched', 'Không có mã đơn hàng')], max_length=20, verbose_name='Kết quả')),
+                ('processed_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bank_transactions', to='MyApp.order')),
+            ],
+            options={
+                'verbose_name': 'Giao dịch ngân hàng đã xử lý',
+                'verbose_name_plural': 'Giao dịch ngân hàng đã xử lý',
+                'ordering': ['-processed_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:03
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def backfill_product_stats(apps, schema_editor):
+    Product = apps.get_model('MyApp', 'Product')
+    ProductVariation = apps.get_model('MyApp', 'ProductVariation')
+    Review = apps.get_model('MyApp', 'Review')
+
+    variations = (
+        ProductVariation.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        .annotate(total=Sum(F('physical_stock') - F('reserved_stock'))).values('total')
+    )
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    rating_field = DecimalField(max_digits=3, decimal_places=2)
+    Product.objects.update(
+        total_available_stock=Coalesce(
+            Subquery(variations, output_field=IntegerField()), F('physical_stock') - F('reserved_stock'),
+        ),
+        avg_rating=Coalesce(
+            Subquery(reviews.annotate(avg=Round(Avg('rating'), 2)).values('avg'), output_field=rating_field),
+            Value(0, output_field=rating_field),
+        ),
+        review_count=Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MyApp', '0032_processed_bank_transaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=3, verbose_name='Điểm đánh giá trung bình'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Số đánh giá'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_available_stock',
+            field=models.IntegerField(default=0, verbose_name='Tồn khả dụng (gồm biến thể)'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['total_available_stock'], name='product_available_stock'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['avg_rating'], name='product_avg_rating'),
+        ),
+        migrations.RunPython(backfill_product_stats, migrations.RunPython.noop),
+    ]
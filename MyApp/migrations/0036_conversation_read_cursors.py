@@ -0,0 +1,76 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_read_cursors(apps, schema_editor):
+    """Cursors from Message.is_read: each participant has read up to the first message of the others still unread."""
+    Conversation = apps.get_model('MyApp', 'Conversation')
+    ConversationReadCursor = apps.get_model('MyApp', 'ConversationReadCursor')
+    Message = apps.get_model('MyApp', 'Message')
+    Participant = Conversation.participants.through
+
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-id').values('id')[:1]
+    Conversation.objects.update(last_message=Subquery(latest))
+    last_ids = dict(Conversation.objects.values_list('id', 'last_message_id'))
+
+    participants = {}
+    for conversation_id, user_id in Participant.objects.values_list('conversation_id', 'user_id'):
+        participants.setdefault(conversation_id, []).append(user_id)
+    unread = {}  # (conversation, user) -> [first unread id, count]
+    for conversation_id, sender_id, message_id in (
+        Message.objects.filter(is_read=False).order_by('id').values_list('conversation_id', 'sender_id', 'id')
+    ):
+        for user_id in participants.get(conversation_id, ()):
+            if user_id != sender_id:
+                unread.setdefault((conversation_id, user_id), [message_id, 0])[1] += 1
+
+    cursors = []
+    for conversation_id, user_ids in participants.items():
+        for user_id in user_ids:
+            first_unread, count = unread.get((conversation_id, user_id), (None, 0))
+            cursors.append(ConversationReadCursor(
+                conversation_id=conversation_id, user_id=user_id, unread_count=count,
+                last_read_id=first_unread - 1 if first_unread else last_ids.get(conversation_id) or 0,
+            ))
+    ConversationReadCursor.objects.bulk_create(cursors, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MyApp', '0035_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='MyApp.message', verbose_name='Tin nhắn mới nhất'),
+        ),
+        migrations.CreateModel(
+            name='ConversationReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_id', models.BigIntegerField(default=0, verbose_name='Id tin nhắn đã đọc gần nhất')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='Số tin chưa đọc')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='MyApp.conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_read_cursors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Vị trí đọc hội thoại',
+                'verbose_name_plural': 'Vị trí đọc hội thoại',
+                'constraints': [models.UniqueConstraint(fields=('user', 'conversation'), name='conversation_read_cursor_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_read_cursors, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:47
+
+import time
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    CatalogVersion = apps.get_model('MyApp', 'CatalogVersion')
+    CatalogVersion.objects.get_or_create(pk=1, defaults={'value': time.time_ns()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MyApp', '0036_conversation_read_cursors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Phiên bản catalog',
+                'verbose_name_plural': 'Phiên bản catalog',
+            },
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
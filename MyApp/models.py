@@ -46,6 +46,11 @@ class Product(models.Model):
 	views_count = models.PositiveIntegerField(default=0, verbose_name="Lượt xem")
 	created_at = models.DateTimeField(auto_now_add=True)
 
+	# Giá trị tổng hợp, cập nhật bởi MyApp/product_stats.py (đối soát: manage.py reconcile_product_stats)
+	total_available_stock = models.IntegerField(default=0, verbose_name="Tồn khả dụng (gồm biến thể)")
+	avg_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, verbose_name="Điểm đánh giá trung bình")
+	review_count = models.PositiveIntegerField(default=0, verbose_name="Số đánh giá")
+
 	objects = InventoryManager()
 
 	@property
@@ -54,6 +59,10 @@ class Product(models.Model):
 
 	class Meta:
 		ordering = ['-created_at']
+		indexes = [
+			models.Index(fields=['total_available_stock'], name='product_available_stock'),
+			models.Index(fields=['avg_rating'], name='product_avg_rating'),
+		]
 
 	def __str__(self):
 		return self.title
@@ -62,6 +71,21 @@ class Product(models.Model):
 		return reverse('product_detail', args=[self.slug])
 
 
+class ProductSearchDocument(models.Model):
+	"""Bản sao đã bỏ dấu của nội dung sản phẩm, dùng làm nguồn cho chỉ mục full-text (xem MyApp/search.py)."""
+	product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+	title = models.TextField(blank=True)
+	body = models.TextField(blank=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		verbose_name = "Chỉ mục tìm kiếm sản phẩm"
+		verbose_name_plural = "Chỉ mục tìm kiếm sản phẩm"
+
+	def __str__(self):
+		return f"Search document #{self.product_id}"
+
+
 class ProductImage(models.Model):
 	product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
 	image = models.ImageField(upload_to='products/', verbose_name="Ảnh sản phẩm")
@@ -140,6 +164,18 @@ class CabinetItem(models.Model):
 		return self.title
 
 
+class CatalogVersion(models.Model):
+	"""Phiên bản catalog khi cache không dùng chung giữa các process (xem MyApp/catalog_cache.py)."""
+	value = models.BigIntegerField()
+
+	class Meta:
+		verbose_name = "Phiên bản catalog"
+		verbose_name_plural = "Phiên bản catalog"
+
+	def __str__(self):
+		return str(self.value)
+
+
 # ==================== USER PROFILE MODELS ====================
 
 class UserProfile(models.Model):
@@ -283,6 +319,12 @@ class Order(models.Model):
 	
 	class Meta:
 		ordering = ['-created_at']
+		indexes = [
+			models.Index(fields=['created_at', 'id'], name='order_created_id'),
+			# Admin order list filtered by status; "my orders" pages
+			models.Index(fields=['status', '-created_at'], name='order_status_created'),
+			models.Index(fields=['user', '-created_at'], name='order_user_created'),
+		]
 	
 	def __str__(self):
 		return f'Order {self.order_number}'
@@ -312,12 +354,16 @@ class Order(models.Model):
 			user=user
 		)
 
+	def stock_lines(self):
+		from .inventory import lines_for
+		return lines_for(self.items.select_related('product', 'variation__product'))
+
 	def can_confirm(self):
 		"""Kiểm tra xem có đủ hàng để xác nhận đơn không."""
-		for item in self.items.all():
-			target = item.variation if item.variation else item.product
-			if target.available_stock < item.quantity:
-				return False, f"Sản phẩm {target} không đủ tồn kho khả dụng."
+		from .inventory import find_shortage
+		shortage = find_shortage(self.stock_lines())
+		if shortage:
+			return False, str(shortage)
 		return True, ""
 
 	def action_confirm(self, user=None, from_cart=False):
@@ -327,59 +373,38 @@ class Order(models.Model):
 		if self.status in ['cancelled', 'refunded', 'exchanged', 'return_requested', 'return_approved', 'returned']:
 			return False, "Đơn hàng đã hủy/hoàn tất, không thể xác nhận lại."
 
+		from . import inventory
 		with transaction.atomic():
-			# Lock items in sorted order to prevent deadlock
-			items = self.items.select_related('product', 'variation').order_by('product__id', 'variation__id')
-			
-			can_proceed, msg = self.can_confirm()
-			if not can_proceed:
-				return False, msg
-
-			for item in items:
-				if not from_cart:
-					# Explicitly lock the specific product or variation row to avoid outer join FOR UPDATE errors
-					if item.variation_id:
-						target = ProductVariation.objects.select_for_update().get(id=item.variation_id)
-					else:
-						target = Product.objects.select_for_update().get(id=item.product_id)
-					
-					# Update reserved stock only if not coming from already reserved cart
-					target.reserved_stock = F('reserved_stock') + item.quantity
-					target.save()
+			# Khóa toàn bộ sản phẩm của đơn trong một truy vấn (theo thứ tự id để tránh deadlock)
+			# rồi ghi log giữ hàng cho Đơn hàng (dù từ giỏ hay không đều cần log của Order)
+			lines = self.stock_lines()
+			note = "Tạm giữ khi xác nhận đơn hàng."
+			try:
+				if from_cart:
+					# Hàng đã được giữ khi thêm vào giỏ: chỉ kiểm tra phần giữ chỗ vẫn còn
+					inventory.confirm_held(lines, self.order_number, user=user, note=note)
 				else:
-					target = item.variation if item.variation else item.product
-				
-				# Ghi log giữ hàng cho Đơn hàng (dù từ giỏ hay không đều cần log của Order)
-				self.log_transaction(item, 'RESERVE', item.quantity, is_physical=False, user=user, note="Tạm giữ khi xác nhận đơn hàng.")
+					inventory.reserve(lines, self.order_number, user=user, note=note)
+			except inventory.InsufficientStock as e:
+				return False, str(e)
 			
 			self.set_status('confirmed', user=user, note="Xác nhận đơn hàng và giữ kho.")
 			self.ensure_invoice()
 			return True, "Đơn hàng đã được xác nhận và giữ kho."
 
-	def action_cancel(self, user=None):
-		"""Hủy đơn hàng: Giải phóng hàng đã giữ (nếu có)."""
+	def action_cancel(self, user=None, note=''):
+		"""Hủy đơn hàng: Giải phóng hàng đã giữ (nếu có). ``note`` thay cho ghi chú mặc định trong lịch sử."""
 		if self.status == 'cancelled':
 			return True, "Đơn hàng đã ở trạng thái hủy."
 		if self.status in ['delivered', 'completed', 'return_requested', 'return_approved', 'returned', 'refunded', 'exchanged']:
 			return False, "Đơn hàng đã hoàn tất hoặc đang xử lý đổi trả, không thể hủy."
+		from . import inventory
 		with transaction.atomic():
-			items = self.items.select_related('product', 'variation').order_by('product__id', 'variation__id')
-			
 			if self.status in ['confirmed', 'processing', 'shipping']:
-				for item in items:
-					if item.variation_id:
-						target = ProductVariation.objects.select_for_update().get(id=item.variation_id)
-					else:
-						target = Product.objects.select_for_update().get(id=item.product_id)
-						
-					# Safe Release: Đảm bảo không trừ âm reserved_stock
-					release_qty = min(item.quantity, target.reserved_stock)
-					if release_qty > 0:
-						target.reserved_stock = F('reserved_stock') - release_qty
-						target.save()
-						self.log_transaction(item, 'RELEASE', -release_qty, is_physical=False, user=user, note=f"Giải phóng kho do hủy đơn hàng {self.order_number}")
+				# Safe Release: Đảm bảo không trừ âm reserved_stock
+				inventory.release(self.stock_lines(), self.order_number, user=user, note=f"Giải phóng kho do hủy đơn hàng {self.order_number}")
 			
-			self.set_status('cancelled', user=user, note="Hủy đơn hàng.")
+			self.set_status('cancelled', user=user, note=note or "Hủy đơn hàng.")
 			try:
 				invoice = self.invoice
 			except Invoice.DoesNotExist:
@@ -398,29 +423,14 @@ class Order(models.Model):
 		if self.status != 'shipping' and self.status != 'processing' and self.status != 'confirmed':
 			return False, "Trạng thái đơn hàng không hợp lệ để hoàn tất."
 
+		from . import inventory
 		with transaction.atomic():
-			items = self.items.select_related('product', 'variation').order_by('product__id', 'variation__id')
-			
-			for item in items:
-				if item.variation_id:
-					target = ProductVariation.objects.select_for_update().get(id=item.variation_id)
-				else:
-					target = Product.objects.select_for_update().get(id=item.product_id)
-					
-				# Physical deduction (Physical stock MUST exist)
-				target.physical_stock = F('physical_stock') - item.quantity
-				
-				# Release logical reservation (Safe Release)
-				release_qty = min(item.quantity, target.reserved_stock)
-				if release_qty > 0:
-					target.reserved_stock = F('reserved_stock') - release_qty
-				
-				target.save()
-				# Log physical move (OUT)
-				self.log_transaction(item, 'OUT', -item.quantity, is_physical=True, user=user, note=f"Xuất kho cho đơn hàng {self.order_number}")
-				# Log release if there was a reservation
-				if release_qty > 0:
-					self.log_transaction(item, 'RELEASE', -release_qty, is_physical=False, user=user, note=f"Giải phóng tạm giữ cho đơn hàng {self.order_number}")
+			# Trừ kho vật lý (OUT) và giải phóng phần tạm giữ (Safe Release) cho toàn bộ đơn
+			inventory.deduct(
+				self.stock_lines(), self.order_number, user=user,
+				note=f"Xuất kho cho đơn hàng {self.order_number}",
+				release_note=f"Giải phóng tạm giữ cho đơn hàng {self.order_number}",
+			)
 			
 			self.set_status('delivered', user=user, note="Giao hàng thành công.")
 
@@ -448,10 +458,15 @@ class Order(models.Model):
 	def set_status(self, new_status, user=None, note=''):
 		if new_status not in dict(Order.STATUS_CHOICES):
 			return False, "Trạng thái không hợp lệ."
+		old_status = self.status
 		self.status = new_status
 		self.save(update_fields=['status', 'updated_at'])
 		OrderStatusHistory.objects.create(order=self, status=new_status, user=user, note=note)
 
+		# Keep the admin statistics rollups in sync
+		from .sales_rollups import record_status_change
+		record_status_change(self, old_status, new_status)
+
 		# Create notification for the user
 		try:
 			from django.urls import reverse
@@ -511,17 +526,18 @@ class Order(models.Model):
 				invoice.save(update_fields=list(updates.keys()))
 
 		if not invoice.items.exists():
-			total_amount = 0
-			for item in self.items.all():
-				amount = item.get_subtotal()
-				InvoiceItem.objects.create(
+			invoice_items = [
+				InvoiceItem(
 					invoice=invoice,
 					product_title=item.product_title,
 					quantity=item.quantity,
 					unit_price=item.price,
-					amount=amount,
+					amount=item.get_subtotal(),
 				)
-				total_amount += amount
+				for item in self.items.all()
+			]
+			InvoiceItem.objects.bulk_create(invoice_items)
+			total_amount = sum(item.amount for item in invoice_items)
 			# Keep invoice total aligned with order (includes discount).
 			invoice.total_amount = self.total_amount or total_amount
 			invoice.save(update_fields=['total_amount'])
@@ -558,6 +574,45 @@ class OrderItem(models.Model):
 		return self.price * self.quantity
 
 
+# ==================== SALES ROLLUPS ====================
+
+class DailySalesSummary(models.Model):
+	"""Doanh thu theo ngày đặt hàng của các đơn hợp lệ (xem MyApp/sales_rollups.py)."""
+	date = models.DateField(unique=True)
+	order_count = models.IntegerField(default=0)
+	revenue = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+
+	class Meta:
+		ordering = ['-date']
+		verbose_name = "Doanh thu theo ngày"
+		verbose_name_plural = "Doanh thu theo ngày"
+
+	def __str__(self):
+		return f"{self.date}: {self.order_count} đơn / {self.revenue}₫"
+
+
+class DailyProductSales(models.Model):
+	"""Số lượng bán và doanh thu theo ngày của từng sản phẩm."""
+	date = models.DateField()
+	product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+	quantity = models.IntegerField(default=0)
+	revenue = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+
+	class Meta:
+		ordering = ['-date']
+		verbose_name = "Doanh số sản phẩm theo ngày"
+		verbose_name_plural = "Doanh số sản phẩm theo ngày"
+		constraints = [
+			models.UniqueConstraint(fields=['date', 'product'], name='daily_product_sales_unique'),
+		]
+		indexes = [
+			models.Index(fields=['product', 'date'], name='daily_sales_product_date'),
+		]
+
+	def __str__(self):
+		return f"{self.date} · {self.product_id}: {self.quantity}"
+
+
 class ReturnRequest(models.Model):
 	RETURN_TYPES = [
 		('refund', 'Hoàn tiền'),
@@ -622,34 +677,37 @@ class Cart(models.Model):
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
 	
+	class Meta:
+		indexes = [
+			# Guest cart lookup on every request; cleanup_expired_carts
+			models.Index(fields=['session_key'], name='cart_session_key'),
+			models.Index(fields=['updated_at'], name='cart_updated_at'),
+		]
+	
 	def __str__(self):
 		if self.user:
 			return f'Cart của {self.user.username}'
 		return f'Cart (session: {self.session_key[:8]}...)'
 	
+	@property
+	def pricing(self):
+		"""Subtotal, discount and total computed in one pass (MyApp/pricing.py), once per instance."""
+		if not hasattr(self, '_pricing'):
+			from .pricing import price_cart
+			self._pricing = price_cart(self)
+		return self._pricing
+	
 	def get_total_items(self):
-		return sum(item.quantity for item in self.items.all())
+		return self.pricing.total_items
 	
 	def get_subtotal(self):
-		return sum(item.get_subtotal() for item in self.items.all())
+		return self.pricing.subtotal
 	
 	def get_discount_amount(self):
-		if not self.coupon or not self.coupon.is_valid:
-			return 0
-		subtotal = self.get_subtotal()
-		if subtotal < self.coupon.min_purchase:
-			return 0
-			
-		if self.coupon.discount_type == 'percent':
-			return (subtotal * self.coupon.discount_value) / 100
-		elif self.coupon.discount_type == 'fixed':
-			return self.coupon.discount_value
-		return 0 # freeship handles shipping cost, not subtotal deduction directly typically, but we can return 0 here
+		return self.pricing.discount
 	
 	def get_total_price(self):
-		subtotal = self.get_subtotal()
-		discount = self.get_discount_amount()
-		return max(0, subtotal - discount)
+		return self.pricing.total
 
 
 class CartItem(models.Model):
@@ -710,6 +768,12 @@ class InventoryTransaction(models.Model):
 
 	class Meta:
 		ordering = ['-timestamp']
+		indexes = [
+			# Keyset pagination of the admin lists (MyApp/pagination.py)
+			models.Index(fields=['timestamp', 'id'], name='inventory_txn_timestamp_id'),
+			# Stock movements of one order on the admin order page
+			models.Index(fields=['reference_id'], name='inventory_txn_reference'),
+		]
 
 	def __str__(self):
 		target = f"{self.product.title}" if self.product else "N/A"
@@ -815,6 +879,35 @@ class PaymentQRCode(models.Model):
 		return f'QR Code for {self.payment.order.order_number}'
 
 
+class ProcessedBankTransaction(models.Model):
+	"""Giao dịch ngân hàng (Casso) đã xử lý: Casso gửi lại webhook thì bỏ qua giao dịch đã có."""
+	OUTCOME_CHOICES = [
+		('confirmed', 'Đã xác nhận thanh toán'),
+		('stock_shortage', 'Đã nhận tiền nhưng thiếu hàng'),
+		('already_paid', 'Đơn đã thanh toán trước đó'),
+		('ineligible', 'Đơn không thể xác nhận'),
+		('amount_mismatch', 'Sai số tiền'),
+		('no_payment', 'Đơn không có bản ghi thanh toán'),
+		('order_not_found', 'Không tìm thấy đơn hàng'),
+		('unmatched', 'Không có mã đơn hàng'),
+	]
+
+	transaction_id = models.CharField(max_length=100, unique=True, verbose_name="Mã giao dịch")
+	order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='bank_transactions')
+	amount = models.BigIntegerField(default=0, verbose_name="Số tiền")
+	description = models.CharField(max_length=255, blank=True, verbose_name="Nội dung")
+	outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES, verbose_name="Kết quả")
+	processed_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		ordering = ['-processed_at']
+		verbose_name = "Giao dịch ngân hàng đã xử lý"
+		verbose_name_plural = "Giao dịch ngân hàng đã xử lý"
+
+	def __str__(self):
+		return f'{self.transaction_id} ({self.get_outcome_display()})'
+
+
 class Invoice(models.Model):
 	order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='invoice')
 	invoice_number = models.CharField(max_length=50, unique=True)
@@ -832,18 +925,25 @@ class Invoice(models.Model):
 	
 	class Meta:
 		ordering = ['-generated_at']
+		indexes = [
+			models.Index(fields=['generated_at', 'id'], name='invoice_generated_id'),
+		]
 		verbose_name = "Hóa đơn"
 		verbose_name_plural = "Danh sách hóa đơn"
 	
 	def __str__(self):
 		return f'Invoice {self.invoice_number}'
 	
+	@staticmethod
+	def new_invoice_number():
+		import uuid
+		now = timezone.now()
+		short_uuid = uuid.uuid4().hex[:6].upper()
+		return f'INV-{now.strftime("%Y%m%d")}-{short_uuid}'
+
 	def save(self, *args, **kwargs):
 		if not self.invoice_number:
-			import uuid
-			now = timezone.now()
-			short_uuid = uuid.uuid4().hex[:6].upper()
-			self.invoice_number = f'INV-{now.strftime("%Y%m%d")}-{short_uuid}'
+			self.invoice_number = self.new_invoice_number()
 		super().save(*args, **kwargs)
 
 
@@ -954,6 +1054,11 @@ class AIChatSession(models.Model):
 	session_key = models.CharField(max_length=40, null=True, blank=True)
 	created_at = models.DateTimeField(auto_now_add=True)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['session_key'], name='ai_chat_session_key'),
+		]
+
 	def __str__(self):
 		if self.user:
 			return f"AI Chat Session for {self.user.username}"
@@ -971,6 +1076,9 @@ class AIChatMessage(models.Model):
 
 	class Meta:
 		ordering = ['created_at']
+		indexes = [
+			models.Index(fields=['session', 'created_at'], name='ai_chat_msg_session_created'),
+		]
 
 	def __str__(self):
 		return f"{self.sender} - {self.content[:50]}"
@@ -979,6 +1087,11 @@ class AIChatMessage(models.Model):
 
 class Conversation(models.Model):
 	participants = models.ManyToManyField(User, related_name='conversations')
+	# Tin nhắn mới nhất, cập nhật khi có tin mới (xem inbox.py)
+	last_message = models.ForeignKey(
+		'Message', on_delete=models.SET_NULL, null=True, blank=True,
+		related_name='+', verbose_name="Tin nhắn mới nhất"
+	)
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
 
@@ -991,18 +1104,15 @@ class Conversation(models.Model):
 	def get_other_user(self, current_user):
 		return self.participants.exclude(id=current_user.id).first()
 
-	def last_message(self):
-		return self.messages.order_by('-created_at').first()
-
 	def unread_count(self, user):
-		return self.messages.filter(is_read=False).exclude(sender=user).count()
+		cursor = self.read_cursors.filter(user=user).first()
+		return cursor.unread_count if cursor else 0
 
 
 class Message(models.Model):
 	conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
 	sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
 	content = models.TextField(verbose_name="Nội dung")
-	is_read = models.BooleanField(default=False)
 	created_at = models.DateTimeField(auto_now_add=True)
 
 	class Meta:
@@ -1012,6 +1122,28 @@ class Message(models.Model):
 		return f"{self.sender.username}: {self.content[:50]}"
 
 
+class ConversationReadCursor(models.Model):
+	"""
+	Vị trí đã đọc của một người trong hội thoại: mọi tin nhắn có id <= last_read_id
+	là đã đọc. unread_count đếm sẵn tin nhắn của người khác sau vị trí đó.
+	"""
+	conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_cursors')
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_read_cursors')
+	last_read_id = models.BigIntegerField(default=0, verbose_name="Id tin nhắn đã đọc gần nhất")
+	unread_count = models.PositiveIntegerField(default=0, verbose_name="Số tin chưa đọc")
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		verbose_name = "Vị trí đọc hội thoại"
+		verbose_name_plural = "Vị trí đọc hội thoại"
+		constraints = [
+			models.UniqueConstraint(fields=['user', 'conversation'], name='conversation_read_cursor_unique'),
+		]
+
+	def __str__(self):
+		return f"{self.user} · Conversation {self.conversation_id} · {self.unread_count} chưa đọc"
+
+
 # ==================== NOTIFICATIONS ====================
 
 class Notification(models.Model):
@@ -1121,6 +1253,19 @@ class SupportBusinessHours(models.Model):
 		return f"{self.get_day_of_week_display()} · {'Mở' if self.is_open else 'Đóng'} {self.open_time}-{self.close_time}"
 
 
+class StaffPresence(models.Model):
+	"""Lần hoạt động gần nhất của nhân viên (xem MyApp/presence.py)."""
+	user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='presence')
+	last_seen = models.DateTimeField(db_index=True)
+
+	class Meta:
+		verbose_name = "Trạng thái trực tuyến"
+		verbose_name_plural = "Trạng thái trực tuyến của nhân viên"
+
+	def __str__(self):
+		return f"{self.user} · {self.last_seen}"
+
+
 class SupportQuickReply(models.Model):
 	"""Template tin nhắn nhanh cho agent."""
 
@@ -1294,35 +1439,9 @@ class SupportMessage(models.Model):
 		return f"[{self.sender_type}] Ticket #{self.ticket_id}: {self.content[:60]}"
 
 	def to_dict(self):
-		"""Serialize cho JSON API."""
-		return {
-			'id': self.id,
-			'sender_type': self.sender_type,
-			'sender_name': (
-				self.sender.get_full_name() or self.sender.username
-				if self.sender else
-				('Bot TeaZen' if self.sender_type == 'bot' else 'Hệ thống')
-			),
-			'sender_avatar': (
-				self.sender.profile.avatar.url
-				if self.sender and hasattr(self.sender, 'profile') and self.sender.profile.avatar
-				else None
-			),
-			'content': self.content,
-			'is_read': self.is_read,
-			'is_internal': self.is_internal,
-			'created_at': self.created_at.isoformat(),
-			'attachments': [
-				{
-					'id': a.id,
-					'file_url': a.file.url,
-					'file_name': a.file_name,
-					'file_type': a.file_type,
-					'file_size': a.file_size,
-				}
-				for a in self.attachments.all()
-			],
-		}
+		"""Serialize cho JSON API. Nhiều tin nhắn: dùng support_serializers.serialize_messages()."""
+		from .support_serializers import serialize_message
+		return serialize_message(self)
 
 
 class SupportAttachment(models.Model):
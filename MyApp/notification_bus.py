@@ -0,0 +1,250 @@
+"""
+Publish/subscribe bus used to push real-time events (notification badges,
+support chat, ...) to Server-Sent Events connections.
+
+Channels are plain strings such as ``user:42``. Messages are JSON-serialisable
+dicts. Subscribers only hold a small queue, so an idle SSE connection costs
+no database queries at all: it sleeps until something is published on its
+channel.
+
+Backends:
+
+* ``LocalBus`` (default): in-process fan-out. Enough for a single ASGI worker
+  (``uvicorn MyProject.asgi:application``).
+* ``RedisBus``: set ``NOTIFICATION_BUS_URL=redis://...`` when running several
+  worker processes, so events published in one process reach connections held
+  by another. Requires the optional ``redis`` package; without it the bus
+  falls back to ``LocalBus``.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Slow consumers only need the most recent state, older messages are dropped.
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def ticket_channel(ticket_id):
+    return f'ticket:{ticket_id}'
+
+
+def staff_channel():
+    return 'staff'
+
+
+class Subscription:
+    """Blocking subscription, for sync (WSGI) streaming responses."""
+
+    def __init__(self, bus, *channels):
+        self.bus = bus
+        self.channels = channels
+        self._queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, message):
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next message, or None after ``timeout`` seconds without one."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncSubscription(Subscription):
+    """Subscription bound to the running event loop, for ASGI streaming responses."""
+
+    def __init__(self, bus, *channels):
+        self.bus = bus
+        self.channels = channels
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, message):
+        # Publishers usually run in a sync thread (request handler, on_commit).
+        try:
+            self._loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Event loop already closed: the connection is gone.
+            self.bus.unsubscribe(self)
+
+    def _put(self, message):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(message)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class LocalBus:
+    name = 'local'
+
+    def __init__(self):
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        self.dispatch(channel, message)
+
+    def dispatch(self, channel, message):
+        """Deliver a message to the subscribers held by this process."""
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def subscribe(self, *channels):
+        """One queue for the messages of all ``channels``."""
+        return self._register(Subscription(self, *channels))
+
+    def subscribe_async(self, *channels):
+        """Must be called from the event loop that will consume the subscription."""
+        return self._register(AsyncSubscription(self, *channels))
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._channels.values())
+
+    def _register(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels[channel].add(subscription)
+        return subscription
+
+
+class RedisBus(LocalBus):
+    name = 'redis'
+    prefix = 'myapp:bus:'
+
+    def __init__(self, url):
+        import redis
+
+        super().__init__()
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def publish(self, channel, message):
+        try:
+            self._redis.publish(self.prefix + channel, json.dumps(message))
+        except Exception as e:
+            logger.warning(f"Notification bus: redis publish failed ({e}), delivering locally")
+            self.dispatch(channel, message)
+
+    def _register(self, subscription):
+        self._ensure_listener()
+        return super()._register(subscription)
+
+    def _ensure_listener(self):
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='notification-bus', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # One pattern subscription per process, fanned out locally.
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for item in pubsub.listen():
+                    if item.get('type') != 'pmessage':
+                        continue
+                    channel = item['channel']
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    self.dispatch(channel[len(self.prefix):], json.loads(item['data']))
+            except Exception as e:
+                logger.warning(f"Notification bus: redis listener error ({e}), reconnecting")
+                time.sleep(2)
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = _create_bus()
+    return _bus
+
+
+def _create_bus():
+    url = getattr(settings, 'NOTIFICATION_BUS_URL', '')
+    if url:
+        try:
+            return RedisBus(url)
+        except ImportError:
+            logger.warning("NOTIFICATION_BUS_URL is set but the 'redis' package is not installed; using the in-process bus")
+    return LocalBus()
+
+
+def publish(channel, message):
+    get_bus().publish(channel, message)
+
+
+def publish_on_commit(channel, message_factory):
+    """
+    Publish once the current transaction commits (immediately in autocommit).
+    ``message_factory`` is called at that point, so it sees committed data.
+    """
+    def _send():
+        try:
+            publish(channel, message_factory())
+        except Exception as e:
+            # Real-time push is best effort, never break the caller.
+            logger.warning(f"Notification bus: publish to {channel} failed ({e})")
+
+    transaction.on_commit(_send)
@@ -0,0 +1,133 @@
+"""
+Notification helpers shared by views, models and background tasks.
+
+Whenever a user's unread notifications change, their new state is pushed on
+the ``user:<id>`` channel of the notification bus (see notification_bus.py).
+The SSE endpoint forwards it to the browser without querying the database.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Notification
+from .notification_bus import publish, publish_on_commit, user_channel
+
+logger = logging.getLogger(__name__)
+
+
+def timesince_short(dt):
+    """Return compact Vietnamese time-since string."""
+    diff = timezone.now() - dt
+    seconds = int(diff.total_seconds())
+    if seconds < 60:
+        return 'Vừa xong'
+    minutes = seconds // 60
+    if minutes < 60:
+        return f'{minutes} phút trước'
+    hours = minutes // 60
+    if hours < 24:
+        return f'{hours} giờ trước'
+    days = hours // 24
+    if days < 30:
+        return f'{days} ngày trước'
+    months = days // 30
+    return f'{months} tháng trước'
+
+
+def serialize_notification(notification):
+    return {
+        'id': notification.id,
+        'type': notification.notification_type,
+        'icon': notification.icon,
+        'style': notification.category_style,
+        'title': notification.title,
+        'message': notification.message[:80],
+        'link': notification.link,
+        'time_ago': timesince_short(notification.created_at),
+    }
+
+
+def unread_state(user_id, latest=None):
+    """Payload sent to the notification stream: unread count + newest unread notification."""
+    unread = Notification.objects.filter(user_id=user_id, is_read=False)
+    count = unread.count()
+    if latest is None and count:
+        latest = unread.first()
+    return {
+        'unread_count': count,
+        'latest': serialize_notification(latest) if latest is not None else None,
+    }
+
+
+async def aunread_state(user_id):
+    unread = Notification.objects.filter(user_id=user_id, is_read=False)
+    count = await unread.acount()
+    latest = await unread.afirst() if count else None
+    return {
+        'unread_count': count,
+        'latest': serialize_notification(latest) if latest is not None else None,
+    }
+
+
+def publish_unread_state(user_id, latest=None):
+    """Push the user's unread state after the current transaction commits."""
+    publish_on_commit(user_channel(user_id), lambda: unread_state(user_id, latest))
+
+
+def publish_read_state(user_id, unread_count):
+    """Push a badge update without a toast (notifications were marked as read)."""
+    publish_on_commit(user_channel(user_id), lambda: {'unread_count': unread_count, 'latest': None})
+
+
+def notify_users(user_ids, notification_type, title, message_text, link='', actor=None):
+    """
+    Create the same notification for many users with one INSERT, and push
+    their new unread state with one COUNT query once the transaction commits
+    (bulk_create does not send post_save).
+    """
+    return bulk_notify([
+        Notification(
+            user_id=user_id,
+            actor=actor,
+            notification_type=notification_type,
+            title=title,
+            message=message_text,
+            link=link,
+        )
+        for user_id in user_ids
+    ])
+
+
+def bulk_notify(notifications):
+    """Insert unsaved Notifications with one INSERT and push the recipients' unread state on commit."""
+    notifications = Notification.objects.bulk_create(notifications)
+    if notifications:
+        transaction.on_commit(lambda: _publish_new(notifications))
+    return notifications
+
+
+def _publish_new(notifications):
+    counts = dict(
+        Notification.objects.filter(user_id__in={n.user_id for n in notifications}, is_read=False)
+        .values_list('user_id').annotate(n=Count('id')).order_by()
+    )
+    for notification in notifications:
+        state = {'unread_count': counts.get(notification.user_id, 0), 'latest': serialize_notification(notification)}
+        try:
+            publish(user_channel(notification.user_id), state)
+        except Exception as e:
+            # Real-time push is best effort, never break the caller.
+            logger.warning(f"Notification bus: publish to user {notification.user_id} failed ({e})")
+
+
+@receiver(post_save, sender=Notification)
+def push_new_notification(sender, instance, created, raw=False, **kwargs):
+    # Covers create_notification(), Order.set_status() and every other
+    # Notification.objects.create() call site.
+    if raw or not created or instance.is_read:
+        return
+    publish_unread_state(instance.user_id, latest=instance)
@@ -0,0 +1,190 @@
+"""
+Keyset (cursor) pagination for long admin lists.
+
+django.core.paginator.Paginator reads page N with ``OFFSET (N-1) * per_page``,
+which makes the database walk every row before the page, and it runs a
+``COUNT(*)`` of the whole filtered list on every request. On the inventory
+ledger and the audit log, deep pages got slower the further one went.
+
+KeysetPaginator orders the rows by (key field, pk), both descending, and
+continues from the last row shown instead of counting rows to skip:
+
+    WHERE key <= :key AND (key < :key OR pk < :pk) ORDER BY key DESC, pk DESC LIMIT n
+
+With an index on (key, pk) every page costs the same as the first. Links
+carry an opaque cursor (``?after=...`` / ``?before=...``), so a link keeps
+showing the same rows however many are inserted above them; ``?last=1`` jumps
+to the oldest rows. The page number shown is only a hint carried in the link.
+
+The total is cached for COUNT_CACHE_TIMEOUT seconds per filtered query, and
+on PostgreSQL an unfiltered list larger than ESTIMATE_THRESHOLD rows uses the
+planner's row estimate instead of counting (``page.count_is_estimate``).
+"""
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.functional import cached_property
+
+COUNT_CACHE_TIMEOUT = 60
+ESTIMATE_THRESHOLD = 100000
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, key='created_at'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.key = key
+
+    def get_page(self, params):
+        """The page requested by ``params`` (request.GET); an unreadable cursor gives the first page."""
+        number = _positive_int(params.get('page'), 1)
+        if params.get('last'):
+            return self._last_page(params)
+        for direction in ('after', 'before'):
+            cursor = self.decode(params.get(direction))
+            if cursor is not None:
+                return self._page_from(cursor, direction, number, params)
+        return self._page_from(None, 'after', 1, params)
+
+    @property
+    def count(self):
+        """Number of rows in the list, cached; a PostgreSQL estimate for very large unfiltered lists."""
+        return self._count[0]
+
+    @property
+    def count_is_estimate(self):
+        return self._count[1]
+
+    @cached_property
+    def num_pages(self):
+        return max(1, -(-self.count // self.per_page))
+
+    def encode(self, obj):
+        field = self.queryset.model._meta.get_field(self.key)
+        values = [field.value_to_string(obj), str(obj.pk)]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        if not cursor:
+            return None
+        try:
+            key_value, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            meta = self.queryset.model._meta
+            return meta.get_field(self.key).to_python(key_value), meta.pk.to_python(pk)
+        except Exception:
+            return None
+
+    def _page_from(self, cursor, direction, number, params):
+        key = self.key
+        descending = direction == 'after'
+        rows = self.queryset.order_by(*((f'-{key}', '-pk') if descending else (key, 'pk')))
+        if cursor is not None:
+            key_value, pk = cursor
+            if descending:
+                rows = rows.filter(Q(**{f'{key}__lte': key_value}), Q(**{f'{key}__lt': key_value}) | Q(pk__lt=pk))
+            else:
+                rows = rows.filter(Q(**{f'{key}__gte': key_value}), Q(**{f'{key}__gt': key_value}) | Q(pk__gt=pk))
+        rows = list(rows[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if descending:
+            return KeysetPage(self, rows, number, params, has_previous=cursor is not None, has_next=more)
+        if not more:
+            # Back at the top: show a full first page rather than what is left above the cursor.
+            return self._page_from(None, 'after', 1, params)
+        rows.reverse()
+        return KeysetPage(self, rows, max(number, 2), params, has_previous=True, has_next=True)
+
+    def _last_page(self, params):
+        rows = list(self.queryset.order_by(self.key, 'pk')[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return KeysetPage(self, rows, self.num_pages, params, has_previous=more, has_next=False)
+
+    @cached_property
+    def _count(self):
+        queryset = self.queryset.order_by()
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > ESTIMATE_THRESHOLD:
+                return row[0], True
+        sql, params = queryset.query.sql_with_params()
+        cache_key = 'keyset_count:' + hashlib.sha1(f'{sql}|{params!r}'.encode()).hexdigest()
+        return cache.get_or_set(cache_key, queryset.count, COUNT_CACHE_TIMEOUT), False
+
+
+class KeysetPage:
+    """What the admin templates use from a Django Page, plus the cursor links."""
+
+    def __init__(self, paginator, object_list, number, params, has_previous, has_next):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.number = number
+        self.params = params
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def count_is_estimate(self):
+        return self.paginator.count_is_estimate
+
+    @property
+    def first_query(self):
+        return self._query()
+
+    @property
+    def last_query(self):
+        return self._query(last='1')
+
+    @property
+    def previous_query(self):
+        if not self.object_list:
+            return self.first_query
+        return self._query(before=self.paginator.encode(self.object_list[0]), page=max(self.number - 1, 1))
+
+    @property
+    def next_query(self):
+        if not self.object_list:
+            return self.first_query
+        return self._query(after=self.paginator.encode(self.object_list[-1]), page=self.number + 1)
+
+    def _query(self, **cursor):
+        query = QueryDict(mutable=True)
+        for key, values in self.params.lists():
+            if key not in ('after', 'before', 'last', 'page'):
+                query.setlist(key, values)
+        for key, value in cursor.items():
+            query[key] = value
+        return query.urlencode()
+
+
+def _positive_int(value, default):
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return default
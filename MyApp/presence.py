@@ -0,0 +1,131 @@
+"""
+Support staff presence.
+
+api_support_status used to find "agents online" by loading and decoding every
+unexpired row of django_session on each call. Staff requests now leave a
+heartbeat instead (StaffPresenceMiddleware), and the count is read from a
+small presence store:
+
+* ``cache``: one cache entry holding {user_id: last seen timestamp} for the
+  recently active agents. Needs a cache shared by all worker processes
+  (Redis, Memcached, database cache).
+* ``db``: one StaffPresence row per agent, looked up through the index on
+  last_seen. Used when STAFF_PRESENCE_STORE = 'db', and by default when the
+  cache is local-memory, since each process would only see its own agents.
+
+Heartbeats are throttled to one write per HEARTBEAT_INTERVAL per agent and
+process, so busy staff pages do not write on every request. An agent is
+online for STAFF_PRESENCE_TIMEOUT seconds after their last heartbeat, or
+until they log out.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import StaffPresence, User
+
+CACHE_KEY = 'presence:staff'
+HEARTBEAT_INTERVAL = 60  # seconds
+
+_last_beats = {}
+_lock = threading.Lock()
+
+
+def presence_timeout():
+    return getattr(settings, 'STAFF_PRESENCE_TIMEOUT', 300)
+
+
+def uses_database():
+    store = getattr(settings, 'STAFF_PRESENCE_STORE', '')
+    if store:
+        return store == 'db'
+    return isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def heartbeat(user_id):
+    """Record that a staff user is active (at most once per HEARTBEAT_INTERVAL)."""
+    now = time.monotonic()
+    with _lock:
+        if now - _last_beats.get(user_id, float('-inf')) < HEARTBEAT_INTERVAL:
+            return
+        _last_beats[user_id] = now
+
+    seen = timezone.now()
+    if uses_database():
+        StaffPresence.objects.bulk_create(
+            [StaffPresence(user_id=user_id, last_seen=seen)],
+            update_conflicts=True, unique_fields=['user'], update_fields=['last_seen'],
+        )
+        return
+    roster = _cached_roster()
+    roster[user_id] = seen.timestamp()
+    # A heartbeat lost to a concurrent write is repaired by the agent's next one.
+    cache.set(CACHE_KEY, roster, presence_timeout())
+
+
+def mark_offline(user_id):
+    with _lock:
+        _last_beats.pop(user_id, None)
+    if uses_database():
+        StaffPresence.objects.filter(user_id=user_id).delete()
+        return
+    roster = _cached_roster()
+    if roster.pop(user_id, None) is not None:
+        cache.set(CACHE_KEY, roster, presence_timeout())
+
+
+def last_seen_by_agent():
+    """{user_id: last seen datetime} of the agents the store knows about."""
+    if uses_database():
+        return dict(StaffPresence.objects.values_list('user_id', 'last_seen'))
+    return {
+        user_id: datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+        for user_id, ts in _cached_roster().items()
+    }
+
+
+def online_count():
+    """Number of staff users online."""
+    if uses_database():
+        return StaffPresence.objects.filter(last_seen__gte=_cutoff(), user__is_staff=True).count()
+    return len(_cached_roster())
+
+
+def agents_last_seen():
+    """
+    Staff users for the support dashboard, online agents first:
+    [{'user': User, 'last_seen': datetime or None, 'online': bool}].
+    """
+    seen = last_seen_by_agent()
+    cutoff = _cutoff()
+    agents = []
+    for user in User.objects.filter(is_staff=True, is_active=True).only('id', 'username', 'first_name', 'last_name'):
+        last_seen = seen.get(user.pk)
+        agents.append({'user': user, 'last_seen': last_seen, 'online': last_seen is not None and last_seen >= cutoff})
+    agents.sort(key=lambda agent: (not agent['online'], agent['user'].username))
+    return agents
+
+
+def _cutoff():
+    return timezone.now() - timedelta(seconds=presence_timeout())
+
+
+def _cached_roster():
+    """The cached roster without entries older than the presence timeout."""
+    cutoff = timezone.now().timestamp() - presence_timeout()
+    roster = cache.get(CACHE_KEY) or {}
+    return {user_id: ts for user_id, ts in roster.items() if ts >= cutoff}
+
+
+@receiver(user_logged_out)
+def presence_logout(sender, request, user, **kwargs):
+    if user is not None and user.is_staff:
+        mark_offline(user.pk)
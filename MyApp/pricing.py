@@ -0,0 +1,64 @@
+"""
+Single-pass cart pricing.
+
+Cart.get_total_price() called get_subtotal() twice (once itself, once through
+get_discount_amount()), every call iterated ``self.items.all()`` again and
+each item loaded its product and variation lazily; cart_view, checkout and
+their templates called them several times. The cart page and checkout ran
+a few queries per item.
+
+``price_cart()`` loads the items with their product and variation in one
+query and computes everything in one pass: the price of each line, item
+count, subtotal, coupon discount (percent, fixed amount or free shipping,
+with the minimum purchase and validity rules of Coupon) and total. Cart
+keeps the result on the instance (``cart.pricing``), so it is computed once
+per request however many times views and templates read it. The views that
+change the items or the coupon redirect afterwards, so the next request
+prices the cart again; read ``cart.pricing`` only before such a change.
+"""
+from decimal import Decimal
+
+
+class PricedLine:
+    __slots__ = ('item', 'unit_price', 'subtotal')
+
+    def __init__(self, item):
+        self.item = item
+        variation = item.variation
+        self.unit_price = (variation.price if variation and variation.price else item.product.price) or 0
+        self.subtotal = self.unit_price * item.quantity
+
+
+class CartPricing:
+    def __init__(self, cart, items):
+        self.cart = cart
+        self.items = list(items)
+        self.lines = [PricedLine(item) for item in self.items]
+        self.total_items = sum(item.quantity for item in self.items)
+        self.subtotal = sum((line.subtotal for line in self.lines), Decimal(0))
+
+        self.coupon = cart.coupon
+        self.coupon_applies = bool(
+            self.coupon and self.coupon.is_valid and self.subtotal >= self.coupon.min_purchase
+        )
+        self.free_shipping = self.coupon_applies and self.coupon.discount_type == 'freeship'
+        self.discount = Decimal(0)
+        if self.coupon_applies:
+            if self.coupon.discount_type == 'percent':
+                self.discount = self.subtotal * self.coupon.discount_value / 100
+            elif self.coupon.discount_type == 'fixed':
+                self.discount = self.coupon.discount_value
+        self.total = max(Decimal(0), self.subtotal - self.discount)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def cart_items(cart):
+    """The cart's items with what pricing and the cart templates read."""
+    return cart.items.select_related('product', 'variation').order_by('id')
+
+
+def price_cart(cart, items=None):
+    """CartPricing of ``cart``; ``items`` defaults to cart_items(cart)."""
+    return CartPricing(cart, cart_items(cart) if items is None else items)
@@ -0,0 +1,117 @@
+"""
+Denormalized product stock and rating columns.
+
+product_list_view and product_detail summed the variations of every product
+in Python to show its sellable stock, and the rating filter joined reviews
+with ``Avg('reviews__rating')`` on every listing request. Product now stores:
+
+* ``total_available_stock``: what the storefront can sell, the available
+  stock of its variations, or its own when it has none,
+* ``avg_rating`` (rounded to 2 decimals) and ``review_count``.
+
+The database recomputes them from the source rows (``UPDATE ... SET col =
+(SELECT ...)``) in the transaction that changed those rows: inventory._apply()
+after every reservation, release and deduction, and the receivers below for
+Product/ProductVariation saves (cart views, stock receipts, Django admin) and
+Review saves and deletes. Since the values are read back from the rows,
+concurrent writers cannot leave a stale total behind.
+
+Writes that bypass both (raw SQL, QuerySet.update() of the stock columns)
+cause drift; ``manage.py reconcile_product_stats`` reports and repairs it.
+"""
+from decimal import Decimal
+
+from django.db.models import Avg, Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product, ProductVariation, Review
+
+# Saving one of these (or an unknown set of fields) may overwrite the stored values.
+SOURCE_FIELDS = {'physical_stock', 'reserved_stock', 'total_available_stock', 'avg_rating', 'review_count'}
+RATING_TOLERANCE = Decimal('0.005')
+
+
+def stock_expression():
+    variations = (
+        ProductVariation.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        .annotate(total=Sum(F('physical_stock') - F('reserved_stock'))).values('total')
+    )
+    return Coalesce(Subquery(variations, output_field=IntegerField()), F('physical_stock') - F('reserved_stock'))
+
+
+def rating_expressions():
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    rating_field = DecimalField(max_digits=3, decimal_places=2)
+    return {
+        'avg_rating': Coalesce(
+            Subquery(reviews.annotate(avg=Round(Avg('rating'), 2)).values('avg'), output_field=rating_field),
+            Value(0, output_field=rating_field),
+        ),
+        'review_count': Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n')), 0),
+    }
+
+
+def refresh_stock(product_ids):
+    """Recompute total_available_stock of the products (one UPDATE)."""
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(total_available_stock=stock_expression())
+
+
+def refresh_ratings(product_ids):
+    """Recompute avg_rating and review_count of the products (one UPDATE)."""
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(**rating_expressions())
+
+
+def refresh(product_ids=None):
+    """Recompute every stored value of the products (all products when None); returns rows updated."""
+    products = Product.objects.all() if product_ids is None else Product.objects.filter(pk__in=product_ids)
+    return products.update(total_available_stock=stock_expression(), **rating_expressions())
+
+
+def find_drift():
+    """[(product_id, {field: (stored, actual)})] for products whose stored values are wrong."""
+    ratings = rating_expressions()
+    rows = Product.objects.order_by('pk').annotate(
+        actual_stock=stock_expression(),
+        actual_rating=ratings['avg_rating'],
+        actual_count=ratings['review_count'],
+    ).values_list(
+        'pk', 'total_available_stock', 'actual_stock', 'avg_rating', 'actual_rating', 'review_count', 'actual_count',
+    )
+    drift = []
+    for pk, stock, actual_stock, rating, actual_rating, count, actual_count in rows.iterator(chunk_size=2000):
+        wrong = {}
+        if stock != actual_stock:
+            wrong['total_available_stock'] = (stock, actual_stock)
+        if abs(Decimal(rating) - Decimal(actual_rating)) >= RATING_TOLERANCE:
+            wrong['avg_rating'] = (rating, actual_rating)
+        if count != actual_count:
+            wrong['review_count'] = (count, actual_count)
+        if wrong:
+            drift.append((pk, wrong))
+    return drift
+
+
+@receiver(post_save, sender=Product)
+def refresh_saved_product(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A full save() writes the values loaded with the instance, which may be stale by now.
+    if raw or (update_fields is not None and not SOURCE_FIELDS & set(update_fields)):
+        return
+    refresh([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariation)
+@receiver(post_delete, sender=ProductVariation)
+def refresh_variation_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_stock([instance.product_id])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def refresh_reviewed_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_ratings([instance.product_id])
@@ -0,0 +1,168 @@
+"""
+Per-request SQL recording, N+1 detection and query budgets.
+
+Several views run the same query once per row without anyone noticing
+(Cart.get_subtotal() and get_total_items() iterating ``self.items.all()``
+again on every call, CartItem.__str__ loading its product and variation,
+Order.can_confirm() reloading the items). QueryRecorder records every query
+sent through Django's connections while it is active:
+
+* each query is grouped by its normalized SQL (parameters, literals and
+  ``IN (...)`` lists collapsed) and by the line of project code that ran it,
+* a group seen QUERY_N_PLUS_ONE_THRESHOLD times or more in one request is
+  reported as an N+1,
+* ``summary()`` is a one-line report: count, total time and top offenders.
+
+QueryInspectorMiddleware records a sample of requests
+(QUERY_INSPECTOR_SAMPLE_RATE) and logs that summary, as a warning when the
+URL went over its budget in QUERY_BUDGETS or has an N+1. With
+QUERY_BUDGET_STRICT (tests) it raises QueryBudgetExceeded instead.
+
+In tests and benchmark commands, ``assert_query_budget()`` applies the same
+checks to a block:
+
+    with assert_query_budget('cart'):
+        client.get(reverse('cart'))
+"""
+import logging
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = str(settings.BASE_DIR) + os.sep
+_THIS_FILE = os.path.abspath(__file__)
+_VENDOR_DIRS = (os.sep + 'site-packages' + os.sep, os.sep + 'dist-packages' + os.sep)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:\s*(?:%s|\?|NULL)\s*,?)+\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def sample_rate():
+    return getattr(settings, 'QUERY_INSPECTOR_SAMPLE_RATE', 0)
+
+
+def n_plus_one_threshold():
+    return getattr(settings, 'QUERY_N_PLUS_ONE_THRESHOLD', 5)
+
+
+def budget_for(url_name):
+    """Query budget of a URL name from QUERY_BUDGETS ('*' for the others); None = no budget."""
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(url_name, budgets.get('*'))
+
+
+def normalize(sql):
+    """SQL with its parameters and literals replaced, so the queries of one loop compare equal."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def call_site():
+    """``path:line function`` of the innermost project frame (not Django, not this module)."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(PROJECT_ROOT) and filename != _THIS_FILE
+                and not any(vendor in filename for vendor in _VENDOR_DIRS)):
+            return f'{os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '?'
+
+
+class QueryRecorder:
+    """Records the queries of every database connection of this thread while active."""
+
+    def __init__(self):
+        self.queries = []  # (normalized sql, call site, seconds)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        site = call_site()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((normalize(sql), site, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(seconds for _, _, seconds in self.queries)
+
+    def groups(self):
+        """{(normalized sql, call site): [seconds, ...]}, most repeated first."""
+        groups = defaultdict(list)
+        for sql, site, seconds in self.queries:
+            groups[(sql, site)].append(seconds)
+        return dict(sorted(groups.items(), key=lambda item: (-len(item[1]), -sum(item[1]))))
+
+    def n_plus_one(self, threshold=None):
+        """The groups repeated ``threshold`` times or more."""
+        threshold = threshold or n_plus_one_threshold()
+        return {key: times for key, times in self.groups().items() if len(times) >= threshold}
+
+    def summary(self, top=3):
+        offenders = '; '.join(
+            f'{len(times)}x {sql[:80]} @ {site}' for (sql, site), times in list(self.groups().items())[:top]
+            if len(times) > 1
+        )
+        text = f'{self.count} queries in {self.total_time * 1000:.1f} ms'
+        return f'{text}; top: {offenders}' if offenders else text
+
+    def problems(self, budget=None, threshold=None):
+        """Messages for an exceeded budget and for every N+1 group."""
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f'{self.count} queries, budget {budget}')
+        for (sql, site), times in self.n_plus_one(threshold).items():
+            problems.append(f'N+1: {len(times)}x {sql[:120]} @ {site}')
+        return problems
+
+
+@contextmanager
+def assert_query_budget(budget=None, n_plus_one=None):
+    """
+    Raise QueryBudgetExceeded when the block runs more than ``budget`` queries
+    (an int, or a URL name looked up in QUERY_BUDGETS) or repeats a query
+    ``n_plus_one`` times (QUERY_N_PLUS_ONE_THRESHOLD by default; 0 = no check).
+    """
+    if isinstance(budget, str):
+        budget = budget_for(budget)
+    with QueryRecorder() as recorder:
+        yield recorder
+    problems = recorder.problems(budget, n_plus_one if n_plus_one != 0 else float('inf'))
+    if problems:
+        raise QueryBudgetExceeded('\n'.join([recorder.summary()] + problems))
+
+
+def should_sample():
+    rate = sample_rate()
+    return rate >= 1 or (rate > 0 and random.random() < rate)
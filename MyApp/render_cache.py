@@ -0,0 +1,212 @@
+"""
+On-disk cache for rendered invoice PDFs and payment QR images.
+
+invoice_pdf, invoice_pdf_with_qr and payment_qr_image used to run ReportLab
+or qrcode on every request. The rendered bytes are now kept under
+MEDIA_ROOT/<RENDER_CACHE_DIR>/<order id>/ in files named after a SHA-256 of
+everything that goes into the output: the order fields, its items, the
+customer's name/phone/address/email, the payment method, the bank account
+settings, the font in use and RENDERER_VERSION.
+
+* A change to any of those produces a new key, so a stale file is never
+  served, even when the change bypassed save() (queryset.update()).
+* Saving or deleting the order, one of its items, its payment or invoice
+  also removes the order's directory right away (see the receivers below);
+  other stale files (e.g. after a profile change) age out through the LRU.
+* Every hit touches the file's mtime; when the directory grows past
+  RENDER_CACHE_MAX_BYTES the least recently used files are deleted.
+* The key doubles as the ETag, so repeat downloads with If-None-Match get a
+  304 without reading the file.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from . import invoices
+from .models import Order, OrderItem, Payment, Invoice
+
+# Bump when the output of MyApp/invoices.py changes.
+RENDERER_VERSION = 1
+QR_SIZE = 8
+# Payment methods an invoice QR can be rendered for; anything else gets 'bank'
+# ('vietqr' renders the same code as 'bank').
+QR_PAYMENT_METHODS = {'bank', 'momo'}
+
+_lock = threading.Lock()
+_estimated_size = None  # bytes under the cache root, as far as this process knows
+
+
+def cache_root():
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'RENDER_CACHE_DIR', 'render_cache'))
+
+
+def max_bytes():
+    return getattr(settings, 'RENDER_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+
+
+def orders_for_rendering():
+    """Order queryset loading everything the renderers and render_key() read."""
+    return Order.objects.select_related('user', 'user__profile', 'payment').prefetch_related('items')
+
+
+def render_key(order, kind, *params):
+    """Hex digest of the inputs of a rendering of ``order``."""
+    user = order.user
+    profile = getattr(user, 'profile', None)
+    try:
+        payment_method = order.payment.payment_method
+    except Payment.DoesNotExist:
+        payment_method = None
+    parts = [
+        RENDERER_VERSION, invoices.DEFAULT_FONT, kind, *params,
+        order.order_number, order.status, str(order.total_amount), order.note,
+        order.created_at.isoformat(), order.updated_at.isoformat(),
+        user.username, user.email,
+        profile and (profile.get_full_name(), profile.phone, profile.address),
+        payment_method,
+        sorted(getattr(settings, 'BANK_ACCOUNT', {}).items()),
+        [(item.product_title, item.quantity, str(item.price)) for item in order.items.all()],
+    ]
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def invoice_pdf(order):
+    key = render_key(order, 'invoice')
+    return key, lambda: invoices.InvoicePDFGenerator(order).generate().getvalue()
+
+
+def invoice_pdf_with_qr(order, payment_method):
+    # Part of the key: an unchecked value would let a client fill the cache with distinct renderings.
+    if payment_method not in QR_PAYMENT_METHODS:
+        payment_method = 'bank'
+    key = render_key(order, 'invoice_qr', payment_method)
+    return key, lambda: invoices.InvoiceWithQRGenerator(order, payment_method=payment_method).generate().getvalue()
+
+
+def payment_qr_png(order):
+    def render():
+        buffer = BytesIO()
+        invoices.QRCodePaymentGenerator(order, payment_method='bank').generate(size=QR_SIZE).save(buffer, format='PNG')
+        return buffer.getvalue()
+    return render_key(order, 'qr', QR_SIZE), render
+
+
+def serve(request, order, rendering, content_type, filename, disposition='attachment'):
+    """
+    Response for a (key, render) pair from one of the functions above: 304
+    when the client already has this version, else the cached file,
+    rendering and storing it first on a miss.
+    """
+    key, render = rendering
+    etag = f'"{key}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        path, data = get_or_render(order, key, render, os.path.splitext(filename)[1])
+        content = open(path, 'rb') if data is None else BytesIO(data)
+        response = FileResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    response['ETag'] = etag
+    # Per-user documents: browsers may keep them, but must revalidate.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def get_or_render(order, key, render, suffix):
+    """
+    (path, None) for a cached rendering, or (path, bytes) after rendering it
+    on a miss; the bytes are what to serve, the file may already be gone
+    again if the order was invalidated meanwhile.
+    """
+    path = os.path.join(cache_root(), str(order.pk), key + suffix)
+    try:
+        os.utime(path)
+        return path, None
+    except FileNotFoundError:
+        pass
+    data = render()
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename, so concurrent readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except FileNotFoundError:
+        return path, data  # directory removed by invalidate() while rendering
+    _account(len(data))
+    return path, data
+
+
+def invalidate(order_id):
+    """Drop every cached rendering of an order."""
+    if order_id is not None:
+        shutil.rmtree(os.path.join(cache_root(), str(order_id)), ignore_errors=True)
+
+
+def evict(limit=None):
+    """Delete least recently used files until the cache is at most 90% of ``limit``; returns bytes freed."""
+    global _estimated_size
+    limit = max_bytes() if limit is None else limit
+    files = []
+    for directory, _, names in os.walk(cache_root()):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    freed = 0
+    if total > limit:
+        files.sort()
+        target = limit * 0.9
+        for _, size, path in files:
+            if total - freed <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            freed += size
+    with _lock:
+        _estimated_size = total - freed
+    return freed
+
+
+def _account(size):
+    """Track what this process wrote, and evict once the cache may be over its limit."""
+    global _estimated_size
+    with _lock:
+        if _estimated_size is not None:
+            _estimated_size += size
+        over = _estimated_size is None or _estimated_size > max_bytes()
+    if over:
+        evict()
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_order(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_order_of(sender, instance, **kwargs):
+    invalidate(instance.order_id)
+
@@ -0,0 +1,134 @@
+"""
+Pre-aggregated sales statistics for the admin dashboard.
+
+``DailySalesSummary`` (orders/revenue per day) and ``DailyProductSales``
+(quantity/revenue per product per day) are keyed by the local date the order
+was placed and only count orders in SALES_STATUSES, the same rule
+admin_statistics used when it aggregated OrderItem rows on every page load.
+
+They are maintained incrementally by Order.set_status(): an order entering a
+counted status adds its totals, leaving one subtracts them. Status changes
+made outside set_status() (Django admin, raw updates) are repaired with
+``manage.py rebuild_sales_rollups``.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum, Count, DecimalField
+from django.db.models.functions import TruncDate, Coalesce
+from django.utils import timezone
+
+from .models import Order, OrderItem, DailySalesSummary, DailyProductSales
+
+SALES_STATUSES = ['confirmed', 'shipping', 'delivered', 'completed']
+
+
+def record_status_change(order, old_status, new_status):
+    was_counted = old_status in SALES_STATUSES
+    is_counted = new_status in SALES_STATUSES
+    if was_counted != is_counted:
+        apply_order(order, 1 if is_counted else -1)
+
+
+def apply_order(order, sign):
+    """Add (sign=1) or remove (sign=-1) an order's totals from the rollups."""
+    apply_orders([order], sign)
+
+
+def apply_orders(orders, sign):
+    """
+    apply_order() for many orders: one query for their items and one UPDATE
+    per rollup table, whatever the number of orders or days.
+    """
+    if not orders:
+        return
+    days = {order.pk: timezone.localdate(order.created_at) for order in orders}
+    day_totals = {}
+    for order in orders:
+        count, revenue = day_totals.get(days[order.pk], (0, 0))
+        day_totals[days[order.pk]] = (count + 1, revenue + order.total_amount)
+    product_totals = {}
+    rows = (
+        OrderItem.objects.filter(order__in=list(days), product__isnull=False)
+        .values('order_id', 'product_id').annotate(
+            qty=Sum('quantity'),
+            rev=Sum(F('quantity') * F('price'), output_field=DecimalField()),
+        ).order_by()
+    )
+    for row in rows:
+        key = (days[row['order_id']], row['product_id'])
+        qty, rev = product_totals.get(key, (0, 0))
+        product_totals[key] = (qty + row['qty'], rev + row['rev'])
+
+    with transaction.atomic():
+        DailySalesSummary.objects.bulk_create([DailySalesSummary(date=day) for day in day_totals], ignore_conflicts=True)
+        summaries = list(DailySalesSummary.objects.filter(date__in=list(day_totals)).only('id', 'date'))
+        for summary in summaries:
+            count, revenue = day_totals[summary.date]
+            summary.order_count = F('order_count') + sign * count
+            summary.revenue = F('revenue') + sign * revenue
+        DailySalesSummary.objects.bulk_update(summaries, ['order_count', 'revenue'])
+        if not product_totals:
+            return
+        DailyProductSales.objects.bulk_create(
+            [DailyProductSales(date=day, product_id=product_id) for day, product_id in product_totals],
+            ignore_conflicts=True,
+        )
+        # One UPDATE for all products of the orders, whatever their number.
+        rollups = list(
+            DailyProductSales.objects.filter(
+                date__in={day for day, _ in product_totals},
+                product_id__in={product_id for _, product_id in product_totals},
+            ).only('id', 'date', 'product_id')
+        )
+        rollups = [rollup for rollup in rollups if (rollup.date, rollup.product_id) in product_totals]
+        for rollup in rollups:
+            qty, rev = product_totals[(rollup.date, rollup.product_id)]
+            rollup.quantity = F('quantity') + sign * qty
+            rollup.revenue = F('revenue') + sign * rev
+        DailyProductSales.objects.bulk_update(rollups, ['quantity', 'revenue'], batch_size=500)
+
+
+def rebuild(since=None):
+    """
+    Recompute the rollups from Order/OrderItem, for every day or only for days
+    on/after ``since`` (a date). Returns (days, product rows) written.
+    """
+    orders = Order.objects.filter(status__in=SALES_STATUSES)
+    items = OrderItem.objects.filter(order__status__in=SALES_STATUSES, product__isnull=False)
+    summaries = DailySalesSummary.objects.all()
+    product_sales = DailyProductSales.objects.all()
+    if since is not None:
+        start = timezone.make_aware(datetime.combine(since, time.min))
+        orders = orders.filter(created_at__gte=start)
+        items = items.filter(order__created_at__gte=start)
+        summaries = summaries.filter(date__gte=since)
+        product_sales = product_sales.filter(date__gte=since)
+
+    day_rows = orders.annotate(day=TruncDate('created_at')).values('day').annotate(
+        order_count=Count('id'),
+        revenue=Coalesce(Sum('total_amount'), 0, output_field=DecimalField()),
+    ).order_by()
+    product_rows = items.annotate(day=TruncDate('order__created_at')).values('day', 'product_id').annotate(
+        qty=Sum('quantity'),
+        rev=Sum(F('quantity') * F('price'), output_field=DecimalField()),
+    ).order_by()
+
+    with transaction.atomic():
+        summaries.delete()
+        product_sales.delete()
+        new_days = DailySalesSummary.objects.bulk_create(
+            [DailySalesSummary(date=row['day'], order_count=row['order_count'], revenue=row['revenue']) for row in day_rows],
+            batch_size=1000,
+        )
+        new_products = DailyProductSales.objects.bulk_create(
+            (DailyProductSales(date=row['day'], product_id=row['product_id'], quantity=row['qty'], revenue=row['rev'])
+             for row in product_rows.iterator(chunk_size=2000)),
+            batch_size=1000,
+        )
+    return len(new_days), len(new_products)
+
+
+def window_start(days):
+    """First day included in a "last N days" window."""
+    return timezone.localdate(timezone.now() - timedelta(days=days))
@@ -0,0 +1,349 @@
+"""
+Product full-text search.
+
+Every product has a ``ProductSearchDocument`` row holding its title and body
+(excerpt + description + category name) folded to plain ASCII-ish lowercase:
+Vietnamese diacritics are stripped and "đ" becomes "d", so "trà đen" and
+"tra den" match the same products. The document table is the source for a
+vendor specific index:
+
+* SQLite: an external-content FTS5 table kept in sync by triggers on the
+  document table, ranked with bm25 (title weighted over body).
+* PostgreSQL: a GIN index on a weighted ``tsvector`` expression, ranked with
+  ``ts_rank``.
+* Anything else (or SQLite built without FTS5): ``icontains`` on the folded
+  document columns, which is still correct, just not indexed.
+
+The FTS table, its triggers and the GIN index are created by migration 0028.
+
+Every query word is matched as a prefix, so suggestions work while the user
+is still typing. Documents are refreshed from Product/Category signals; run
+``manage.py rebuild_search_index`` after bulk imports that bypass ``save()``.
+"""
+import re
+import unicodedata
+
+from django.db import connection, connections
+from django.db.models import Case, When, Value, IntegerField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Category, Product, ProductSearchDocument
+
+FTS_TABLE = 'myapp_product_fts'
+DOC_TABLE = ProductSearchDocument._meta.db_table
+PG_VECTOR = (
+    "setweight(to_tsvector('simple', title), 'A') || "
+    "setweight(to_tsvector('simple', body), 'B')"
+)
+
+# Fields whose change requires refreshing the search document.
+INDEXED_FIELDS = {'title', 'excerpt', 'description', 'category'}
+
+MAX_QUERY_TOKENS = 8
+# Matches ranked for product_list_view; the ones after it are listed newest first.
+MAX_RESULTS = 1000
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def fold_text(value):
+    """Lowercase and strip Vietnamese diacritics ("Trà Đen" -> "tra den")."""
+    if not value:
+        return ''
+    value = value.replace('đ', 'd').replace('Đ', 'D')
+    value = unicodedata.normalize('NFD', value)
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return value.lower()
+
+
+def tokenize(query):
+    """Split a raw query into folded search tokens."""
+    return _TOKEN_RE.findall(fold_text(query))[:MAX_QUERY_TOKENS]
+
+
+def build_document(product):
+    """Return the folded (title, body) pair stored for a product."""
+    category_name = product.category.name if product.category_id and product.category else ''
+    body = ' '.join(part for part in (product.excerpt, product.description, category_name) if part)
+    return fold_text(product.title), fold_text(body)
+
+
+def index_products(products):
+    """Create or refresh the search documents for an iterable of products."""
+    now = timezone.now()
+    documents = []
+    for product in products:
+        title, body = build_document(product)
+        documents.append(ProductSearchDocument(product=product, title=title, body=body, updated_at=now))
+    if documents:
+        ProductSearchDocument.objects.bulk_create(
+            documents,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['title', 'body', 'updated_at'],
+        )
+    return len(documents)
+
+
+def rebuild_index(batch_size=2000):
+    """Regenerate every search document. Returns the number of products indexed."""
+    total = 0
+    last_id = 0
+    qs = Product.objects.select_related('category').only(
+        'id', 'title', 'excerpt', 'description', 'category__name'
+    ).order_by('id')
+    while True:
+        batch = list(qs.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        total += index_products(batch)
+        last_id = batch[-1].id
+    ProductSearchDocument.objects.exclude(product__in=Product.objects.all()).delete()
+    if get_backend().name == 'sqlite-fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+# ==================== BACKENDS ====================
+
+class BaseSearchBackend:
+    name = None
+
+    def search(self, tokens, limit):
+        """Ids of documents containing every token, best ranked first."""
+        raise NotImplementedError
+
+    def match_ids(self, tokens, limit, title_only=False):
+        """Ids of documents containing every token, newest product first (no ranking)."""
+        raise NotImplementedError
+
+    def match_subquery(self, tokens):
+        """Subquery of the ids of all documents containing every token, for ``id__in``."""
+        raise NotImplementedError
+
+    def suggest(self, tokens, limit):
+        """
+        Cheap ranking for as-you-type suggestions: title matches first, then
+        body matches. Ranking every prefix match costs more than the lookup
+        itself when a short prefix such as "tr" hits most of the catalogue.
+        """
+        ids = self.match_ids(tokens, limit, title_only=True)
+        if len(ids) < limit:
+            seen = set(ids)
+            extra = [pk for pk in self.match_ids(tokens, limit + len(ids)) if pk not in seen]
+            ids += extra[:limit - len(ids)]
+        return ids
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    name = 'sqlite-fts5'
+
+    def search(self, tokens, limit):
+        sql = (
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, 10.0, 1.0), rowid DESC LIMIT %s"
+        )
+        return self._fetch(sql, [self._match(tokens), limit])
+
+    def match_ids(self, tokens, limit, title_only=False):
+        sql = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rowid DESC LIMIT %s"
+        return self._fetch(sql, [self._match(tokens, title_only), limit])
+
+    def match_subquery(self, tokens):
+        return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [self._match(tokens)])
+
+    def _match(self, tokens, title_only=False):
+        column = 'title : ' if title_only else ''
+        return ' AND '.join(f'{column}"{token}"*' for token in tokens)
+
+    def _fetch(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    name = 'postgresql'
+
+    def search(self, tokens, limit):
+        tsquery = self._tsquery(tokens)
+        sql = (
+            f'SELECT product_id FROM "{DOC_TABLE}" '
+            f"WHERE ({PG_VECTOR}) @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank(({PG_VECTOR}), to_tsquery('simple', %s)) DESC, product_id DESC LIMIT %s"
+        )
+        return self._fetch(sql, [tsquery, tsquery, limit])
+
+    def match_ids(self, tokens, limit, title_only=False):
+        sql = (
+            f'SELECT product_id FROM "{DOC_TABLE}" '
+            f"WHERE ({PG_VECTOR}) @@ to_tsquery('simple', %s) ORDER BY product_id DESC LIMIT %s"
+        )
+        return self._fetch(sql, [self._tsquery(tokens, title_only), limit])
+
+    def match_subquery(self, tokens):
+        return RawSQL(
+            f'SELECT product_id FROM "{DOC_TABLE}" WHERE ({PG_VECTOR}) @@ to_tsquery(\'simple\', %s)',
+            [self._tsquery(tokens)],
+        )
+
+    def _tsquery(self, tokens, title_only=False):
+        # Title lexemes carry weight A, so ":*A" restricts a prefix to the title.
+        suffix = ':*A' if title_only else ':*'
+        return ' & '.join(f"'{token}'{suffix}" for token in tokens)
+
+    def _fetch(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    name = 'fallback'
+
+    def search(self, tokens, limit):
+        title_hit = Case(When(title__icontains=tokens[0], then=Value(1)), default=Value(0), output_field=IntegerField())
+        qs = self._matches(tokens).annotate(title_hit=title_hit)
+        return list(qs.order_by('-title_hit', '-product_id').values_list('product_id', flat=True)[:limit])
+
+    def match_ids(self, tokens, limit, title_only=False):
+        qs = self._matches(tokens, title_only).order_by('-product_id')
+        return list(qs.values_list('product_id', flat=True)[:limit])
+
+    def match_subquery(self, tokens):
+        return self._matches(tokens).values('product_id')
+
+    def _matches(self, tokens, title_only=False):
+        qs = ProductSearchDocument.objects.all()
+        for token in tokens:
+            if title_only:
+                qs = qs.filter(title__icontains=token)
+            else:
+                qs = qs.filter(Q(title__icontains=token) | Q(body__icontains=token))
+        return qs
+
+
+_backends = {}
+
+
+def get_backend():
+    """Pick the backend for the default connection (cached per alias)."""
+    alias = connection.alias
+    backend = _backends.get(alias)
+    if backend is None:
+        conn = connections[alias]
+        if conn.vendor == 'sqlite' and FTS_TABLE in conn.introspection.table_names():
+            backend = SQLiteFTSBackend()
+        elif conn.vendor == 'postgresql':
+            backend = PostgresSearchBackend()
+        else:
+            backend = FallbackSearchBackend()
+        _backends[alias] = backend
+    return backend
+
+
+@receiver(post_migrate)
+def reset_backends(sender, **kwargs):
+    # Migrations may have created or dropped the FTS table since the backend was picked.
+    _backends.clear()
+
+
+def search_product_ids(query, limit=MAX_RESULTS):
+    """
+    Return up to ``limit`` product ids matching every word of ``query``, best
+    match first; none when the query has no searchable words.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    return get_backend().search(tokens, limit)
+
+
+def search_filter(query, limit=MAX_RESULTS):
+    """
+    ``(matches, rank)`` for a Product queryset: ``filter(matches)`` keeps every
+    product matching ``query`` and ``order_by(rank, '-id')`` lists the ``limit``
+    best ranked first, then the others newest first. Only the first ``limit``
+    matches are ranked; past that the filter is a subquery of all matches, so
+    further filters and counts still see every one of them.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return Q(pk__in=[]), Value(0)
+    backend = get_backend()
+    ids = backend.search(tokens, limit)
+    matches = Q(id__in=ids) if len(ids) < limit else Q(id__in=backend.match_subquery(tokens))
+    return matches, _ranking(ids)
+
+
+def suggest_product_ids(query, limit=30):
+    """Like search_product_ids, tuned for as-you-type suggestions."""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    return get_backend().suggest(tokens, limit)
+
+
+def order_by_ids(queryset, ids):
+    """Keep the ranking returned by search_product_ids on a Product queryset."""
+    if not ids:
+        return queryset.none()
+    return queryset.filter(id__in=ids).annotate(search_rank=_ranking(ids)).order_by('search_rank')
+
+
+def _ranking(ids):
+    if not ids:
+        return Value(0)
+    return Case(
+        *[When(id=pk, then=Value(pos)) for pos, pk in enumerate(ids)],
+        default=Value(len(ids)), output_field=IntegerField(),
+    )
+
+
+# ==================== SIGNALS ====================
+
+@receiver(post_save, sender=Product)
+def update_product_search_document(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    index_products([instance])
+
+
+@receiver(post_save, sender=Category)
+def update_category_search_documents(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or created:
+        return
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    _reindex_products(Product.objects.filter(category=instance))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    # Products fall back to category=NULL through a bulk UPDATE, so keep the
+    # ids to drop the old category name from their documents afterwards.
+    instance._search_product_ids = list(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def update_uncategorized_search_documents(sender, instance, **kwargs):
+    product_ids = getattr(instance, '_search_product_ids', None)
+    if product_ids:
+        _reindex_products(Product.objects.filter(id__in=product_ids))
+
+
+def _reindex_products(queryset):
+    products = queryset.select_related('category').only(
+        'id', 'title', 'excerpt', 'description', 'category__name'
+    )
+    index_products(products.iterator(chunk_size=500))
+
+# Documents are removed together with their product through the CASCADE
+# foreign key, which also fires the FTS delete trigger on SQLite.
@@ -1,19 +1,11 @@
 import json
-from django.db.models.signals import post_save, post_delete, pre_save
+from functools import lru_cache
+from django.db.models.signals import post_init, post_save, post_delete
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
 from django.dispatch import receiver
 from django.forms.models import model_to_dict
-from django_q.tasks import async_task
-from django.conf import settings
-from .tasks import process_audit_event_task
+from .audit_sink import audit_sink
 from .middleware import get_current_request
-
-def async_or_sync_task(func_name, payload):
-    sync_mode = getattr(settings, 'Q_CLUSTER', {}).get('sync', False)
-    if sync_mode:
-        process_audit_event_task(payload)
-    else:
-        async_task(func_name, payload)
 from .models import Order, Product, Category, UserProfile, Coupon, Payment, Invoice, InventoryReceipt, InventoryTransaction, ReturnRequest, StoryboardItem, CabinetItem, RawItem, Review
 from django.contrib.auth.models import User
 
@@ -60,7 +52,7 @@ def serialize_instance(instance):
         opts = instance._meta
         
         # We manually build the dict to handle labels better than model_to_dict
-        for f in opts.concrete_fields:
+        for f in audited_fields(type(instance)):
             value = f.value_from_object(instance)
             
             # 1. Handle Choices
@@ -99,7 +91,7 @@ def log_user_login(sender, request, user, **kwargs):
         'status': 'SUCCESS',
         'reason': 'User logged in successfully'
     }
-    async_or_sync_task('MyApp.tasks.process_audit_event_task', payload)
+    audit_sink.emit(payload)
 
 @receiver(user_logged_out)
 def log_user_logout(sender, request, user, **kwargs):
@@ -115,7 +107,7 @@ def log_user_logout(sender, request, user, **kwargs):
         'status': 'SUCCESS',
         'reason': 'User logged out'
     }
-    async_or_sync_task('MyApp.tasks.process_audit_event_task', payload)
+    audit_sink.emit(payload)
 
 @receiver(user_login_failed)
 def log_user_login_failed(sender, credentials, request, **kwargs):
@@ -134,42 +126,156 @@ def log_user_login_failed(sender, credentials, request, **kwargs):
         'status': 'FAILED',
         'reason': 'Invalid credentials'
     }
-    async_or_sync_task('MyApp.tasks.process_audit_event_task', payload)
+    audit_sink.emit(payload)
 
 # ================= DATA MANIPULATION (CRUD) SIGNALS =================
 
-# Store old state before save to calculate diff
-_old_states = {}
+# Updates are audited as a diff against a snapshot of the field values taken
+# when the instance was loaded (post_init), so saving a tracked model costs no
+# extra query: no SELECT of the old row, no fetching of related objects.
+# post_init runs for every row of every listing of these models, so the
+# snapshot is a plain copy of the instance dict; picking the audited fields
+# out of it waits until the instance is saved (changed_fields()).
+
+# Per-model allowlist of audited fields (default: every concrete field).
+AUDITED_FIELDS = {
+    User: ['username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser', 'date_joined'],
+}
+# Updates that change nothing but these fields are not logged: counters,
+# stock holds (holds are already in the InventoryTransaction ledger) and the
+# values product_stats.py derives from other rows.
+COUNTER_FIELDS = {
+    Product: {'views_count', 'reserved_stock', 'total_available_stock', 'avg_rating', 'review_count'},
+}
+
+_UNKNOWN = object()
+
+
+@lru_cache(maxsize=None)
+def audited_fields(model):
+    allowed = AUDITED_FIELDS.get(model)
+    return tuple(f for f in model._meta.concrete_fields if allowed is None or f.name in allowed)
+
+
+@lru_cache(maxsize=None)
+def _diffed_fields(model):
+    # auto_now timestamps change on every save; they are not a change of their own.
+    return tuple(f for f in audited_fields(model) if not getattr(f, 'auto_now', False))
+
+
+def snapshot_state(sender, instance, **kwargs):
+    """post_init: remember the loaded values (deferred fields are simply absent)."""
+    snapshot = instance.__dict__.copy()
+    snapshot.pop('_audit_snapshot', None)
+    instance._audit_snapshot = snapshot
+
+
+for _model in TRACKED_MODELS:
+    post_init.connect(snapshot_state, sender=_model, dispatch_uid=f'audit_snapshot_{_model.__name__}')
+
+
+def changed_fields(sender, instance, update_fields=None):
+    """[(field, old value or _UNKNOWN, new value)] of the fields that differ from the snapshot."""
+    snapshot = getattr(instance, '_audit_snapshot', {})
+    values = instance.__dict__
+    changes = []
+    for f in _diffed_fields(sender):
+        if update_fields is not None and f.name not in update_fields and f.attname not in update_fields:
+            continue
+        if f.attname not in values:
+            continue  # deferred: not saved
+        new = values[f.attname]
+        if f.attname not in snapshot or hasattr(snapshot[f.attname], 'resolve_expression'):
+            # Not loaded, or last saved as an F() expression: only known to change when named explicitly.
+            if update_fields is not None:
+                changes.append((f, _UNKNOWN, new))
+            continue
+        old = snapshot[f.attname]
+        if not _same_value(f, old, new):
+            changes.append((f, old, new))
+    return changes
+
+
+def _same_value(field, old, new):
+    if old == new:
+        return True
+    if hasattr(new, 'resolve_expression'):
+        return False
+    try:
+        return field.to_python(old) == field.to_python(new)
+    except Exception:
+        return False
+
+
+def _display_value(instance, field, value):
+    """Same labels as serialize_instance(), without loading related objects."""
+    if value is None:
+        return None
+    if field.choices:
+        return f"{dict(field.flatchoices).get(value, value)} ({value})"
+    if field.is_relation:
+        related = field.get_cached_value(instance, None) if field.is_cached(instance) else None
+        if related is not None and related.pk == value:
+            return f"{related} [ID: {value}]"
+        return f"[ID: {value}]"
+    if not isinstance(value, (str, int, float, bool, dict, list)):
+        return str(value)
+    return value
 
-@receiver(pre_save)
-def capture_old_state(sender, instance, **kwargs):
-    if sender not in TRACKED_MODELS:
-        return
-    if instance.pk:
-        try:
-            old_instance = sender.objects.get(pk=instance.pk)
-            _old_states[id(instance)] = serialize_instance(old_instance)
-        except sender.DoesNotExist:
-            _old_states[id(instance)] = None
-    else:
-        _old_states[id(instance)] = None
 
 @receiver(post_save)
-def log_model_save(sender, instance, created, **kwargs):
+def log_model_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if sender not in TRACKED_MODELS or raw:
+        return
+
+    if created:
+        snapshot_state(sender, instance)
+        audit_sink.emit(_save_payload(sender, instance, True, get_actor_info(), None, serialize_instance(instance)))
+        return
+    states = _update_states(sender, instance, update_fields)
+    if states:
+        audit_sink.emit(_save_payload(sender, instance, False, get_actor_info(), *states))
+
+def _update_states(sender, instance, update_fields):
+    """(before_state, after_state) of an update, or None when only counters changed; re-snapshots."""
+    changes = changed_fields(sender, instance, update_fields)
+    snapshot_state(sender, instance)
+    counters = COUNTER_FIELDS.get(sender, ())
+    if all(f.name in counters for f, _, _ in changes):
+        # No actual change, or only counters
+        return None
+    before_state = {f.name: _display_value(instance, f, old) for f, old, _ in changes if old is not _UNKNOWN}
+    after_state = {f.name: _display_value(instance, f, new) for f, _, new in changes}
+    return before_state, after_state
+
+def log_bulk_create(sender, instances):
+    """Audit rows inserted with bulk_create(), which does not send post_save."""
     if sender not in TRACKED_MODELS:
         return
-        
     actor_info = get_actor_info()
-    event_type = 'DATA_CREATE' if created else 'DATA_UPDATE'
-    
-    after_state = serialize_instance(instance)
-    before_state = _old_states.pop(id(instance), None)
-    
-    if not created and before_state == after_state:
-        # No actual change
+    audit_sink.emit_many([
+        _save_payload(sender, instance, True, actor_info, None, serialize_instance(instance))
+        for instance in instances
+    ])
+
+def log_bulk_update(sender, instances, update_fields=None):
+    """
+    Audit rows changed with QuerySet.update() or bulk_update(), which do not
+    send post_save. Set the new values on the loaded instances first.
+    """
+    if sender not in TRACKED_MODELS:
         return
+    actor_info = get_actor_info()
+    payloads = []
+    for instance in instances:
+        states = _update_states(sender, instance, update_fields)
+        if states:
+            payloads.append(_save_payload(sender, instance, False, actor_info, *states))
+    audit_sink.emit_many(payloads)
 
-    payload = {
+def _save_payload(sender, instance, created, actor_info, before_state, after_state):
+    event_type = 'DATA_CREATE' if created else 'DATA_UPDATE'
+    return {
         'event_type': event_type,
         'severity_level': 'INFO' if event_type == 'DATA_CREATE' else 'WARNING',
         **actor_info,
@@ -180,7 +286,6 @@ def log_model_save(sender, instance, created, **kwargs):
         'status': 'SUCCESS',
         'reason': f'{sender.__name__} was {"created" if created else "updated"}'
     }
-    async_or_sync_task('MyApp.tasks.process_audit_event_task', payload)
 
 @receiver(post_delete)
 def log_model_delete(sender, instance, **kwargs):
@@ -201,4 +306,4 @@ def log_model_delete(sender, instance, **kwargs):
         'status': 'SUCCESS',
         'reason': f'{sender.__name__} was deleted'
     }
-    async_or_sync_task('MyApp.tasks.process_audit_event_task', payload)
+    audit_sink.emit(payload)
@@ -0,0 +1,173 @@
+"""
+Notifications to groups of staff.
+
+New support tickets, return requests, reviews and orders each looped over
+``User.objects.filter(is_staff=True)`` and created one Notification per staff
+member, every INSERT (and its post_save push with a COUNT query) inside the
+customer's request. Now:
+
+* recipients are named by group: ``'staff'`` (is_staff) or a UserProfile
+  role (``'admin'``, ``'accountant'``, ``'warehouse'``). The roster of all
+  groups is read with one query and kept in the cache; a save or delete that
+  changes the groups of a user clears it. With a local-memory cache, which
+  the other worker processes would not see cleared, it is read from the
+  database every time instead,
+* ``fan_out()`` queues the work with tasks.run_task_on_commit(), so it runs
+  in a django-q worker (inline after the commit in sync mode),
+* ``deliver()`` writes every row with one bulk_create and publishes one event
+  on the ``staff`` channel of the notification bus, with the id of each
+  recipient's row. notification_sse subscribes members to that channel and
+  turns the event into their own badge state (``recipient_state()``), without
+  a query per recipient.
+"""
+import logging
+
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Notification, UserProfile
+from .notification_bus import publish, staff_channel
+from .notifications import serialize_notification
+
+logger = logging.getLogger(__name__)
+
+ROSTER_KEY = 'staff_fanout_roster'
+ROSTER_TIMEOUT = 600
+STAFF = 'staff'
+
+
+def uses_cache():
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _members():
+    return User.objects.filter(is_active=True).filter(
+        Q(is_staff=True) | (Q(profile__isnull=False) & ~Q(profile__role='customer'))
+    )
+
+
+def roster():
+    """{group: sorted user ids} of the active members of every group."""
+    groups = cache.get(ROSTER_KEY) if uses_cache() else None
+    if groups is None:
+        groups = {}
+        for user_id, is_staff, role in _members().values_list('id', 'is_staff', 'profile__role').order_by('id'):
+            if is_staff:
+                groups.setdefault(STAFF, []).append(user_id)
+            if role and role != 'customer':
+                groups.setdefault(role, []).append(user_id)
+        if uses_cache():
+            cache.set(ROSTER_KEY, groups, ROSTER_TIMEOUT)
+    return groups
+
+
+def recipients(groups):
+    """Ids of the members of any of ``groups``, each once."""
+    members = roster()
+    return sorted({user_id for group in groups for user_id in members.get(group, ())})
+
+
+def is_member(user_id):
+    if not uses_cache():
+        return _members().filter(pk=user_id).exists()
+    return any(user_id in ids for ids in roster().values())
+
+
+def fan_out(groups, notification_type, title, message_text, link='', actor=None):
+    """Notify ``groups`` once the current transaction commits, off the request thread when a worker runs."""
+    from .tasks import run_task_on_commit
+
+    run_task_on_commit(
+        'staff_fanout_task', list(groups), notification_type, title, message_text, link,
+        actor.pk if actor is not None else None,
+    )
+
+
+def deliver(groups, notification_type, title, message_text, link='', actor_id=None):
+    """Create the notification for every member of ``groups`` with one INSERT and publish one event."""
+    notifications = Notification.objects.bulk_create([
+        Notification(
+            user_id=user_id,
+            actor_id=actor_id,
+            notification_type=notification_type,
+            title=title,
+            message=message_text,
+            link=link,
+        )
+        for user_id in recipients(groups)
+    ])
+    if notifications:
+        transaction.on_commit(lambda: _publish(notifications))
+    return notifications
+
+
+def recipient_state(event, user_id, unread_count):
+    """
+    The stream payload of a ``staff`` channel event for ``user_id``, whose
+    badge showed ``unread_count``; None when the event is not for them.
+    """
+    # Keys are strings: the event went through JSON on the Redis bus.
+    notification_id = event['recipients'].get(str(user_id), 0)
+    if notification_id == 0:
+        return None
+    return {
+        'unread_count': unread_count + 1,
+        'latest': dict(event['notification'], id=notification_id),
+    }
+
+
+def _publish(notifications):
+    event = {
+        'recipients': {str(n.user_id): n.pk for n in notifications},
+        'notification': serialize_notification(notifications[0]),
+    }
+    try:
+        publish(staff_channel(), event)
+    except Exception as e:
+        # Real-time push is best effort, never break the caller.
+        logger.warning(f"Staff fan-out: publish of '{event['notification']['title']}' failed ({e})")
+
+
+def _groups_of(user, role):
+    if not user.is_active:
+        return set()
+    groups = {role} if role and role != 'customer' else set()
+    if user.is_staff:
+        groups.add(STAFF)
+    return groups
+
+
+def _refresh(user_id, groups_now):
+    """Clear the cached roster when it does not list ``user_id`` in ``groups_now``."""
+    if not uses_cache():
+        return
+    groups = cache.get(ROSTER_KEY)
+    if groups is None:
+        return
+    if {group for group, ids in groups.items() if user_id in ids} != groups_now:
+        transaction.on_commit(lambda: cache.delete(ROSTER_KEY))
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_saved(sender, instance, raw=False, **kwargs):
+    # save_user_profile() saves the profile with every save of its user, so this sees flag changes too.
+    if not raw:
+        _refresh(instance.user_id, _groups_of(instance.user, instance.role))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, raw=False, **kwargs):
+    # Users without a profile (save_user_profile() has just looked it up).
+    if not raw and not hasattr(instance, 'profile'):
+        _refresh(instance.pk, _groups_of(instance, None))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    _refresh(instance.pk, set())
@@ -0,0 +1,65 @@
+"""
+Bulk serialization of support messages.
+
+SupportMessage.to_dict() reads the message's sender, the sender's profile
+(for the avatar) and its attachments, each loaded lazily. The support APIs
+serialized whole histories with at most the attachments prefetched, so a
+ticket with 200 messages cost a few hundred queries per poll.
+
+``serialize_messages()`` returns the same dicts for any number of messages in
+a fixed number of queries: senders with their profiles in one (a JOIN for a
+queryset, a prefetch for a list of instances) and attachments in one. Each
+sender's avatar URL is computed once per call, not once per message, so a
+view serializing everything it returns in one call builds each URL once per
+request.
+"""
+from django.db.models import prefetch_related_objects
+from django.db.models.query import QuerySet
+
+
+def serialize_messages(messages):
+    """to_dict() of each of ``messages`` (a queryset or a list of SupportMessage)."""
+    if isinstance(messages, QuerySet):
+        messages = messages.select_related('sender__profile').prefetch_related('attachments')
+    messages = list(messages)
+    # Skips whatever the caller already loaded.
+    prefetch_related_objects(messages, 'sender__profile', 'attachments')
+    avatars = {}
+    return [serialize_message(message, avatars) for message in messages]
+
+
+def serialize_message(message, avatars=None):
+    sender = message.sender
+    if sender is not None:
+        sender_name = sender.get_full_name() or sender.username
+    else:
+        sender_name = 'Bot TeaZen' if message.sender_type == 'bot' else 'Hệ thống'
+    return {
+        'id': message.id,
+        'sender_type': message.sender_type,
+        'sender_name': sender_name,
+        'sender_avatar': _avatar_url(sender, {} if avatars is None else avatars) if sender is not None else None,
+        'content': message.content,
+        'is_read': message.is_read,
+        'is_internal': message.is_internal,
+        'client_msg_id': message.client_msg_id,
+        'created_at': message.created_at.isoformat(),
+        'attachments': [
+            {
+                'id': a.id,
+                'file_url': a.file.url,
+                'file_name': a.file_name,
+                'file_type': a.file_type,
+                'file_size': a.file_size,
+            }
+            for a in message.attachments.all()
+        ],
+    }
+
+
+def _avatar_url(user, avatars):
+    if user.pk not in avatars:
+        # A missing profile raises RelatedObjectDoesNotExist, an AttributeError.
+        profile = getattr(user, 'profile', None)
+        avatars[user.pk] = profile.avatar.url if profile is not None and profile.avatar else None
+    return avatars[user.pk]
@@ -0,0 +1,168 @@
+"""
+Push channel for support tickets.
+
+The chat widget polled api_support_messages_get every 3 to 8 seconds for an
+open ticket (and every 15 s while closed, to light the unread dot), and the
+agent dashboard reloaded the selected ticket every 10 seconds. Every poll read
+the ticket, ran an UPDATE for read marks and serialized messages, whether or
+not anyone had written anything.
+
+Now every change of a ticket is published on its ``ticket:<id>`` channel of
+the notification bus once the transaction commits:
+
+* a new SupportMessage, or a new attachment on one (receivers below;
+  bulk_transitions.close_tickets publishes the messages it bulk-creates),
+* a status or assignment change of the SupportTicket.
+
+The update has the shape of the messages API response (messages,
+ticket_status, agent_info) and is built once per change, internal notes
+included. api_support_messages_stream holds one TicketFeed per connection,
+which drops what its viewer may not see or was already sent, so a connected
+customer or agent costs no query until something happens on the ticket.
+
+Each SSE event carries the id of the newest message sent so far as its
+``id:``. A reconnecting EventSource sends it back as Last-Event-ID (the first
+connection passes ``?after_id=``) and gets the messages it missed from the
+database before the live updates.
+"""
+import json
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import SupportTicket, SupportMessage, SupportAttachment
+from .notification_bus import publish, ticket_channel
+from .support_serializers import serialize_messages
+
+logger = logging.getLogger(__name__)
+
+# Ticket fields the widget shows; saves touching only others (priority, updated_at) publish nothing.
+STATE_FIELDS = {'status', 'assigned_to'}
+# Messages a viewer marks read by receiving them, as the messages API (customer) and the dashboard (agent) do.
+READ_ON_DELIVERY = {False: ('agent', 'bot', 'system'), True: ('customer',)}
+
+
+def agent_info(ticket):
+    """Name and avatar of the agent assigned to ``ticket``, None when unassigned."""
+    agent = ticket.assigned_to
+    if agent is None:
+        return None
+    return {
+        'name': agent.get_full_name() or agent.username,
+        'avatar': agent.profile.avatar.url if hasattr(agent, 'profile') and agent.profile.avatar else None,
+    }
+
+
+def ticket_updates(ticket_ids, message_ids=()):
+    """{ticket id: update}: the given messages of each ticket and its state, as published on its channel."""
+    updates = {
+        ticket.pk: {'messages': [], 'ticket_status': ticket.status, 'agent_info': agent_info(ticket)}
+        for ticket in SupportTicket.objects.select_related('assigned_to__profile').filter(pk__in=ticket_ids)
+    }
+    if message_ids:
+        messages = list(SupportMessage.objects.filter(ticket_id__in=updates, pk__in=message_ids).order_by('id'))
+        for message, data in zip(messages, serialize_messages(messages)):
+            updates[message.ticket_id]['messages'].append(data)
+    return updates
+
+
+def publish_ticket_update(ticket_id, message_ids=()):
+    """Push ``message_ids`` and the state of the ticket after the current transaction commits."""
+    publish_ticket_updates([ticket_id], message_ids)
+
+
+def publish_ticket_updates(ticket_ids, message_ids=()):
+    """Same for several tickets, loaded together (bulk transitions)."""
+    ticket_ids, message_ids = list(ticket_ids), list(message_ids)
+
+    def _send():
+        try:
+            updates = ticket_updates(ticket_ids, message_ids)
+        except Exception as e:
+            logger.warning(f"Support stream: loading updates of tickets {ticket_ids[:5]} failed ({e})")
+            return
+        for ticket_id, update in updates.items():
+            try:
+                publish(ticket_channel(ticket_id), update)
+            except Exception as e:
+                # Real-time push is best effort, never break the caller.
+                logger.warning(f"Support stream: publish to ticket {ticket_id} failed ({e})")
+
+    transaction.on_commit(_send)
+
+
+class TicketFeed:
+    """The stream of one connection: what its viewer may see and what it was already sent."""
+
+    def __init__(self, ticket_id, as_agent, cursor=0):
+        self.ticket_id = ticket_id
+        self.as_agent = as_agent
+        self.cursor = cursor
+        self._sent = {}  # message id -> number of attachments sent with it
+        self._state = None
+
+    def first_event(self):
+        """The messages after the cursor (none without a cursor) and the current state of the ticket."""
+        ticket = SupportTicket.objects.select_related('assigned_to__profile').get(pk=self.ticket_id)
+        messages = []
+        if self.cursor:
+            missed = SupportMessage.objects.filter(ticket_id=self.ticket_id, pk__gt=self.cursor).order_by('id')
+            if not self.as_agent:
+                missed = missed.filter(is_internal=False)
+            messages = serialize_messages(missed)
+        update = {'messages': messages, 'ticket_status': ticket.status, 'agent_info': agent_info(ticket)}
+        return self._event(self._accept(update, force=True))
+
+    def next_event(self, update):
+        """The event for an update published on the channel, or None when it has nothing for this viewer."""
+        data = self._accept(update)
+        return self._event(data) if data is not None else None
+
+    def _accept(self, update, force=False):
+        messages = [
+            m for m in update['messages']
+            if (self.as_agent or not m['is_internal']) and self._sent.get(m['id']) != len(m['attachments'])
+        ]
+        state = (update['ticket_status'], update['agent_info'])
+        if not messages and state == self._state and not force:
+            return None
+        for m in messages:
+            self._sent[m['id']] = len(m['attachments'])
+            self.cursor = max(self.cursor, m['id'])
+        self._state = state
+        self._mark_read(messages)
+        return {'messages': messages, 'ticket_status': state[0], 'agent_info': state[1], 'agent_typing': False}
+
+    def _mark_read(self, messages):
+        senders = READ_ON_DELIVERY[self.as_agent]
+        unread = [m['id'] for m in messages if m['sender_type'] in senders and not m['is_read']]
+        if unread:
+            SupportMessage.objects.filter(pk__in=unread, is_read=False).update(is_read=True)
+
+    def _event(self, data):
+        event_id = f"id: {self.cursor}\n" if self.cursor else ""
+        return f"{event_id}data: {json.dumps(data)}\n\n"
+
+
+@receiver(post_save, sender=SupportMessage)
+def publish_new_message(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        publish_ticket_update(instance.ticket_id, [instance.pk])
+
+
+@receiver(post_save, sender=SupportAttachment)
+def publish_new_attachment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        # Sent again with its attachments; feeds let a message through once more when they changed.
+        publish_ticket_update(instance.message.ticket_id, [instance.message_id])
+
+
+@receiver(post_save, sender=SupportTicket)
+def publish_ticket_state(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if created or raw:
+        return
+    if update_fields is not None and not STATE_FIELDS & set(update_fields):
+        return
+    publish_ticket_update(instance.pk)
@@ -1,37 +1,138 @@
-import hashlib
-from .audit_models import AuditLog
+import logging
+
+from .audit_sink import write_audit_events
+
+logger = logging.getLogger(__name__)
 
 def process_audit_event_task(payload):
     """
-    Background worker task to process and save audit logs sequentially.
-    Ensures that hash chaining is calculated without race conditions.
+    Background worker task to save a single audit log.
+    Hash chaining is done by the batched writer in audit_sink.py, which locks
+    the chain head so concurrent workers cannot fork the chain.
     """
+    process_audit_batch_task([payload])
+
+
+def process_audit_batch_task(payloads):
+    """Background worker task to save a batch of audit logs in one transaction."""
     try:
-        # Get the previous hash from the latest entry
-        last_log = AuditLog.objects.order_by('-timestamp').first()
-        previous_hash = last_log.current_hash if last_log and last_log.current_hash else "0000000000000000000000000000000000000000000000000000000000000000"
-
-        # Prepare data for hashing
-        hash_content = f"{previous_hash}|{payload.get('event_type')}|{payload.get('actor_id')}|{payload.get('resource_id')}"
-        current_hash = hashlib.sha256(hash_content.encode('utf-8')).hexdigest()
-
-        # Create record
-        AuditLog.objects.create(
-            event_type=payload.get('event_type'),
-            severity_level=payload.get('severity_level', 'INFO'),
-            actor_id=payload.get('actor_id'),
-            actor_role=payload.get('actor_role', ''),
-            ip_address=payload.get('ip_address'),
-            user_agent=payload.get('user_agent', ''),
-            resource_type=payload.get('resource_type', ''),
-            resource_id=payload.get('resource_id', ''),
-            before_state=payload.get('before_state', ''),
-            after_state=payload.get('after_state', ''),
-            status=payload.get('status', 'SUCCESS'),
-            reason=payload.get('reason', ''),
-            previous_hash=previous_hash,
-            current_hash=current_hash
+        write_audit_events(payloads)
+    except Exception:
+        # Safely catch error so worker doesn't crash on one failing batch
+        logger.exception(f"process_audit_batch_task: writing {len(payloads)} audit event(s) failed")
+
+
+# ==================== POST-COMMIT SIDE EFFECTS ====================
+# Staff notifications and customer emails used to run inline in checkout and
+# casso_webhook, after the order transaction, so every request paid for one
+# INSERT per staff user plus the SMTP round trip. They are now queued with
+# run_task_on_commit() and run in a django-q worker. Q_CLUSTER['sync'] (on by
+# default only with DEBUG, see settings.py) runs them inline after the commit.
+
+def run_task_on_commit(task_name, *args):
+    """
+    Run ``MyApp.tasks.<task_name>(*args)`` once the current transaction commits
+    (immediately in autocommit): in a django-q worker, or inline in sync mode
+    like dispatch_audit_events.
+    """
+    from django.conf import settings
+    from django.db import transaction
+
+    def _dispatch():
+        try:
+            if getattr(settings, 'Q_CLUSTER', {}).get('sync', False):
+                globals()[task_name](*args)
+            else:
+                from django_q.tasks import async_task
+                async_task(f'MyApp.tasks.{task_name}', *args)
+        except Exception as e:
+            # The order/payment is already committed; never fail the request for a side effect.
+            logger.error(f"Side-effect task {task_name}{args} failed: {e}")
+
+    transaction.on_commit(_dispatch)
+
+
+def order_placed_task(order_id, payment_method):
+    """Notify staff about a new order and send the customer their confirmation email."""
+    from django.core.mail import send_mail
+    from .models import Order
+    from .staff_fanout import deliver
+
+    order = Order.objects.select_related('user').get(pk=order_id)
+    items = list(order.items.all())
+    deliver(
+        ('staff', 'warehouse'),
+        notification_type='order',
+        title=f'Đơn hàng mới {order.order_number}',
+        message_text=f'{order.user.username} đã đặt {len(items)} sản phẩm.',
+        link=f'/manage/orders/{order.order_number}/manage/',
+    )
+
+    if not order.user.email:
+        return
+    items_text = '\n'.join(f'  - {item.product_title} x{item.quantity}' for item in items)
+    if payment_method == 'cod':
+        payment_instruction = 'Bạn sẽ thanh toán khi nhận hàng. Vui lòng chuẩn bị số tiền chính xác.'
+    else:
+        payment_instruction = 'Vui lòng thanh toán qua chuyển khoản để chúng tôi xử lý đơn hàng.'
+    send_mail(
+        f'Xác nhận đơn hàng {order.order_number} - TeaZen',
+        f'Xin chào {order.user.get_full_name() or order.user.username},\n\n'
+        f'Đơn hàng của bạn đã được tạo thành công!\n\n'
+        f'Mã đơn: {order.order_number}\n'
+        f'Sản phẩm:\n{items_text}\n\n'
+        f'Tổng tiền: {order.total_amount:,.0f}đ\n\n'
+        f'{payment_instruction}\n\n'
+        f'Trân trọng,\nTeaZen',
+        None,
+        [order.user.email],
+        fail_silently=True,
+    )
+
+
+def staff_fanout_task(groups, notification_type, title, message_text, link='', actor_id=None):
+    """Queued by staff_fanout.fan_out()."""
+    from .staff_fanout import deliver
+
+    deliver(groups, notification_type, title, message_text, link=link, actor_id=actor_id)
+
+
+def payments_confirmed_task(confirmations):
+    """
+    Tell customers their bank transfers were matched: one notification each,
+    and the emails over a single SMTP connection. ``confirmations`` is a list
+    of (order_id, amount received).
+    """
+    from django.core.mail import EmailMessage, get_connection
+    from .models import Order
+    from .views.utils import create_notification
+
+    received_by_order = dict(confirmations)
+    emails = []
+    for order in Order.objects.filter(id__in=received_by_order).select_related('user'):
+        received = received_by_order[order.id]
+        create_notification(
+            user=order.user,
+            notification_type='order',
+            title=f'Thanh toán đơn {order.order_number} thành công!',
+            message_text=f'Hệ thống đã xác nhận giao dịch {received:,}đ từ tài khoản của bạn.',
+            link=f'/order/{order.order_number}/',
         )
-    except Exception as e:
-        # Safely catch error so worker doesn't crash on one failing log
-        print(f"Error in process_audit_event_task: {e}")
+        if order.user.email:
+            emails.append(EmailMessage(
+                f'Thanh toán đơn {order.order_number} thành công! - TeaZen',
+                f'Xin chào {order.user.get_full_name() or order.user.username},\n\n'
+                f'Chúng tôi đã xác nhận thanh toán {received:,}đ cho đơn hàng {order.order_number}.\n\n'
+                f'Đơn hàng của bạn đang được xử lý.\n\n'
+                f'Trân trọng,\nTeaZen',
+                None,
+                [order.user.email],
+            ))
+    if emails:
+        get_connection(fail_silently=True).send_messages(emails)
+
+
+def flush_view_counts_task():
+    """Scheduled with django-q (see manage.py flush_view_counts)."""
+    from . import view_counter
+    return view_counter.flush()
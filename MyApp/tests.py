@@ -1,3 +1,77 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from MyApp import view_counter
+from MyApp.management.commands import check_query_plans, stress_stock_reservation
+from MyApp.models import SupportAttachment, SupportMessage, SupportTicket
+from MyApp.query_inspector import assert_query_budget
+
+
+class QueryPlanTests(TestCase):
+    """The checks of ``manage.py check_query_plans``, on a smaller seed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixture = check_query_plans.Command()._seed(300)
+
+    def setUp(self):
+        self.command = check_query_plans.Command(stdout=StringIO())
+
+    def tearDown(self):
+        # Views counted product views in memory; write them while the test transaction is open.
+        view_counter.flush()
+
+    def test_hot_filters_use_an_index(self):
+        self.assertEqual(self.command.check_queries(self.fixture), [])
+
+    def test_views_within_budget_without_full_scans(self):
+        self.assertEqual(self.command.check_views(self.fixture), [])
+
+
+class StockReservationQueryTests(TestCase):
+    def test_query_count_does_not_grow_with_order_lines(self):
+        counts = stress_stock_reservation.query_counts()
+        self.assertFalse(stress_stock_reservation.counts_grow(counts), counts)
+
+
+class SupportMessagesQueryTests(TestCase):
+    """api_support_messages_get runs the same queries for 3 messages as for 200."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('support-customer')
+        agents = [User.objects.create_user(f'support-agent-{i}', first_name=f'Agent {i}') for i in range(3)]
+        cls.tickets = {}
+        for length in (3, 200):
+            ticket = SupportTicket.objects.create(
+                user=cls.customer, subject=f'{length} tin nhắn', status='assigned', assigned_to=agents[0],
+            )
+            messages = SupportMessage.objects.bulk_create([
+                SupportMessage(ticket=ticket, sender_type='customer' if i % 2 else 'agent',
+                               sender=cls.customer if i % 2 else agents[i % 3], content=f'Tin nhắn {i}')
+                for i in range(length)
+            ])
+            SupportAttachment.objects.bulk_create([
+                SupportAttachment(message=message, file=f'support_attachments/test-{message.pk}.png', file_name='anh.png')
+                for message in messages[::5]
+            ])
+            cls.tickets[length] = ticket
+
+    def setUp(self):
+        self.client.force_login(self.customer)
+
+    def _get(self, length):
+        url = reverse('api_support_messages_get', kwargs={'ticket_id': self.tickets[length].pk})
+        with CaptureQueriesContext(connection) as queries, assert_query_budget('api_support_messages_get'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), length)
+        return len(queries)
 
-# Create your tests here.
+    def test_query_count_does_not_grow_with_history(self):
+        self.assertEqual(self._get(3), self._get(200))
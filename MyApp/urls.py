@@ -152,6 +152,7 @@ urlpatterns = [
     path('api/support/status/', views.api_support_status, name='api_support_status'),
     path('api/support/tickets/', views.api_support_create_ticket, name='api_support_create_ticket'),
     path('api/support/tickets/<int:ticket_id>/messages/', views.api_support_messages_get, name='api_support_messages_get'),
+    path('api/support/tickets/<int:ticket_id>/stream/', views.api_support_messages_stream, name='api_support_messages_stream'),
     path('api/support/tickets/<int:ticket_id>/send/', views.api_support_messages_send, name='api_support_messages_send'),
     path('api/support/tickets/<int:ticket_id>/close/', views.api_support_close, name='api_support_close'),
     path('api/support/tickets/<int:ticket_id>/rate/', views.api_support_rate, name='api_support_rate'),
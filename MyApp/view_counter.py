@@ -0,0 +1,181 @@
+"""
+Write-behind product view counter.
+
+product_detail used to UPDATE Product.views_count and read it back on every
+page view: two queries per hit, row-lock contention on popular products and
+one audit event per view. Hits are now counted outside the database and
+added to views_count in one bulk UPDATE per flush:
+
+* ``memory``: a per-process counter, flushed by the first hit after
+  VIEW_COUNT_FLUSH_INTERVAL seconds and when the process exits. Nothing is
+  shared, so every worker process flushes its own hits.
+* ``cache``: one counter per product in the shared cache (atomic incr), plus
+  a per-minute list of the products that were hit. ``manage.py
+  flush_view_counts`` (cron, or the django-q schedule described there) adds
+  them to the database. A product id lost from a list by two concurrent
+  appends only delays its count until the product is viewed again.
+
+VIEW_COUNT_STORE selects the store; by default ``cache`` unless the default
+cache is local-memory, as for presence.py. Displayed counts may be up to one
+flush interval behind.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import F
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+COUNT_KEY = 'views:count:{}'
+BUCKET_KEY = 'views:ids:{}'
+FLUSH_LOCK_KEY = 'views:flush-lock'
+BUCKET_SECONDS = 60
+LOOKBACK_BUCKETS = 24 * 60  # a flush sees the hits of the last 24 hours
+KEY_TIMEOUT = (LOOKBACK_BUCKETS + 60) * BUCKET_SECONDS
+
+_lock = threading.Lock()
+_pending = Counter()
+_last_flush = time.monotonic()
+_bucket_ids = (None, set())  # (bucket, ids this process already listed in it)
+
+
+def flush_interval():
+    return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 30)
+
+
+def uses_cache():
+    store = getattr(settings, 'VIEW_COUNT_STORE', '')
+    if store:
+        return store == 'cache'
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def record_view(product_id):
+    """Count one view of a product. No database write (except the periodic flush in memory mode)."""
+    if uses_cache():
+        _record_in_cache(product_id)
+        return
+    global _last_flush
+    now = time.monotonic()
+    with _lock:
+        _pending[product_id] += 1
+        due = now - _last_flush >= flush_interval()
+        if due:
+            _last_flush = now
+    if due:
+        try:
+            flush()
+        except Exception as e:
+            # Never fail the page view; the hits stay pending for the next flush.
+            logger.warning(f"View counter: flush failed ({e})")
+
+
+def pending_views(product_id):
+    """Views of a product that are not in Product.views_count yet."""
+    if uses_cache():
+        return cache.get(COUNT_KEY.format(product_id), 0)
+    with _lock:
+        return _pending.get(product_id, 0)
+
+
+def flush():
+    """Add the counted views to Product.views_count; returns the number of products updated."""
+    if uses_cache():
+        return _flush_cache()
+    with _lock:
+        deltas = dict(_pending)
+        _pending.clear()
+    try:
+        _apply(deltas)
+    except Exception:
+        # Keep the hits for the next flush rather than losing them.
+        with _lock:
+            _pending.update(deltas)
+        raise
+    return len(deltas)
+
+
+def _apply(deltas):
+    """One UPDATE ... CASE for every product, whatever the number of products."""
+    deltas = {pk: n for pk, n in deltas.items() if n}
+    if not deltas:
+        return
+    products = []
+    for pk in sorted(deltas):
+        product = Product(pk=pk)
+        product.views_count = F('views_count') + deltas[pk]
+        products.append(product)
+    # bulk_update sends no signals: view counts are not audited.
+    Product.objects.bulk_update(products, ['views_count'], batch_size=500)
+
+
+def _record_in_cache(product_id):
+    global _bucket_ids
+    key = COUNT_KEY.format(product_id)
+    if not cache.add(key, 1, KEY_TIMEOUT):
+        try:
+            cache.incr(key)
+        except ValueError:  # expired between add() and incr()
+            cache.add(key, 1, KEY_TIMEOUT)
+
+    bucket = int(time.time()) // BUCKET_SECONDS
+    with _lock:
+        if _bucket_ids[0] != bucket:
+            _bucket_ids = (bucket, set())
+        listed = _bucket_ids[1]
+        if product_id in listed:
+            return
+        listed.add(product_id)
+    bucket_key = BUCKET_KEY.format(bucket)
+    ids = cache.get(bucket_key) or []
+    ids.append(product_id)
+    cache.set(bucket_key, ids, KEY_TIMEOUT)
+
+
+def _flush_cache():
+    # Two concurrent flushes would both add the same counts.
+    if not cache.add(FLUSH_LOCK_KEY, 1, 300):
+        return 0
+    try:
+        return _flush_cached_counts()
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+
+def _flush_cached_counts():
+    bucket = int(time.time()) // BUCKET_SECONDS
+    bucket_keys = [BUCKET_KEY.format(b) for b in range(bucket - LOOKBACK_BUCKETS, bucket + 1)]
+    ids = set()
+    for listed in cache.get_many(bucket_keys).values():
+        ids.update(listed)
+    if not ids:
+        return 0
+    counts = cache.get_many([COUNT_KEY.format(pk) for pk in ids])
+    deltas = {pk: counts.get(COUNT_KEY.format(pk), 0) for pk in ids}
+    deltas = {pk: n for pk, n in deltas.items() if n}
+    _apply(deltas)
+    for pk, n in deltas.items():
+        # Subtract what was written, keeping hits counted since get_many().
+        try:
+            cache.decr(COUNT_KEY.format(pk), n)
+        except ValueError:
+            pass
+    return len(deltas)
+
+
+@atexit.register
+def _flush_at_exit():
+    if _pending and not uses_cache():
+        try:
+            flush()
+        except Exception as e:
+            logger.warning(f"View counter: could not flush {sum(_pending.values())} views at exit ({e})")
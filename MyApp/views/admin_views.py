@@ -9,9 +9,10 @@ from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.utils import timezone
 from django.template.loader import render_to_string
-from django.db.models import Count, Sum, Avg, F, Q, DecimalField, IntegerField
+from django.db.models import Count, Sum, Avg, F, Q, Value, DecimalField, IntegerField
 from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator
+from MyApp.pagination import KeysetPaginator
 from decimal import Decimal
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 
@@ -36,57 +37,69 @@ def admin_dashboard(request):
 
 @accountant_required
 def admin_statistics(request):
+    from django.db.models import OuterRef, Subquery
+    from MyApp.sales_rollups import window_start
+
     days = int(request.GET.get('days', 30))
     sort_by = request.GET.get('sort', 'revenue')
     category_id = request.GET.get('category')
     stock_filter = request.GET.get('stock') # low, out, slow
     
-    # Time threshold
-    threshold_date = timezone.now() - timezone.timedelta(days=days)
-    valid_status = ['confirmed', 'shipping', 'delivered', 'completed']
-    
-    # Filters for conditional aggregation
-    product_stats_filter = Q(order_items__order__status__in=valid_status, order_items__order__created_at__gte=threshold_date)
-    category_stats_filter = Q(products__order_items__order__status__in=valid_status, products__order_items__order__created_at__gte=threshold_date)
-    
+    # Sales come from the daily rollups (MyApp/sales_rollups.py), so the cost
+    # of this page depends on the number of products/days, not on order history.
+    start_date = window_start(days)
+    window_sales = DailyProductSales.objects.filter(date__gte=start_date)
+
+    def product_sales_sum(field, output_field, **lookups):
+        return Coalesce(Subquery(
+            window_sales.filter(**lookups).values(*lookups.keys()).annotate(s=Sum(field)).values('s'),
+            output_field=output_field,
+        ), Value(0), output_field=output_field)
+
     # Overall KPIs
-    total_stats = Order.objects.filter(status__in=valid_status, created_at__gte=threshold_date).aggregate(
-        revenue=Coalesce(Sum('total_amount'), Decimal('0.00')),
-        order_count=Count('id')
+    total_stats = DailySalesSummary.objects.filter(date__gte=start_date).aggregate(
+        revenue=Coalesce(Sum('revenue'), Decimal('0.00')),
+        order_count=Coalesce(Sum('order_count'), 0)
     )
     
-    total_views = Product.objects.aggregate(total=Sum('views_count'))['total'] or 0
-    total_p_count = Product.objects.count()
-    low_stock_p = Product.objects.filter(physical_stock__lte=5).count()
+    product_totals = Product.objects.aggregate(
+        total_views=Sum('views_count'),
+        total=Count('id'),
+        low_stock=Count('id', filter=Q(physical_stock__lte=5)),
+    )
+    total_views = product_totals['total_views'] or 0
+    total_p_count = product_totals['total']
+    low_stock_p = product_totals['low_stock']
     
     total_revenue = total_stats['revenue']
     total_orders = total_stats['order_count']
     aov = total_revenue / total_orders if total_orders > 0 else 0
     conversion_rate = (total_orders / total_views * 100) if total_views > 0 else 0
 
-    # Base Queryset
-    product_qs = Product.objects.all()
+    # Product performance stats with advanced BI fields
+    wishlist_count = Wishlist.objects.filter(product=OuterRef('pk')).values('product').annotate(c=Count('id')).values('c')
+    products = Product.objects.select_related('category').annotate(
+        total_views_num=F('views_count'),
+        total_wishlists=Coalesce(Subquery(wishlist_count, output_field=IntegerField()), 0),
+        total_sold=product_sales_sum('quantity', IntegerField(), product=OuterRef('pk')),
+        total_revenue=product_sales_sum('revenue', DecimalField(), product=OuterRef('pk')),
+    )
     if category_id:
-        product_qs = product_qs.filter(category_id=category_id)
+        products = products.filter(category_id=category_id)
     if stock_filter == 'low':
-        product_qs = product_qs.filter(physical_stock__lte=5, physical_stock__gt=0)
+        products = products.filter(physical_stock__lte=5, physical_stock__gt=0)
     elif stock_filter == 'out':
-        product_qs = product_qs.filter(physical_stock=0)
+        products = products.filter(physical_stock=0)
     elif stock_filter == 'slow':
         # Slow movers: Stock > 10 and no sales in threshold
-        product_qs = product_qs.filter(physical_stock__gt=10).annotate(
-            recent_sales=Coalesce(Sum('order_items__quantity', filter=product_stats_filter), 0)
-        ).filter(recent_sales=0)
+        products = products.filter(physical_stock__gt=10, total_sold=0)
 
-    # Product performance stats with advanced BI fields
-    products = product_qs.annotate(
-        total_views_num=F('views_count'),
-        total_wishlists=Count('wishlisted_by', distinct=True),
-        total_sold=Coalesce(Sum('order_items__quantity', filter=product_stats_filter, output_field=IntegerField()), 0),
-        total_revenue=Coalesce(Sum(F('order_items__quantity') * F('order_items__price'), filter=product_stats_filter, output_field=DecimalField()), Decimal('0.00')),
-    ).order_by(f'-total_{sort_by}' if sort_by != 'created_at' else '-created_at')
+    sort_fields = {'revenue': '-total_revenue', 'sold': '-total_sold', 'views': '-total_views_num', 'created_at': '-created_at'}
+    products = list(products.order_by(sort_fields.get(sort_by, '-total_revenue')))
 
-    # Post-process for BI insights (Sales velocity, Recommendation scores)
+    # Post-process for BI insights (Sales velocity, Recommendation scores) and
+    # collect the alerts in the same pass
+    alerts = {'critical_stock': [], 'low_stock': [], 'slow_movers': [], 'opportunities': []}
     for p in products:
         p.sales_velocity = Decimal(p.total_sold) / Decimal(days)
         # Restock Score: critical if selling fast but low stock
@@ -100,18 +113,22 @@ def admin_statistics(request):
         p.is_best_seller = p.total_sold > 10
         p.is_slow_mover = p.physical_stock > 20 and p.total_sold == 0
 
+        if p.physical_stock == 0:
+            alerts['critical_stock'].append(p)
+        elif p.physical_stock <= 5:
+            alerts['low_stock'].append(p)
+        if p.is_slow_mover:
+            alerts['slow_movers'].append(p)
+        if p.is_opportunity:
+            alerts['opportunities'].append(p)
+
     # Critical Alerts
-    alerts = {
-        'critical_stock': products.filter(physical_stock=0)[:5],
-        'low_stock': products.filter(physical_stock__lte=5, physical_stock__gt=0)[:5],
-        'slow_movers': [p for p in products if p.is_slow_mover][:5],
-        'opportunities': [p for p in products if p.is_opportunity][:5]
-    }
+    alerts = {key: items[:5] for key, items in alerts.items()}
 
     # Category performance stats
     categories = Category.objects.annotate(
-        total_sold=Coalesce(Sum('products__order_items__quantity', filter=category_stats_filter), 0),
-        total_revenue=Coalesce(Sum(F('products__order_items__quantity') * F('products__order_items__price'), filter=category_stats_filter, output_field=DecimalField()), Decimal('0.00')),
+        total_sold=product_sales_sum('quantity', IntegerField(), product__category=OuterRef('pk')),
+        total_revenue=product_sales_sum('revenue', DecimalField(), product__category=OuterRef('pk')),
         product_count=Count('products', distinct=True)
     ).order_by('-total_revenue')
 
@@ -197,7 +214,7 @@ def admin_inventory(request):
 
 @accountant_required
 def admin_order_list(request):
-    orders = Order.objects.select_related('user', 'user__profile').order_by('-created_at')
+    orders = Order.objects.select_related('user', 'user__profile', 'invoice').order_by('-created_at')
     q = request.GET.get('q', '').strip()
     status = request.GET.get('status', '').strip()
 
@@ -210,8 +227,8 @@ def admin_order_list(request):
     if status and status != 'all':
         orders = orders.filter(status=status)
 
-    paginator = Paginator(orders, 10)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    paginator = KeysetPaginator(orders, 10, key='created_at')
+    page_obj = paginator.get_page(request.GET)
 
     return render(request, 'admin/order_list.html', {
         'orders': page_obj,
@@ -219,7 +236,7 @@ def admin_order_list(request):
         'current_query': q,
         'current_status': status or 'all',
         'status_choices': Order.STATUS_CHOICES,
-        'total_count': orders.count(),
+        'total_count': paginator.count,
     })
 
 
@@ -252,8 +269,8 @@ def admin_invoice_list(request):
     if status:
         invoices = invoices.filter(status=status)
 
-    paginator = Paginator(invoices, 10)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    paginator = KeysetPaginator(invoices, 10, key='generated_at')
+    page_obj = paginator.get_page(request.GET)
 
     return render(request, 'admin/invoice_list.html', {
         'invoices': page_obj,
@@ -261,7 +278,7 @@ def admin_invoice_list(request):
         'current_query': q,
         'current_status': status,
         'status_choices': Invoice._meta.get_field('status').choices,
-        'total_count': invoices.count(),
+        'total_count': paginator.count,
     })
 
 @warehouse_required
@@ -276,8 +293,8 @@ def admin_inventory_ledger(request):
     if t_type:
         transactions = transactions.filter(transaction_type=t_type)
         
-    paginator = Paginator(transactions, 10)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    paginator = KeysetPaginator(transactions, 10, key='timestamp')
+    page_obj = paginator.get_page(request.GET)
     
     return render(request, 'admin/inventory_ledger.html', {
         'transactions': page_obj,
@@ -1080,8 +1097,8 @@ def admin_audit_log_list(request):
     event_types = AuditLog.objects.values_list('event_type', flat=True).distinct()
     roles = AuditLog.objects.exclude(actor_role__isnull=True).exclude(actor_role='').values_list('actor_role', flat=True).distinct()
     
-    paginator = Paginator(logs, 20)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    paginator = KeysetPaginator(logs, 20, key='timestamp')
+    page_obj = paginator.get_page(request.GET)
     
     # Get all actors from this page to fetch their info in one query
     actor_ids = [log.actor_id for log in page_obj if log.actor_id]
@@ -26,26 +26,27 @@ from .utils import *
 def get_or_create_cart(request):
     """Lấy hoặc tạo giỏ hàng cho user hoặc guest"""
     if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart, created = Cart.objects.select_related('coupon').get_or_create(user=request.user)
     else:
         if not request.session.session_key:
             request.session.create()
         # Đảm bảo session được đánh dấu là modified để lưu cookie cho guest (cần thiết cho messages)
         request.session.modified = True
         session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
+        cart, created = Cart.objects.select_related('coupon').get_or_create(session_key=session_key)
     return cart
 
 
 def cart_view(request):
     """Xem giỏ hàng"""
     cart = get_or_create_cart(request)
-    # Thêm prefetch_related('product__images') để tránh N+1 khi gọi product.images.first() trong template
-    cart_items = cart.items.select_related('product', 'variation').prefetch_related('product__images').all()
+    # Một truy vấn cho các item (kèm product/variation), giá tính một lần (MyApp/pricing.py)
+    pricing = cart.pricing
     
     context = {
         'cart': cart,
-        'cart_items': cart_items,
+        'cart_items': pricing.items,
+        'pricing': pricing,
     }
     return render(request, 'shop/cart.html', context)
 
@@ -92,7 +93,7 @@ def cart_add(request, product_id):
 
         # Tăng số lượng tạm giữ
         target.reserved_stock = F('reserved_stock') + qty
-        target.save()
+        target.save(update_fields=['reserved_stock'])
 
         # Ghi log giao dịch kho
         InventoryTransaction.objects.create(
@@ -131,7 +132,7 @@ def cart_remove(request, item_id):
         release_qty = min(qty, target.reserved_stock)
         if release_qty > 0:
             target.reserved_stock = F('reserved_stock') - release_qty
-            target.save()
+            target.save(update_fields=['reserved_stock'])
 
             # Ghi log giải phóng kho thực tế
             InventoryTransaction.objects.create(
@@ -197,7 +198,7 @@ def cart_update(request, item_id):
                 trans_type = 'RELEASE'
                 note = f"Giảm số lượng trong giỏ (Cart ID: {cart.id})"
 
-            target.save()
+            target.save(update_fields=['reserved_stock'])
             cart_item.quantity = new_quantity
             cart_item.save()
 
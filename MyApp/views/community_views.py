@@ -21,6 +21,8 @@ from MyApp.forms import *
 import requests
 import json
 from .utils import *
+from MyApp.notifications import timesince_short, publish_read_state
+from MyApp import inbox, staff_fanout
 
 # ==================== REVIEW & COMMENT VIEWS ====================
 
@@ -40,16 +42,17 @@ def review_create(request, slug):
         
         if created:
             messages.success(request, 'Đã gửi đánh giá!')
-            for admin_user in User.objects.filter(is_staff=True):
-                create_notification(
-                    admin_user, 'review',
-                    f'Đánh giá mới cho {product.title}',
-                    f'{request.user.username} rated {rating}★',
-                    link=f'/product/{slug}/'
-                )
+            staff_fanout.fan_out(
+                ['staff'], 'review',
+                f'Đánh giá mới cho {product.title}',
+                f'{request.user.username} rated {rating}★',
+                link=f'/product/{slug}/',
+            )
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            review_count = product.reviews.count()
-            avg_rating = product.reviews.aggregate(avg=Avg('rating'))['avg'] or 0
+            # Recomputed by product_stats when the review was saved
+            product.refresh_from_db(fields=['avg_rating', 'review_count'])
+            review_count = product.review_count
+            avg_rating = float(product.avg_rating)
             html = render_to_string('shop/partials/review_item.html', {
                 'reviews': [review],
                 'request': request,
@@ -267,21 +270,9 @@ def comment_delete_api(request, comment_id):
 
 @login_required(login_url='login')
 def message_inbox(request):
-    conversations = request.user.conversations.all()
-    conv_data = []
-    total_unread = 0
-    for conv in conversations:
-        other = conv.get_other_user(request.user)
-        last_msg = conv.last_message()
-        unread = conv.unread_count(request.user)
-        total_unread += unread
-        conv_data.append({
-            'conv': conv,
-            'other': other,
-            'last_msg': last_msg,
-            'unread': unread,
-        })
-    return render(request, 'messages/inbox.html', {'conv_data': conv_data, 'total_unread': total_unread})
+    conversations = list(inbox.inbox(request.user))
+    total_unread = sum(conv.unread for conv in conversations)
+    return render(request, 'messages/inbox.html', {'conversations': conversations, 'total_unread': total_unread})
 
 
 @login_required(login_url='login')
@@ -292,17 +283,16 @@ def message_detail(request, conversation_id):
         content = request.POST.get('content', '').strip()
         if content:
             Message.objects.create(conversation=conversation, sender=request.user, content=content)
-            conversation.updated_at = timezone.now()
-            conversation.save(update_fields=['updated_at'])
             if other_user:
                 create_notification(other_user, 'message', f'Tin nhắn mới từ {request.user.username}', content[:50], link=f'/messages/{conversation.id}/')
             return redirect('message_detail', conversation_id=conversation.id)
     
-    conversation.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
+    inbox.mark_read(conversation, request.user)
     return render(request, 'messages/detail.html', {
         'conversation': conversation,
         'other_user': other_user,
         'messages_list': conversation.messages.all(),
+        'other_read_id': inbox.read_position(conversation, other_user) if other_user else 0,
     })
 
 
@@ -390,7 +380,7 @@ def notification_list_ajax(request):
             'link': n.link,
             'is_read': n.is_read,
             'created_at': n.created_at.strftime('%d/%m/%Y %H:%M'),
-            'time_ago': _timesince_short(n.created_at),
+            'time_ago': timesince_short(n.created_at),
         })
     return JsonResponse({
         'items': items,
@@ -411,6 +401,7 @@ def notification_mark_read(request):
         else:
             request.user.notifications.filter(is_read=False).update(is_read=True, read_at=now)
         new_count = request.user.notifications.filter(is_read=False).count()
+        publish_read_state(request.user.id, new_count)
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'success': True, 'unread_count': new_count})
         return redirect('notification_list')
@@ -421,10 +412,7 @@ def notification_count_api(request):
     """Badge count endpoint — supports SSE via Accept header."""
     if request.user.is_authenticated:
         notif_count = request.user.notifications.filter(is_read=False).count()
-        msg_count = Message.objects.filter(
-            conversation__participants=request.user,
-            is_read=False
-        ).exclude(sender=request.user).count()
+        msg_count = inbox.unread_total(request.user)
         return JsonResponse({'notification_count': notif_count, 'message_count': msg_count})
     return JsonResponse({'notification_count': 0, 'message_count': 0})
 
@@ -445,70 +433,85 @@ def notification_dropdown_api(request):
             'message': n.message[:80],
             'link': n.link,
             'is_read': n.is_read,
-            'time_ago': _timesince_short(n.created_at),
+            'time_ago': timesince_short(n.created_at),
         })
     return JsonResponse({'items': items, 'unread_count': unread_count})
 
 
 @login_required(login_url='login')
-def notification_sse(request):
-    """Server-Sent Events endpoint for real-time notification push."""
-    import time
+async def notification_sse(request):
+    """
+    Server-Sent Events endpoint for real-time notification push.
+
+    The connection subscribes to the user's channel on the notification bus and
+    sleeps until an event arrives; the database is only queried once, for the
+    initial badge state. Members of staff groups also get the ``staff``
+    channel, where staff_fanout publishes one event per fan-out: the stream
+    keeps the badge count it last sent and adds the new notification to it. Served from an event loop under ASGI (uvicorn), so
+    idle connections do not hold a worker thread. Under WSGI (runserver,
+    gunicorn) the same stream runs in a blocking thread.
+    """
+    from django.core.handlers.asgi import ASGIRequest
     from django.http import StreamingHttpResponse
-
-    def event_stream():
-        last_count = -1
-        while True:
+    from django.conf import settings
+    from asgiref.sync import sync_to_async
+    from MyApp.notification_bus import get_bus, staff_channel, user_channel
+    from MyApp.notifications import aunread_state
+
+    user = await request.auser()
+    keepalive = getattr(settings, 'NOTIFICATION_SSE_KEEPALIVE', 25)
+    channels = [user_channel(user.id)]
+    if await sync_to_async(staff_fanout.is_member)(user.id):
+        channels.append(staff_channel())
+    bus = get_bus()
+    unread_count = 0
+
+    def sse(data):
+        nonlocal unread_count
+        if 'recipients' in data:
+            data = staff_fanout.recipient_state(data, user.id, unread_count)
+            if data is None:
+                return None
+        unread_count = data['unread_count']
+        return f"data: {json.dumps(data)}\n\n"
+
+    # Subscribe before reading the initial state so nothing is missed in between.
+    if isinstance(request, ASGIRequest):
+        subscription = bus.subscribe_async(*channels)
+
+        async def event_stream():
             try:
-                count = Notification.objects.filter(user=request.user, is_read=False).count()
-                if count != last_count:
-                    last_count = count
-                    latest = Notification.objects.filter(user=request.user, is_read=False).first()
-                    data = {
-                        'unread_count': count,
-                        'latest': None,
-                    }
-                    if latest:
-                        data['latest'] = {
-                            'id': latest.id,
-                            'type': latest.notification_type,
-                            'icon': latest.icon,
-                            'style': latest.category_style,
-                            'title': latest.title,
-                            'message': latest.message[:80],
-                            'link': latest.link,
-                            'time_ago': _timesince_short(latest.created_at),
-                        }
-                    import json
-                    yield f"data: {json.dumps(data)}\n\n"
-                time.sleep(5)
-            except GeneratorExit:
-                break
-            except Exception:
-                break
+                yield "retry: 5000\n\n"
+                yield sse(initial)
+                while True:
+                    data = await subscription.get(timeout=keepalive)
+                    event = sse(data) if data is not None else ": keepalive\n\n"
+                    if event is not None:
+                        yield event
+            finally:
+                subscription.close()
+    else:
+        subscription = bus.subscribe(*channels)
+
+        def event_stream():
+            try:
+                yield "retry: 5000\n\n"
+                yield sse(initial)
+                while True:
+                    data = subscription.get(timeout=keepalive)
+                    event = sse(data) if data is not None else ": keepalive\n\n"
+                    if event is not None:
+                        yield event
+            finally:
+                subscription.close()
+
+    try:
+        initial = await aunread_state(user.id)
+    except Exception:
+        subscription.close()
+        raise
 
     response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
     response['Cache-Control'] = 'no-cache'
     response['X-Accel-Buffering'] = 'no'
     return response
-
-
-def _timesince_short(dt):
-    """Return compact Vietnamese time-since string."""
-    diff = timezone.now() - dt
-    seconds = int(diff.total_seconds())
-    if seconds < 60:
-        return 'Vừa xong'
-    minutes = seconds // 60
-    if minutes < 60:
-        return f'{minutes} phút trước'
-    hours = minutes // 60
-    if hours < 24:
-        return f'{hours} giờ trước'
-    days = hours // 24
-    if days < 30:
-        return f'{days} ngày trước'
-    months = days // 30
-    return f'{months} tháng trước'
-
-
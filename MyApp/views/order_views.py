@@ -1,23 +1,27 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.core.mail import send_mail
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Count
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 
-from MyApp.models import Order, OrderItem, Payment, Notification, Product, ProductVariation
+from MyApp.models import Order, OrderItem, Payment, Notification
 from .cart_views import get_or_create_cart
 from .utils import create_notification, is_accountant
+from MyApp.tasks import run_task_on_commit
 
 
 # ==================== INVOICE & PAYMENT VIEWS ====================
 
 @login_required(login_url='login')
 def order_list(request):
-    orders = request.user.orders.all().order_by('-created_at')
+    orders = (
+        request.user.orders.select_related('payment')
+        .annotate(item_count=Count('items'))
+        .order_by('-created_at')
+    )
     return render(request, 'orders/order_list.html', {'orders': orders})
 
 
@@ -37,33 +41,29 @@ def order_detail(request, order_number):
 
 @login_required(login_url='login')
 def invoice_pdf(request, order_number):
-    from django.http import HttpResponse
-    from MyApp.invoices import InvoicePDFGenerator
-    order = get_object_or_404(Order, order_number=order_number)
+    from MyApp import render_cache
+    order = get_object_or_404(render_cache.orders_for_rendering(), order_number=order_number)
     if not (order.user == request.user or is_accountant(request.user) or request.user.is_staff):
         messages.error(request, 'Bạn không có quyền truy cập hóa đơn này.')
         return redirect('order_list')
-    generator = InvoicePDFGenerator(order)
-    pdf_buffer = generator.generate()
-    response = HttpResponse(pdf_buffer, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="hoa-don-{order.order_number}.pdf"'
-    return response
+    return render_cache.serve(
+        request, order, render_cache.invoice_pdf(order),
+        'application/pdf', f'hoa-don-{order.order_number}.pdf',
+    )
 
 
 @login_required(login_url='login')
 def invoice_pdf_with_qr(request, order_number):
-    from django.http import HttpResponse
-    from MyApp.invoices import InvoiceWithQRGenerator
-    order = get_object_or_404(Order, order_number=order_number)
+    from MyApp import render_cache
+    order = get_object_or_404(render_cache.orders_for_rendering(), order_number=order_number)
     if not (order.user == request.user or is_accountant(request.user) or request.user.is_staff):
         messages.error(request, 'Bạn không có quyền truy cập hóa đơn này.')
         return redirect('order_list')
     payment_method = request.GET.get('method', 'bank')
-    generator = InvoiceWithQRGenerator(order, payment_method=payment_method)
-    pdf_buffer = generator.generate()
-    response = HttpResponse(pdf_buffer, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="hoa-don-{order.order_number}.pdf"'
-    return response
+    return render_cache.serve(
+        request, order, render_cache.invoice_pdf_with_qr(order, payment_method),
+        'application/pdf', f'hoa-don-{order.order_number}.pdf',
+    )
 
 
 @login_required(login_url='login')
@@ -195,22 +195,14 @@ def payment_view(request, order_number):
 
 @login_required(login_url='login')
 def payment_qr_image(request, order_number):
-    from django.http import HttpResponse
-    from MyApp.invoices import QRCodePaymentGenerator
-    from io import BytesIO
+    from MyApp import render_cache
 
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
-
-    qr_gen = QRCodePaymentGenerator(order, payment_method='bank')
-    qr_img = qr_gen.generate(size=8)
-
-    img_buffer = BytesIO()
-    qr_img.save(img_buffer, format='PNG')
-    img_buffer.seek(0)
+    order = get_object_or_404(render_cache.orders_for_rendering(), order_number=order_number, user=request.user)
 
-    response = HttpResponse(img_buffer, content_type='image/png')
-    response['Content-Disposition'] = f'inline; filename="qr_{order.order_number}.png"'
-    return response
+    return render_cache.serve(
+        request, order, render_cache.payment_qr_png(order),
+        'image/png', f'qr_{order.order_number}.png', disposition='inline',
+    )
 
 
 @login_required(login_url='login')
@@ -246,9 +238,10 @@ def payment_confirm(request, order_number):
 def checkout(request):
     """Trang checkout - tạo đơn hàng từ giỏ hàng"""
     cart = get_or_create_cart(request)
-    cart_items = cart.items.select_related('product', 'variation').all()
+    pricing = cart.pricing
+    cart_items = pricing.items
 
-    if not cart_items.exists():
+    if not cart_items:
         messages.warning(request, 'Giỏ hàng của bạn đang trống!')
         return redirect('cart')
 
@@ -271,28 +264,8 @@ def checkout(request):
             payment_method = 'qr_bank'
 
         with transaction.atomic():
-            total_amount = cart.get_total_price()
-            discount_amount = cart.get_discount_amount()
-
-            # Lấy danh sách sản phẩm và khóa bản ghi để tránh race condition
-            # Sắp xếp theo ID để tránh deadlock
-            products_to_lock = []
-            for item in cart_items:
-                if item.variation:
-                    products_to_lock.append(('variation', item.variation.id, item.quantity))
-                else:
-                    products_to_lock.append(('product', item.product.id, item.quantity))
-            
-            # Khóa và kiểm tra tồn kho
-            for type, pk, qty in products_to_lock:
-                if type == 'variation':
-                    target = ProductVariation.objects.select_for_update().get(pk=pk)
-                else:
-                    target = Product.objects.select_for_update().get(pk=pk)
-                
-                if target.available_stock < qty:
-                    messages.error(request, f"Sản phẩm {target} không đủ tồn kho khả dụng (Chỉ còn {target.available_stock}).")
-                    return redirect('cart')
+            total_amount = pricing.total
+            discount_amount = pricing.discount
 
             order = Order.objects.create(
                 user=request.user,
@@ -303,36 +276,27 @@ def checkout(request):
                 discount_amount=discount_amount
             )
 
-            for item in cart_items:
-                item_price = item.variation.price if (item.variation and item.variation.price) else item.product.price
-                OrderItem.objects.create(
+            OrderItem.objects.bulk_create([
+                OrderItem(
                     order=order,
-                    product=item.product,
-                    variation=item.variation,
-                    product_title=item.product.title,
-                    quantity=item.quantity,
-                    price=item_price or 0
+                    product=line.item.product,
+                    variation=line.item.variation,
+                    product_title=line.item.product.title,
+                    quantity=line.item.quantity,
+                    price=line.unit_price
                 )
+                for line in pricing.lines
+            ])
 
-            # Thực hiện giữ chỗ kho hàng (từ giỏ hàng sang đơn hàng)
+            # Thực hiện giữ chỗ kho hàng (từ giỏ hàng sang đơn hàng): khóa toàn bộ
+            # sản phẩm trong một truy vấn và kiểm tra phần giữ chỗ của giỏ vẫn còn
             success, msg = order.action_confirm(user=request.user, from_cart=True)
             if not success:
-                # Nếu vì lý do gì đó fail (dù đã check ở trên), rollback transaction
-                messages.error(request, f"Lỗi giữ kho: {msg}")
+                # Không đủ hàng: rollback cả đơn hàng vừa tạo
+                messages.error(request, msg)
                 transaction.set_rollback(True)
                 return redirect('cart')
 
-        # Notify staff about new order
-        staff_users = User.objects.filter(is_staff=True)
-        for staff_user in staff_users:
-            create_notification(
-                user=staff_user,
-                notification_type='order',
-                title=f'Đơn hàng mới {order.order_number}',
-                message_text=f'{request.user.username} đã đặt {order.items.count()} sản phẩm.',
-                link=f'/manage/orders/{order.order_number}/manage/'
-            )
-
         # Create Payment record based on chosen method
         if payment_method == 'cod':
             Payment.objects.create(
@@ -348,35 +312,14 @@ def checkout(request):
                 payment_method='qr_bank'
             )
 
-        cart_items.delete()
+        cart.items.all().delete()
         cart.coupon = None
         cart.save()
         if request.user.is_authenticated:
             cache.delete(f'user_badges_{request.user.id}')
 
-        if request.user.email:
-            items_text = '\n'.join(
-                f'  - {item.product.title} x{item.quantity}'
-                for item in order.items.all()
-            )
-            if payment_method == 'cod':
-                payment_instruction = 'Bạn sẽ thanh toán khi nhận hàng. Vui lòng chuẩn bị số tiền chính xác.'
-            else:
-                payment_instruction = 'Vui lòng thanh toán qua chuyển khoản để chúng tôi xử lý đơn hàng.'
-
-            send_mail(
-                f'Xác nhận đơn hàng {order.order_number} - TeaZen',
-                f'Xin chào {request.user.get_full_name() or request.user.username},\n\n'
-                f'Đơn hàng của bạn đã được tạo thành công!\n\n'
-                f'Mã đơn: {order.order_number}\n'
-                f'Sản phẩm:\n{items_text}\n\n'
-                f'Tổng tiền: {total_amount:,.0f}đ\n\n'
-                f'{payment_instruction}\n\n'
-                f'Trân trọng,\nTeaZen',
-                None,
-                [request.user.email],
-                fail_silently=True,
-            )
+        # Staff notifications + confirmation email run in a django-q worker
+        run_task_on_commit('order_placed_task', order.id, payment_method)
 
         messages.success(request, 'Đơn hàng đã được tạo!')
 
@@ -389,7 +332,8 @@ def checkout(request):
     return render(request, 'shop/checkout.html', {
         'cart': cart,
         'cart_items': cart_items,
-        'total_price': cart.get_total_price(),
+        'pricing': pricing,
+        'total_price': pricing.total,
         'full_name': full_name,
         'phone': phone,
         'address': address,
@@ -408,7 +352,6 @@ def casso_webhook(request):
     from django.http import JsonResponse
     from django.conf import settings
     import logging
-    import re
 
     logger = logging.getLogger(__name__)
 
@@ -439,103 +382,8 @@ def casso_webhook(request):
         except Exception:
             data = {}
 
-    transactions = data.get('data', [])
-    matched_count = 0
-
-    for t in transactions:
-        description = str(t.get('description', '')).upper()
-        amount = t.get('amount', 0)
-        if not description:
-            continue
-
-        match = re.search(r'ORD-\d{8}-[A-Z0-9]{6}', description)
-        if not match:
-            continue
-
-        order_number = match.group(0)
-        order = Order.objects.filter(order_number=order_number).first()
-        if not order:
-            logger.warning(f"Casso: order not found for {order_number}")
-            continue
-
-        expected = int(order.total_amount)
-        received = int(amount)
-        if abs(received - expected) > 1000:
-            logger.warning(
-                f"Casso: amount mismatch for {order.order_number}: "
-                f"expected {expected}, received {received}"
-            )
-            continue
-
-        try:
-            payment = order.payment
-        except Exception:
-            logger.warning(f"Casso: no payment record for order {order.order_number}")
-            continue
-
-        if payment.payment_status == 'completed':
-            logger.info(f"Casso: order {order.order_number} already completed, skipping")
-            continue
-
-        if order.status in ['cancelled', 'refunded', 'exchanged', 'return_requested', 'return_approved', 'returned']:
-            logger.warning(f"Casso: order {order.order_number} is not eligible for payment confirm")
-            continue
-
-        if order.status == 'pending':
-            success, message = order.action_confirm()  # Reserve stock
-            if not success:
-                logger.error(f"Casso: stock reservation failed for order {order.order_number}: {message}")
-                from datetime import datetime
-                payment.payment_status = 'completed'
-                payment.payment_date = datetime.now()
-                payment.notes = f"Payment received but stock reservation failed: {message}"
-                payment.save()
-                order.set_status('pending', note="Đã nhận thanh toán nhưng thiếu tồn kho.")
-                create_notification(
-                    user=order.user,
-                    notification_type='order',
-                    title=f'Đã nhận thanh toán cho đơn {order.order_number}',
-                    message_text='Tuy nhiên kho đang thiếu hàng cho một số sản phẩm. Chúng tôi sẽ liên hệ để xử lý.',
-                    link=f'/order/{order.order_number}/',
-                )
-                continue
-        else:
-            order.ensure_invoice()
-
-        from datetime import datetime
-        payment.payment_status = 'completed'
-        payment.payment_date = datetime.now()
-        payment.save()
-
-        try:
-            invoice = order.invoice
-        except Exception:
-            invoice = None
-        if invoice and invoice.status != 'paid':
-            invoice.status = 'paid'
-            invoice.save(update_fields=['status'])
-
-        create_notification(
-            user=order.user,
-            notification_type='order',
-            title=f'Thanh toán đơn {order.order_number} thành công!',
-            message_text=f'Hệ thống đã xác nhận giao dịch {received:,}đ từ tài khoản của bạn.',
-            link=f'/order/{order.order_number}/',
-        )
-
-        if order.user.email:
-            send_mail(
-                f'Thanh toán đơn {order.order_number} thành công! - TeaZen',
-                f'Xin chào {order.user.get_full_name() or order.user.username},\n\n'
-                f'Chúng tôi đã xác nhận thanh toán {received:,}đ cho đơn hàng {order.order_number}.\n\n'
-                f'Đơn hàng của bạn đang được xử lý.\n\n'
-                f'Trân trọng,\nTeaZen',
-                None,
-                [order.user.email],
-                fail_silently=True,
-            )
-
-        logger.info(f"✅ Casso auto-confirmed payment for order {order.order_number}")
-        matched_count += 1
+    from MyApp import casso
+    transactions = data.get('data', []) if isinstance(data, dict) else []
+    result = casso.process(transactions if isinstance(transactions, list) else [])
 
-    return JsonResponse({'status': 'ok', 'matched': matched_count})
+    return JsonResponse({'status': 'ok', 'matched': result.matched, 'duplicates': result.duplicates})
@@ -16,6 +16,8 @@ from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 
 from MyApp.models import *
 from MyApp.forms import *
+from MyApp.search import search_filter, suggest_product_ids, order_by_ids
+from MyApp import view_counter, catalog_cache
 import requests
 import json
 from .utils import *
@@ -57,14 +59,23 @@ def seed_categories_view(request):
 # ==================== PUBLIC VIEWS ====================
 
 def index(request):
+    cached = catalog_cache.cached_page(request, 'index')
+    if cached is not None:
+        return cached
+
     active_filter = Q(category__isnull=True) | Q(category__is_active=True)
+    # Các queryset được để lazy: khi fragment trong index.html còn cache thì không chạy query nào
     # Thêm prefetch_related('images') để tránh N+1 query khi hiển thị ảnh phụ
     products = Product.objects.select_related('category').prefetch_related('images').filter(active_filter)[:8]
     top_viewed_products = Product.objects.select_related('category').prefetch_related('images').filter(active_filter).order_by('-views_count')[:4]
     newest_products = Product.objects.select_related('category').prefetch_related('images').filter(active_filter).order_by('-created_at')[:4]
     categories = Category.objects.all()
-    storyboard = list(StoryboardItem.objects.all()[:6])
-    storyboard_columns = [storyboard[i::3] for i in range(3)]
+    storyboard = StoryboardItem.objects.all()[:6]
+
+    def storyboard_columns():
+        items = list(storyboard)
+        return [items[i::3] for i in range(3)]
+
     raws = RawItem.objects.all()[:12]
     cabinet = CabinetItem.objects.all()[:6]
 
@@ -77,7 +88,11 @@ def index(request):
         'storyboard_columns': storyboard_columns,
         'raw_items': raws,
         'cabinet_items': cabinet,
+        **catalog_cache.fragment_context(request),
     }
+    if catalog_cache.page_cacheable(request):
+        context['csrf_token'] = catalog_cache.CSRF_PLACEHOLDER
+        return catalog_cache.store_page(request, 'index', render(request, 'index.html', context))
     return render(request, 'index.html', context)
 
 
@@ -95,11 +110,7 @@ def storyboard_detail(request, pk):
 def product_detail(request, slug):
     active_filter = Q(category__isnull=True) | Q(category__is_active=True)
     product = get_object_or_404(Product.objects.select_related('category').filter(active_filter), slug=slug)
-    variations = list(product.variations.all())
-    if variations:
-        available_stock = sum(v.available_stock for v in variations)
-    else:
-        available_stock = product.available_stock
+    available_stock = product.total_available_stock
     
     # Gallery images
     gallery_images = list(product.images.all())
@@ -111,7 +122,6 @@ def product_detail(request, slug):
     
     # Reviews
     reviews = product.reviews.select_related('user').prefetch_related('images').all()
-    avg_rating = reviews.aggregate(avg=Avg('rating'))['avg'] or 0
     
     # Rating distribution
     rating_counts = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
@@ -125,10 +135,9 @@ def product_detail(request, slug):
     # Comments (top-level only, replies via template)
     comments = product.comments.filter(parent=None).select_related('user').prefetch_related('replies__user')
     
-    # Increment view count
-    product.views_count = F('views_count') + 1
-    product.save(update_fields=['views_count'])
-    product.refresh_from_db(fields=['views_count'])
+    # Count the view (written to the database in batches, see view_counter.py)
+    view_counter.record_view(product.id)
+    product.views_count += view_counter.pending_views(product.id)
 
     context = {
         'product': product,
@@ -136,8 +145,8 @@ def product_detail(request, slug):
         'gallery_images': gallery_images,
         'related_products': related_products,
         'reviews': reviews,
-        'avg_rating': round(avg_rating, 1),
-        'review_count': reviews.count(),
+        'avg_rating': round(float(product.avg_rating), 1),
+        'review_count': product.review_count,
         'rating_counts': rating_counts,
         'user_review': user_review,
         'comments': comments,
@@ -202,13 +211,14 @@ def product_list_view(request):
     """Trang danh sách sản phẩm với tìm kiếm, lọc nâng cao và phân trang"""
     active_filter = Q(category__isnull=True) | Q(category__is_active=True)
     # Thêm prefetch_related('images')
-    products = Product.objects.select_related('category').prefetch_related('images', 'variations').filter(active_filter)
+    products = Product.objects.select_related('category').prefetch_related('images').filter(active_filter)
     categories = Category.objects.filter(is_active=True)
 
-    # Search
+    # Search (full-text index, best match first - see MyApp/search.py)
     query = request.GET.get('q', '').strip()
     if query:
-        products = products.filter(get_smart_search_filter(query, ['title', 'excerpt', 'description']))
+        search_matches, search_rank = search_filter(query)
+        products = products.filter(search_matches).annotate(search_rank=search_rank).order_by('search_rank', '-id')
 
     # Advanced Filters
     min_price = request.GET.get('min_price')
@@ -220,16 +230,16 @@ def product_list_view(request):
     if max_price:
         products = products.filter(price__lte=max_price)
     if rating:
-        products = products.annotate(avg_rating=Avg('reviews__rating')).filter(avg_rating__gte=rating)
+        products = products.filter(avg_rating__gte=rating)
 
     # Filter by category
     category_slug = request.GET.get('category', '')
     if category_slug:
         products = products.filter(category__slug=category_slug)
 
-    # Sort
-    sort = request.GET.get('sort', '-created_at')
-    valid_sorts = ['price', '-price', 'title', '-title', '-created_at', 'created_at']
+    # Sort (searches keep relevance order unless another sort is picked)
+    sort = request.GET.get('sort', 'relevance' if query else '-created_at')
+    valid_sorts = ['price', '-price', 'title', '-title', '-created_at', 'created_at', '-avg_rating', '-total_available_stock']
     if sort in valid_sorts:
         products = products.order_by(sort)
 
@@ -246,11 +256,7 @@ def product_list_view(request):
     end_idx = page * per_page
     product_list = list(products[:end_idx])
     for p in product_list:
-        variations = list(p.variations.all())
-        if variations:
-            p.display_stock = sum(v.available_stock for v in variations)
-        else:
-            p.display_stock = p.available_stock
+        p.display_stock = p.total_available_stock
     has_more = total_count > end_idx
     remaining = total_count - end_idx if has_more else 0
 
@@ -258,7 +264,7 @@ def product_list_view(request):
     category_counts = {}
     all_products_in_filter = Product.objects.select_related('category').filter(active_filter)
     if query:
-        all_products_in_filter = all_products_in_filter.filter(get_smart_search_filter(query, ['title', 'excerpt', 'description']))
+        all_products_in_filter = all_products_in_filter.filter(search_matches)
     for cat_count in all_products_in_filter.values('category__slug', 'category__name').annotate(count=Count('id')):
         if cat_count['category__slug']:
             category_counts[cat_count['category__slug']] = cat_count['count']
@@ -296,9 +302,9 @@ def search_suggestions(request):
         return JsonResponse({'results': []})
     
     active_filter = Q(category__isnull=True) | Q(category__is_active=True)
-    products = Product.objects.filter(active_filter).filter(
-        get_smart_search_filter(q, ['title', 'excerpt', 'category__name'])
-    ).select_related('category')[:6]
+    # A few spare candidates in case some belong to hidden categories
+    candidate_ids = suggest_product_ids(q)
+    products = order_by_ids(Product.objects.filter(active_filter), candidate_ids).select_related('category')[:6]
     
     results = []
     for p in products:
@@ -1,8 +1,11 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.utils.dateparse import parse_datetime
@@ -14,6 +17,10 @@ from MyApp.models import (
     SupportTicket, SupportMessage, SupportAttachment, SupportRating,
     SupportQuickReply, SupportBusinessHours, Notification, User,
 )
+from MyApp import presence, staff_fanout
+from MyApp.notification_bus import get_bus, ticket_channel
+from MyApp.support_serializers import serialize_messages
+from MyApp.support_stream import TicketFeed, agent_info
 from .utils import management_required, is_management_staff
 
 # ==================== SUPPORT CHAT WIDGET PAGE ====================
@@ -37,25 +44,6 @@ def _is_business_hours():
         return True
 
 
-def _count_online_agents():
-    from django.contrib.sessions.models import Session
-    from django.utils import timezone as tz
-    import json as _json
-
-    cutoff = tz.now() - timezone.timedelta(minutes=30)
-    active_sessions = Session.objects.filter(expire_date__gte=tz.now())
-    online_staff_ids = set()
-    for session in active_sessions:
-        data = session.get_decoded()
-        uid = data.get('_auth_user_id')
-        if uid:
-            online_staff_ids.add(int(uid))
-
-    if not online_staff_ids:
-        return 0
-    return User.objects.filter(id__in=online_staff_ids, is_staff=True).count()
-
-
 def _get_or_create_open_ticket(request):
     if request.user.is_authenticated:
         return SupportTicket.objects.filter(
@@ -78,35 +66,27 @@ def _verify_ticket_ownership(request, ticket):
 
 def _notify_staff_new_ticket(ticket, first_message_content):
     category_display = dict(SupportTicket.CATEGORY_CHOICES).get(ticket.category, ticket.category)
-    for staff in User.objects.filter(is_staff=True):
-        Notification.objects.create(
-            user=staff,
-            notification_type='system',
-            title=f'🎧 Yêu cầu hỗ trợ mới #{ticket.id} · {category_display}',
-            message=f'{ticket.display_name}: {first_message_content[:80]}',
-            link=f'/manage/support/{ticket.id}/'
-        )
+    staff_fanout.fan_out(
+        ['staff'], 'system',
+        f'🎧 Yêu cầu hỗ trợ mới #{ticket.id} · {category_display}',
+        f'{ticket.display_name}: {first_message_content[:80]}',
+        link=f'/manage/support/{ticket.id}/',
+    )
 
 
 def _notify_staff_return_request(return_req):
     """
-    Notify all staff members when a new return/exchange request is submitted.
+    Notify staff and the warehouse team when a new return/exchange request is submitted.
     """
-    from django.urls import reverse
     order = return_req.order
     request_type_display = "Đổi trả" if return_req.request_type == 'refund' else "Đổi hàng"
-    
-    # Notify all staff (is_staff=True)
-    staff_users = User.objects.filter(is_staff=True)
-    for staff in staff_users:
-        Notification.objects.create(
-            user=staff,
-            actor=order.user,
-            notification_type='order',
-            title=f'📦 Yêu cầu {request_type_display} mới: {order.order_number}',
-            message=f'Khách hàng {order.user.username} đã gửi yêu cầu cho đơn hàng {order.order_number}.',
-            link=f'/manage/returns/' # Direct to the returns management page
-        )
+    staff_fanout.fan_out(
+        ['staff', 'warehouse'], 'order',
+        f'📦 Yêu cầu {request_type_display} mới: {order.order_number}',
+        f'Khách hàng {order.user.username} đã gửi yêu cầu cho đơn hàng {order.order_number}.',
+        link='/manage/returns/',  # Direct to the returns management page
+        actor=order.user,
+    )
 
 
 def _get_avg_wait_minutes():
@@ -140,7 +120,7 @@ def api_support_status(request):
         request.session.create()
 
     open_ticket = _get_or_create_open_ticket(request)
-    agents_online = _count_online_agents()
+    agents_online = presence.online_count()
     is_bh = _is_business_hours()
 
     return JsonResponse({
@@ -251,19 +231,19 @@ def api_support_create_ticket(request):
     return JsonResponse({
         'ticket_id': ticket.id,
         'status': ticket.status,
-        'messages': [customer_msg.to_dict(), bot_msg.to_dict()],
+        'messages': serialize_messages([customer_msg, bot_msg]),
     }, status=201)
 
 
 @csrf_exempt
 def api_support_messages_get(request, ticket_id):
     """
-    GET /api/support/tickets/{id}/messages/?after=ISO_TIMESTAMP
-    Lấy tin nhắn (full history hoặc sau timestamp nhất định).
+    GET /api/support/tickets/{id}/messages/?after=ISO_TIMESTAMP | ?after_id=MESSAGE_ID
+    Lấy tin nhắn (full history hoặc sau timestamp / id tin nhắn nhất định).
     Không trả về internal notes.
     """
     try:
-        ticket = SupportTicket.objects.get(id=ticket_id)
+        ticket = SupportTicket.objects.select_related('user', 'assigned_to__profile').get(id=ticket_id)
     except SupportTicket.DoesNotExist:
         return JsonResponse({'error': 'Ticket không tồn tại'}, status=404)
 
@@ -273,36 +253,121 @@ def api_support_messages_get(request, ticket_id):
     after_param = request.GET.get('after')
     qs = ticket.messages.filter(is_internal=False)
 
-    if after_param:
+    after_id = _message_cursor(request.GET.get('after_id'))
+    if after_id:
+        qs = qs.filter(id__gt=after_id)
+    elif after_param:
         dt = parse_datetime(after_param)
         if dt:
             qs = qs.filter(created_at__gt=dt)
 
-    qs = qs.order_by('created_at').prefetch_related('attachments')
+    qs = qs.order_by('created_at')
 
     # Mark agent/bot messages as read
     qs.filter(sender_type__in=['agent', 'bot', 'system'], is_read=False).update(is_read=True)
 
-    # Agent info
-    agent_info = None
-    if ticket.assigned_to:
-        ag = ticket.assigned_to
-        agent_info = {
-            'name': ag.get_full_name() or ag.username,
-            'avatar': ag.profile.avatar.url if hasattr(ag, 'profile') and ag.profile.avatar else None,
-        }
-
     # Check if agent is "typing" — simple approach: check agent activity in last 5s
     agent_typing = False  # Will be updated by agent typing API
 
     return JsonResponse({
-        'messages': [m.to_dict() for m in qs],
+        'messages': serialize_messages(qs),
         'ticket_status': ticket.status,
-        'agent_info': agent_info,
+        'agent_info': agent_info(ticket),
         'agent_typing': agent_typing,
     })
 
 
+def _message_cursor(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _stream_viewer(request, ticket_id):
+    """(ticket, as_agent) for a stream of ``ticket_id``; as_agent is None when the request may not read it."""
+    ticket = SupportTicket.objects.get(id=ticket_id)
+    if _verify_ticket_ownership(request, ticket):
+        return ticket, False
+    if is_management_staff(request.user):
+        return ticket, True
+    return ticket, None
+
+
+async def api_support_messages_stream(request, ticket_id):
+    """
+    GET /api/support/tickets/{id}/stream/?after_id=MESSAGE_ID
+    Server-Sent Events: đẩy tin nhắn mới và trạng thái ticket ngay khi có,
+    thay cho việc poll api_support_messages_get. Khách (chủ ticket) không
+    nhận internal notes; nhân viên quản lý nhận tất cả.
+
+    Kết nối chỉ đăng ký kênh ``ticket:<id>`` của notification bus và chờ, không
+    truy vấn DB khi không có gì mới (xem support_stream.py). Mỗi event mang
+    ``id:`` là id tin nhắn mới nhất đã gửi; EventSource kết nối lại với
+    Last-Event-ID và nhận các tin nhắn bị lỡ.
+    """
+    try:
+        ticket, as_agent = await sync_to_async(_stream_viewer)(request, ticket_id)
+    except SupportTicket.DoesNotExist:
+        return JsonResponse({'error': 'Ticket không tồn tại'}, status=404)
+    if as_agent is None:
+        return JsonResponse({'error': 'Không có quyền truy cập'}, status=403)
+
+    cursor = _message_cursor(request.headers.get('Last-Event-ID') or request.GET.get('after_id'))
+    feed = TicketFeed(ticket.id, as_agent, cursor)
+    keepalive = getattr(settings, 'NOTIFICATION_SSE_KEEPALIVE', 25)
+    channel = ticket_channel(ticket.id)
+    bus = get_bus()
+
+    # Subscribe before reading the missed messages so nothing is lost in between.
+    if isinstance(request, ASGIRequest):
+        subscription = bus.subscribe_async(channel)
+        next_event = sync_to_async(feed.next_event)
+
+        async def event_stream():
+            try:
+                yield "retry: 3000\n\n"
+                yield first
+                while True:
+                    update = await subscription.get(timeout=keepalive)
+                    if update is None:
+                        yield ": keepalive\n\n"
+                        continue
+                    event = await next_event(update)
+                    if event is not None:
+                        yield event
+            finally:
+                subscription.close()
+    else:
+        subscription = bus.subscribe(channel)
+
+        def event_stream():
+            try:
+                yield "retry: 3000\n\n"
+                yield first
+                while True:
+                    update = subscription.get(timeout=keepalive)
+                    if update is None:
+                        yield ": keepalive\n\n"
+                        continue
+                    event = feed.next_event(update)
+                    if event is not None:
+                        yield event
+            finally:
+                subscription.close()
+
+    try:
+        first = await sync_to_async(feed.first_event)()
+    except Exception:
+        subscription.close()
+        raise
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @csrf_exempt
 def api_support_messages_send(request, ticket_id):
     """
@@ -581,7 +646,7 @@ def admin_support_dashboard(request):
             selected_ticket = SupportTicket.objects.select_related(
                 'user', 'assigned_to', 'user__profile'
             ).get(id=selected_id)
-            ticket_messages = selected_ticket.messages.prefetch_related('attachments').order_by('created_at')
+            ticket_messages = selected_ticket.messages.select_related('sender').prefetch_related('attachments').order_by('created_at')
             quick_replies = SupportQuickReply.objects.filter(is_active=True).order_by('category', 'order')
             if selected_ticket.user:
                 customer_orders = selected_ticket.user.orders.order_by('-created_at')[:5]
@@ -611,6 +676,7 @@ def admin_support_dashboard(request):
         'search_q': search_q,
         'categories': SupportTicket.CATEGORY_CHOICES,
         'priority_choices': SupportTicket.PRIORITY_CHOICES,
+        'agents': presence.agents_last_seen(),
     }
     return render(request, 'admin/support/dashboard.html', context)
 
@@ -628,7 +694,7 @@ def admin_support_ticket_detail(request, ticket_id):
     )
     
     # Get ticket messages
-    ticket_messages = selected_ticket.messages.prefetch_related('attachments').order_by('created_at')
+    ticket_messages = selected_ticket.messages.select_related('sender').prefetch_related('attachments').order_by('created_at')
     
     # Get quick replies
     quick_replies = SupportQuickReply.objects.filter(is_active=True).order_by('category', 'order')
@@ -669,6 +735,7 @@ def admin_support_ticket_detail(request, ticket_id):
         'status_filter': status_filter,
         'categories': SupportTicket.CATEGORY_CHOICES,
         'priority_choices': SupportTicket.PRIORITY_CHOICES,
+        'agents': presence.agents_last_seen(),
     }
     return render(request, 'admin/support/dashboard.html', context)
 
@@ -78,6 +78,7 @@ SITE_ID = 1
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'MyApp.middleware.QueryInspectorMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,6 +87,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'MyApp.middleware.AuditLogContextMiddleware',
+    'MyApp.middleware.StaffPresenceMiddleware',
 ]
 
 ROOT_URLCONF = 'MyProject.urls'
@@ -197,6 +199,8 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.environ.get('EMAIL_HOST_USER', 'noreply@teazen.com')
+# Seconds before an SMTP connect/send gives up, so a slow mail server cannot hang a worker (or a request in sync mode).
+EMAIL_TIMEOUT = int(os.environ.get('EMAIL_TIMEOUT', '10'))
 
 # ==================== DJANGO Q2 & AUDIT LOG ====================
 Q_CLUSTER = {
@@ -209,10 +213,71 @@ Q_CLUSTER = {
     'queue_limit': 500,
     'cpu_affinity': 1,
     'label': 'Django Q',
-    'sync': True,  # Execute tasks synchronously without needing a worker
+    # Sync mode runs tasks inline (after the commit) without a worker: the default only with DEBUG.
+    # Production (DJANGO_DEBUG=False) queues order emails, staff notifications and audit batches
+    # for `manage.py qcluster`, so requests never wait on SMTP.
+    'sync': os.environ.get('DJANGO_Q_SYNC', str(DEBUG)).lower() == 'true',
     'orm': 'default'  # Using Django ORM as broker
 }
 
 # 32-byte URL-safe base64-encoded key for Fernet (cryptography)
 AUDIT_LOG_ENCRYPTION_KEY = os.environ.get('AUDIT_LOG_ENCRYPTION_KEY', 'vOa3Q7yE-xL1o9D9uI6V-S8gE1W6eG5F-Y1E2nO9Z2c=')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
+# One hash chain per resource type instead of a single global chain (less lock contention between writers)
+AUDIT_LOG_SHARDED_CHAINS = os.environ.get('AUDIT_LOG_SHARDED_CHAINS', 'False').lower() == 'true'
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# ==================== REAL-TIME NOTIFICATIONS (SSE) ====================
+# Empty = in-process bus (single worker). Set to a Redis URL, e.g.
+# redis://localhost:6379/0, when running several ASGI workers (needs `pip install redis`).
+NOTIFICATION_BUS_URL = os.environ.get('NOTIFICATION_BUS_URL', '')
+# Seconds between SSE keep-alive comments on idle connections
+NOTIFICATION_SSE_KEEPALIVE = 25
+# ==================== SUPPORT STAFF PRESENCE ====================
+# Where staff heartbeats are kept: 'cache', 'db', or empty = 'cache' unless the
+# default cache is local-memory (not shared between worker processes), then 'db'.
+STAFF_PRESENCE_STORE = os.environ.get('STAFF_PRESENCE_STORE', '')
+# An agent counts as online for this many seconds after their last request
+STAFF_PRESENCE_TIMEOUT = 300
+# ==================== STOREFRONT CATALOG CACHE ====================
+# Where the catalog version of the cached home page is kept: 'cache', 'db', or
+# empty = 'cache' unless the default cache is local-memory, then 'db' (one query
+# per request, so a catalog edit reaches every worker process).
+CATALOG_VERSION_STORE = os.environ.get('CATALOG_VERSION_STORE', '')
+# ==================== INVOICE / QR RENDER CACHE ====================
+# Rendered invoice PDFs and payment QR images, under MEDIA_ROOT
+RENDER_CACHE_DIR = 'render_cache'
+# Least recently used renderings are deleted above this size
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# ==================== PRODUCT VIEW COUNTER ====================
+# Where product page views are counted before being added to Product.views_count:
+# 'cache', 'memory', or empty = 'cache' unless the default cache is local-memory.
+# With 'cache', run `manage.py flush_view_counts` every few minutes (cron or django-q schedule).
+VIEW_COUNT_STORE = os.environ.get('VIEW_COUNT_STORE', '')
+# 'memory' store: seconds between two flushes of a worker process's counts
+VIEW_COUNT_FLUSH_INTERVAL = 30
+# ==================== QUERY BUDGETS / N+1 DETECTION ====================
+# Fraction of requests whose SQL is recorded and summarized in the 'MyApp.query_inspector'
+# log (0 = middleware off, 1 = every request). See MyApp/query_inspector.py.
+QUERY_INSPECTOR_SAMPLE_RATE = float(os.environ.get('QUERY_INSPECTOR_SAMPLE_RATE', '0'))
+# Raise QueryBudgetExceeded instead of logging (tests); records every request
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'False').lower() == 'true'
+# The same normalized query from the same line this many times in one request = N+1
+QUERY_N_PLUS_ONE_THRESHOLD = 5
+# Max queries per URL name; '*' applies to the URLs not listed
+QUERY_BUDGETS = {
+    '*': 60,
+    'index': 12,
+    'product_list_public': 12,
+    'product_detail': 20,
+    'cart': 10,
+    'order_list': 12,
+    'order_detail': 15,
+    'api_chat_history': 6,
+    'admin_order_list': 10,
+    'admin_order_detail_manage': 25,
+    'admin_inventory_ledger': 15,
+    'admin_support_dashboard': 15,
+    'api_support_messages_get': 8,
+    'admin_support_ticket_detail': 20,
+    'message_inbox': 8,
+    'message_detail': 12,
+}